@@ -11,11 +11,20 @@
 #   pandas: pandas dataframes provide a simple and easy way to read the input data and build the new EJScreen tables
 #   numpy: numpy functions are used to generate percentiles for the lookup tables
 #   col_names: a python file containing lists that together comprise all of the columns in teh EJScreen dataset
-#   warnings: used to disable 2 specific warning messages that would otherwise be output to the console hundreds of times. Warnings being ignored are:
-#       1. Letting us know when an entire column in percentile calculationis NA. 
-#       2. Pandas making suggestions on how to accomplish a certain task.
+#   warnings: used to disable a warning message that would otherwise be output to the console hundreds of times, 
+#       letting us know when an entire column in percentile calculationis NA. 
 #   math: Used to determine if a value is not a number. 
 #   os.path: Used to get directory when exporting spatial dataset
+#   tempfile: Used to hold the memory mapped columns shared with worker processes
+#   concurrent.futures: Used to calculate percentiles on multiple processes when `workers` is greater than 1, and to
+#       write the outputs at the same time when `output_workers` is greater than 1
+#   shutil: Used to join the csv segments formatted by worker processes
+#   time: Used to time each column and state for the run report
+#   hashlib: Used to fingerprint input columns for the percentile cache
+#   struct/zipfile/ast: Used to find the arrays of a lookup artifact or dataset store so they can be memory mapped
+#   run_report: Records the time and memory of each stage of a run in place of progress messages
+#   stage_checkpoints: Saves the output of each stage so a failed run can resume from the last completed stage
+#   geopackage: Reads and writes GeoPackages without ArcGIS Pro, used when the output feature class is a .gpkg
 #   arcgis: required to import feature class as a pandas dataframe. This package is only imported if you attempt to export the dataset to an ESRI feature class.
 #   arcpy: Batch Update Field tool is used to set field order, datatypes, and aliases of final feature class. This package is only imported if you attempt to export the dataset to an ESRI feature class.
 #
@@ -28,74 +37,125 @@ import col_names
 import warnings
 import math
 import os.path
+import tempfile
+import time
+import hashlib
+import struct
+import zipfile
+import ast
+import shutil
+import run_report
+import stage_checkpoints
+import geopackage
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 #import arcpy
 #from arcgis import GeoAccessor, GeoSeriesAccessor
 
+#version of the lookup artifact layout written by saveLookupArtifact. Increase when the layout changes
+lookup_artifact_version = 1
+
+#version of the dataset store layout written by saveDatasetStore. Increase when the layout changes
+dataset_store_version = 1
+
+#stages of ejscreen_cal and ejscreenState_cal whose output is checkpointed, in the order they run
+checkpoint_stages = ["indicator_percentiles", "calIndexes", "index_percentiles", "calBinTxt", "calExceedCounts"]
+
+#rows of each csv segment formatted by a worker process when `output_workers` is greater than 1
+csv_segment_rows = 50000
+
+#version of the tract rollup. Increase when rollupTracts changes, so tract checkpoints of an earlier rollup are not resumed
+tract_rollup_version = 3
+
+#version of the percentile cache. Increase when percentiles are calculated differently, so old cache entries are not used
+column_cache_version = 1
+
+#preview mode: rows per group of the validation sample used to measure the error of preview percentiles, and the
+#seed of the random samples, so a preview run gives the same results every time
+preview_validation_rows = 5000
+preview_seed = 0
+
 #-------------------------------------------------------------------------------
 # Name:        ejscreen_cal
 # Purpose:     Build EJScreen dataset using US based percentiles.
 # 
 # Parameters:
 #   input_csv - path to csv file containing EJScreen indicator data and ID
-#   output_csv - path to output csv that will contain EJScreen dataset.
-#   output_lookup - path to output xlsx that will contain the percentile lookup table
+#   output_csv - path, or list of paths, to output file(s) that will contain EJScreen dataset. The format of each 
+#                file is set by its extension: .csv, .parquet, .feather/.arrow (Arrow IPC) or .npz (dataset store, 
+#                see saveDatasetStore)
+#   output_lookup - path to output file that will contain the percentile lookup table. The format is set by the extension: 
+#                   .xlsx, .csv, .parquet or .npz (lookup artifact)
 #   to_featureclass - (True/False) whether or not the EJScreen dataset will be joined to geometry and output to a file geodatabase
 #   geom_source = path to featureclass containing geometry that will be joined to the EJScreen dataset. 
-#   output_fc = path to output EJScrfeen featureclass 
+#   output_fc = path to output EJScrfeen featureclass. A path in a GeoPackage (e.g. "data/EJSCREEN.gpkg/EJSCREEN_Full") 
+#               is written without ArcGIS Pro, see exportGeoPackage
 #   schema = path to csv file containing field update schema. Format can be found here: https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/batch-update-fields.htm
+#   workers = number of processes used to calculate percentiles. Results are identical for any number of workers
+#   csv_engine = parser used to read input_csv. "pyarrow" reads with multiple threads (requires the pyarrow package)
+#   indicator_dtype = data type of the `col_names.data_names` columns, "float64" or "float32"
+#   output_compression = compression codec of Parquet/Feather output, e.g. "snappy", "zstd", "lz4". None uses the format default
+#   row_group_size = number of rows per Parquet row group / Feather record batch. None uses the format default
+#   output_artifact = optional path to output .npz file that will contain the lookup tables in binary form. It can be used by ejscreenScore_cal
+#   report_path = optional path to output JSON run report with the time and memory of each stage
+#   report = optional run_report.RunReport used to record the stages, e.g. to turn on per-column detail or profile a stage.
+#            A default RunReport is used when None
+#   cache_dir = optional directory of cached percentiles. Percentiles whose inputs have not changed since a previous
+#               run with the same cache_dir are read from it instead of being calculated again
+#   checkpoint_dir = optional directory where the output of each stage is saved (requires the pyarrow package)
+#   resume = (True/False) whether to continue from the checkpoints in checkpoint_dir of an earlier run with the same
+#            input and col_names, at the first stage that has no valid checkpoint
+#   dtype_schema = optional path to a schema csv (e.g. ejscreen_schema.csv). Each column is stored in the most compact
+#                  type its schema field type allows as soon as it is created. See applySchemaTypes
+#   preview_rows = when greater than 0, a faster approximate run for trying out indicators: the lookup table of each
+#                  column (of each state at the state level) with more rows than this is found from a random sample 
+#                  of preview_rows of its rows. Every row is scored against it, and the largest difference from the 
+#                  exact percentiles on a validation sample is printed for each column. The cache is not used
+#   output_tract_csv - optional path, or list of paths, to output file(s) that will contain the same dataset for tracts.
+#                      The block groups of the input are rolled up to tracts (see rollupTracts) in the same run and
+#                      ranked against other tracts
+#   output_tract_lookup - optional path to output file that will contain the tract percentile lookup table
+#   output_tract_artifact - optional path to output .npz file that will contain the tract lookup tables in binary form
+#   output_workers = number of outputs written at the same time. With more than 1, csv datasets are also formatted 
+#                    in segments on as many processes. The output files are identical for any number of output_workers
 #   
 #   col_names.py will need to be up to date for all fields to be processed correctly. 
 #-------------------------------------------------------------------------------
 
-def ejscreen_cal(input_csv, output_csv, output_lookup, to_featureclass = False, geom_source = "", output_fc = "", schema = ""):
+def ejscreen_cal(input_csv, output_csv, output_lookup, to_featureclass = False, geom_source = "", output_fc = "", schema = "", workers = 1, csv_engine = "c", indicator_dtype = "float64", output_compression = None, row_group_size = None, output_artifact = "", report_path = "", report = None, cache_dir = "", checkpoint_dir = "", resume = False, dtype_schema = "", preview_rows = 0, output_tract_csv = "", output_tract_lookup = "", output_tract_artifact = "", output_workers = 1):
 
-    #eliminates warnings that have no effect on results
-    warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning) 
+    #eliminates a warning that has no effect on results
     warnings.filterwarnings("ignore", message="All-NaN slice encountered")
 
-    #import dataset
-    source_df = pd.read_csv(input_csv, usecols=(col_names.info_names + col_names.data_names), dtype= {"ID": str})
-
-    #import extra fields to add back at end
-    if len(col_names.extra_cols) > 0:
-        extra_df = pd.read_csv(input_csv, usecols=col_names.extra_cols) 
-
-    #calculate percentiles for socioeconomic and pollution & sources
-    indicator_pctiles, indicator_lookup = percentileCal(source_df, output = False) 
-
-    #calculate raw EJ index and Supplemental index values
-    indicator_indexes = calIndexes(indicator_pctiles) 
-
-    #calculate percentiles for EJ & Supplemental indexes
-    ejscreen_pctiles, index_lookup = percentileCal(indicator_indexes, output=False, percentile_column_names = col_names.index_names) 
-    
-    #calcualte B_ and T_ fields
-    ejscreen_full = calBinTxt(ejscreen_pctiles, output=False) 
-
-    #add extra columns back in
-    if len(col_names.extra_cols) > 0:
-        ejscreen_full = pd.concat([ejscreen_full, extra_df], axis=1) 
+    #records the time and memory of each stage
+    if report is None:
+        report = run_report.RunReport()
+    report.info.update({"function": "ejscreen_cal", "input": input_csv, "workers": workers})
+    if preview_rows > 0:
+        report.info["preview_rows"] = preview_rows
+
+    #calculate the percentiles, indexes, B_ and T_ fields, and exceedance counts
+    tracts = output_tract_csv != ""
+    checkpoints = getCheckpoints(checkpoint_dir, resume, input_csv, "national", indicator_dtype, dtype_schema, preview_rows, tracts)
+    datasets = buildDataset(input_csv, percentileCal, workers, csv_engine, indicator_dtype, report, cache_dir, checkpoints, readSchemaTypes(dtype_schema), preview_rows, tracts)
+    ejscreen_full, ejscreen_lookup = datasets[0]
+    row_count = len(ejscreen_full)
+        
+    #the dataset, lookup table and spatial export are written at the same time when output_workers is greater than 1
+    writers = [("write_dataset", row_count, lambda pool: writeDataset(ejscreen_full, output_csv, output_compression, row_group_size, pool), True),
+               ("write_lookup", None, lambda pool: writeLookupFiles(ejscreen_lookup, output_lookup, output_artifact), True)]
 
-    index_names_2f = [i for i in col_names.index_names if i.startswith('P_D2_')]
-    index_names_5f = [i for i in col_names.index_names if i.startswith('P_D5_')]
+    if tracts:
+        tract_full, tract_lookup = datasets[1]
+        writers += [("write_tract_dataset", len(tract_full), lambda pool: writeDataset(tract_full, output_tract_csv, output_compression, row_group_size, pool), True),
+                    ("write_tract_lookup", None, lambda pool: writeLookupFiles(tract_lookup, output_tract_lookup, output_tract_artifact), True)]
 
-    #count how many 2 factor EJ Indexes exceed the 80th percentile
-    ejscreen_full['EXCEED_COUNT_80'] = ejscreen_full[index_names_2f].ge(80).sum(axis=1) 
-    
-    #count how many 5 factor EJ Indexes exceed the 80th percentile
-    ejscreen_full['EXCEED_COUNT_80_SUPP'] = ejscreen_full[index_names_5f].ge(80).sum(axis=1) 
-    
-    #combine the two lookup tables
-    ejscreen_lookup = pd.concat([indicator_lookup, index_lookup], axis=1)
+    if to_featureclass == True:
+        writers.append(("exportSpatial", row_count, lambda pool: exportSpatial(geom_source, ejscreen_full, output_fc, schema, report = report), geopackage.isGeoPackage(output_fc)))
 
-    #put columns in correct order
-    ejscreen_full = ejscreen_full[col_names.cols_all] 
-        
-    ejscreen_full.to_csv(output_csv)
-    ejscreen_lookup.to_excel(output_lookup)
+    writeOutputs(writers, report, output_workers)
 
-    if to_featureclass == True:
-        exportSpatial(geom_source, ejscreen_full, output_fc, schema)
+    if report_path != "":
+        report.write(report_path)
 
 
 #-------------------------------------------------------------------------------
@@ -104,242 +164,1977 @@ def ejscreen_cal(input_csv, output_csv, output_lookup, to_featureclass = False,
 # 
 # Parameters:
 #   input_csv - path to csv file containing EJScreen indicator data and ID
-#   output_csv - path to output csv that will contain EJScreen dataset.
-#   output_lookup - path to output xlsx that will contain the percentile lookup table
+#   output_csv - path, or list of paths, to output file(s) that will contain EJScreen dataset. The format of each 
+#                file is set by its extension: .csv, .parquet, .feather/.arrow (Arrow IPC) or .npz (dataset store, 
+#                see saveDatasetStore)
+#   output_lookup - path to output file that will contain the percentile lookup table. The format is set by the extension: 
+#                   .xlsx, .csv, .parquet or .npz (lookup artifact)
 #   to_featureclass - (True/False) whether or not the EJScreen dataset will be joined to geometry and output to a file geodatabase
 #   geom_source = path to featureclass containing geometry that will be joined to the EJScreen dataset. 
-#   output_fc = path to output EJScrfeen featureclass 
+#   output_fc = path to output EJScrfeen featureclass. A path in a GeoPackage (e.g. "data/EJSCREEN.gpkg/EJSCREEN_Full") 
+#               is written without ArcGIS Pro, see exportGeoPackage
 #   schema = path to csv file containing field update schema. Format can be found here: https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/batch-update-fields.htm
+#   workers = number of processes used to calculate percentiles. Results are identical for any number of workers
+#   csv_engine = parser used to read input_csv. "pyarrow" reads with multiple threads (requires the pyarrow package)
+#   indicator_dtype = data type of the `col_names.data_names` columns, "float64" or "float32"
+#   output_compression = compression codec of Parquet/Feather output, e.g. "snappy", "zstd", "lz4". None uses the format default
+#   row_group_size = number of rows per Parquet row group / Feather record batch. None uses the format default
+#   output_artifact = optional path to output .npz file that will contain the lookup tables in binary form. It can be used by ejscreenScore_cal
+#   report_path = optional path to output JSON run report with the time and memory of each stage
+#   report = optional run_report.RunReport used to record the stages, e.g. to turn on per-column detail or profile a stage.
+#            A default RunReport is used when None
+#   cache_dir = optional directory of cached percentiles. Percentiles whose inputs have not changed since a previous
+#               run with the same cache_dir are read from it instead of being calculated again
+#   checkpoint_dir = optional directory where the output of each stage is saved (requires the pyarrow package)
+#   resume = (True/False) whether to continue from the checkpoints in checkpoint_dir of an earlier run with the same
+#            input and col_names, at the first stage that has no valid checkpoint
+#   dtype_schema = optional path to a schema csv (e.g. ejscreen_schema.csv). Each column is stored in the most compact
+#                  type its schema field type allows as soon as it is created. See applySchemaTypes
+#   preview_rows = when greater than 0, a faster approximate run for trying out indicators: the lookup table of each
+#                  column (of each state at the state level) with more rows than this is found from a random sample 
+#                  of preview_rows of its rows. Every row is scored against it, and the largest difference from the 
+#                  exact percentiles on a validation sample is printed for each column. The cache is not used
+#   output_tract_csv - optional path, or list of paths, to output file(s) that will contain the same dataset for tracts.
+#                      The block groups of the input are rolled up to tracts (see rollupTracts) in the same run and
+#                      ranked against other tracts
+#   output_tract_lookup - optional path to output file that will contain the tract percentile lookup table
+#   output_tract_artifact - optional path to output .npz file that will contain the tract lookup tables in binary form
+#   output_workers = number of outputs written at the same time. With more than 1, csv datasets are also formatted 
+#                    in segments on as many processes. The output files are identical for any number of output_workers
 #   
 #   col_names.py will need to be up to date for all fields to be processed correctly. 
 #-------------------------------------------------------------------------------
 
 
-def ejscreenState_cal(input_csv, output_csv, output_lookup, to_featureclass = False, geom_source = "", output_fc = "", schema = ""):
+def ejscreenState_cal(input_csv, output_csv, output_lookup, to_featureclass = False, geom_source = "", output_fc = "", schema = "", workers = 1, csv_engine = "c", indicator_dtype = "float64", output_compression = None, row_group_size = None, output_artifact = "", report_path = "", report = None, cache_dir = "", checkpoint_dir = "", resume = False, dtype_schema = "", preview_rows = 0, output_tract_csv = "", output_tract_lookup = "", output_tract_artifact = "", output_workers = 1):
      
-    #eliminates a warning that has no effect on results
-    warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning) 
     #eliminates a warning that has no effect on results
     warnings.filterwarnings("ignore", message="All-NaN slice encountered")
 
     #these imports are done here to allow for users without an ArcGIS Pro installation to still generate the csv dataset
-    if to_featureclass == True:
+    if to_featureclass == True and not geopackage.isGeoPackage(output_fc):
         import arcpy
         from arcgis import GeoAccessor, GeoSeriesAccessor
 
-    #import dataset
-    source_df = pd.read_csv(input_csv, usecols=(col_names.info_names + col_names.data_names), dtype= {"ID": str})  
+    #records the time and memory of each stage
+    if report is None:
+        report = run_report.RunReport()
+    report.info.update({"function": "ejscreenState_cal", "input": input_csv, "workers": workers})
+    if preview_rows > 0:
+        report.info["preview_rows"] = preview_rows
+
+    #calculate the state percentiles, indexes, B_ and T_ fields, and exceedance counts
+    tracts = output_tract_csv != ""
+    checkpoints = getCheckpoints(checkpoint_dir, resume, input_csv, "state", indicator_dtype, dtype_schema, preview_rows, tracts)
+    datasets = buildDataset(input_csv, percentileCalState, workers, csv_engine, indicator_dtype, report, cache_dir, checkpoints, readSchemaTypes(dtype_schema), preview_rows, tracts)
+    ejscreen_full, ejscreen_lookup = datasets[0]
+    row_count = len(ejscreen_full)
+        
+    #the dataset, lookup table and spatial export are written at the same time when output_workers is greater than 1
+    writers = [("write_dataset", row_count, lambda pool: writeDataset(ejscreen_full, output_csv, output_compression, row_group_size, pool), True),
+               ("write_lookup", None, lambda pool: writeLookupFiles(ejscreen_lookup, output_lookup, output_artifact), True)]
 
-    #import extra fields to add back at end
-    if len(col_names.extra_cols) > 0:
-        extra_df = pd.read_csv(input_csv, usecols=col_names.extra_cols) 
+    if tracts:
+        tract_full, tract_lookup = datasets[1]
+        writers += [("write_tract_dataset", len(tract_full), lambda pool: writeDataset(tract_full, output_tract_csv, output_compression, row_group_size, pool), True),
+                    ("write_tract_lookup", None, lambda pool: writeLookupFiles(tract_lookup, output_tract_lookup, output_tract_artifact), True)]
 
-    #calculate percentiles for socioeconomic and pollution & sources
-    indicator_pctiles, indicator_lookup = percentileCalState(source_df, output = False) 
+    if to_featureclass == True:
+        writers.append(("exportSpatial", row_count, lambda pool: exportSpatial(geom_source, ejscreen_full, output_fc, schema, report = report), geopackage.isGeoPackage(output_fc)))
+
+    writeOutputs(writers, report, output_workers)
+
+    if report_path != "":
+        report.write(report_path)
+
+#-------------------------------------------------------------------------------
+# Name:        buildDataset
+# Purpose:     Internal function that runs the stages shared by ejscreen_cal and ejscreenState_cal, from reading the 
+#              input to counting the indexes above the 80th percentile. When `checkpoints` has the stages of an 
+#              earlier run, the stages it completed are skipped and the run continues from its latest checkpoint.
+#              Each checkpoint holds everything the stages after it need, so only one is loaded. With `tracts`, the
+#              block groups are also rolled up to tracts after they are read, and every stage after that runs for 
+#              both geographies.
+# 
+# Parameters:
+#   input_csv - path to csv file containing EJScreen indicator data and ID
+#   percentile_function - percentileCal for national percentiles or percentileCalState for state percentiles
+#   workers, csv_engine, indicator_dtype, report, cache_dir - see ejscreen_cal
+#   checkpoints - stage_checkpoints.StageCheckpoints of the run
+#   schema_types - optional dictionary returned by readSchemaTypes. The columns each stage adds are stored in 
+#                  compact types. None keeps the default types
+#   preview_rows - rows sampled for the lookup tables in preview mode, or 0 for exact percentiles. See ejscreen_cal
+#   tracts - (True/False) whether to also build the tract dataset, see rollupTracts
+#
+# Returns:
+#   a list of (ejscreen_full, ejscreen_lookup) for the block groups, and then for the tracts with `tracts`:
+#   ejscreen_full - data frame of the `col_names.cols_all` columns
+#   ejscreen_lookup - lookup table of the indicators and indexes
+#-------------------------------------------------------------------------------
+
+def buildDataset(input_csv, percentile_function, workers, csv_engine, indicator_dtype, report, cache_dir, checkpoints, schema_types = None, preview_rows = 0, tracts = False):
+
+    resume_stage, saved = checkpoints.loadLatest(checkpoint_stages)
+    completed = checkpoint_stages[:checkpoint_stages.index(resume_stage) + 1] if resume_stage is not None else []
+    if resume_stage is not None:
+        report.info["resumed_after"] = resume_stage
+
+    #the data frame the latest stage produced for each geography, and what later stages need from before it.
+    #block group frames are saved under their own names and tract frames with a "tract_" prefix
+    prefixes = ["", "tract_"] if tracts else [""]
+    datasets = [{"data": saved.get(prefix + "data"), "extra": saved.get(prefix + "extra"), 
+                 "indicator_lookup": setLookupIndex(saved.get(prefix + "indicator_lookup")), 
+                 "index_lookup": setLookupIndex(saved.get(prefix + "index_lookup"))} for prefix in prefixes]
+
+    if "indicator_percentiles" not in completed:
+
+        #import dataset and the extra fields to add back at end in a single read
+        with report.stage("ingest") as stage:
+            source_df, extra_df = readInput(input_csv, csv_engine, indicator_dtype)
+            source_df = applySchemaTypes(source_df, schema_types)
+            extra_df = applySchemaTypes(extra_df, schema_types)
+            stage["rows"] = len(source_df)
+        datasets[0]["data"], datasets[0]["extra"] = source_df, extra_df
+
+        #roll the block groups up to tracts from the same read
+        if tracts:
+            with report.stage("rollup_tracts", len(source_df)):
+                tract_df, tract_extra_df = rollupTracts(source_df, extra_df)
+                datasets[1]["data"] = applySchemaTypes(tract_df, schema_types)
+                datasets[1]["extra"] = applySchemaTypes(tract_extra_df, schema_types)
+
+        #calculate percentiles for socioeconomic and pollution & sources
+        with report.stage("indicator_percentiles", getRowCount(datasets)):
+            for dataset in datasets:
+                source_df = dataset["data"]
+                dataset["data"], dataset["indicator_lookup"] = percentile_function(source_df, output = False, workers = workers, report = report, cache_dir = cache_dir, preview_rows = preview_rows) 
+                dataset["data"] = applySchemaTypes(dataset["data"], schema_types, source_df.columns)
+            saveCheckpoint(checkpoints, "indicator_percentiles", datasets, prefixes)
+
+    row_count = getRowCount(datasets)
 
     #calculate raw EJ index and Supplemental index values
-    indicator_indexes = calIndexes(indicator_pctiles) 
+    if "calIndexes" not in completed:
+        with report.stage("calIndexes", row_count):
+            for dataset in datasets:
+                dataset["data"] = applySchemaTypes(calIndexes(dataset["data"]), schema_types, dataset["data"].columns)
+            saveCheckpoint(checkpoints, "calIndexes", datasets, prefixes)
 
     #calculate percentiles for EJ & Supplemental indexes
-    ejscreen_pctiles, index_lookup = percentileCalState(indicator_indexes, output=False, percentile_column_names = col_names.index_names) 
+    if "index_percentiles" not in completed:
+        with report.stage("index_percentiles", row_count):
+            for dataset in datasets:
+                pctiles_df, dataset["index_lookup"] = percentile_function(dataset["data"], output=False, percentile_column_names = col_names.index_names, workers = workers, report = report, cache_dir = cache_dir, preview_rows = preview_rows) 
+                dataset["data"] = applySchemaTypes(pctiles_df, schema_types, dataset["data"].columns)
+            saveCheckpoint(checkpoints, "index_percentiles", datasets, prefixes)
     
     #calcualte B_ and T_ fields
-    ejscreen_full = calBinTxt(ejscreen_pctiles, output=False) 
+    if "calBinTxt" not in completed:
+        with report.stage("calBinTxt", row_count):
+            for dataset in datasets:
+                dataset["data"] = applySchemaTypes(calBinTxt(dataset["data"], output=False, text_categories = (schema_types is not None)), schema_types, dataset["data"].columns)
+            saveCheckpoint(checkpoints, "calBinTxt", datasets, prefixes)
 
-    #add extra columns back in
-    if len(col_names.extra_cols) > 0:
-        ejscreen_full = pd.concat([ejscreen_full, extra_df], axis=1) 
+    if "calExceedCounts" not in completed:
+        with report.stage("calExceedCounts", row_count):
+            for dataset, prefix in zip(datasets, prefixes):
+                ejscreen_df = dataset["data"]
 
-    #get 2 factor percentile columns
-    index_names_2f = [i for i in col_names.index_names if i.startswith('P_D2_')] 
-    
-    #get 5 factor percentiles columns
-    index_names_5f = [i for i in col_names.index_names if i.startswith('P_D5_')] 
+                #add extra columns back in
+                if len(col_names.extra_cols) > 0:
+                    ejscreen_df = joinColumns(ejscreen_df, dataset["extra"]) 
 
-    #count how many 2 factor EJ Indexes exceed the 80th percentile
-    ejscreen_full['EXCEED_COUNT_80'] = ejscreen_full[index_names_2f].ge(80).sum(axis=1) 
-    
-    # count how many 5 factor EJ Indexes exceed the 80th percentile
-    ejscreen_full['EXCEED_COUNT_80_SUPP'] = ejscreen_full[index_names_5f].ge(80).sum(axis=1) 
+                #count how many EJ Indexes exceed the 80th percentile
+                ejscreen_df = applySchemaTypes(calExceedCounts(ejscreen_df), schema_types, ejscreen_df.columns)
+                if prefix == "tract_":
+                    ejscreen_df = applySchemaTypes(calTractExceedCounts(ejscreen_df), schema_types, ejscreen_df.columns)
 
-    
-    #combines the indicators lookup with the indexes lookup
-    ejscreen_lookup = pd.concat([indicator_lookup, index_lookup.drop(["PCTILE", "REGION"], axis = 1)], axis=1) 
+                #put columns in correct order
+                dataset["data"], dataset["extra"] = selectColumns(ejscreen_df, col_names.cols_all), None
+            saveCheckpoint(checkpoints, "calExceedCounts", datasets, prefixes)
+
+    #combine the two lookup tables of each geography
+    return([(dataset["data"], combineLookups(dataset["indicator_lookup"], dataset["index_lookup"])) for dataset in datasets])
 
-    #removes the percentile column
-    ejscreen_lookup = ejscreen_lookup.drop(['PCTILE'], axis = 1) 
+#-------------------------------------------------------------------------------
+# Name:        rollupTracts
+# Purpose:     Internal function that rolls the block groups returned by readInput up to tracts. Block groups are 
+#              grouped by the first `col_names.tract_id_length` characters of their ID, the `col_names.tract_sum_names`
+#              columns are added together, and every other `col_names.data_names` column is averaged weighted by the
+#              population it describes (see `col_names.tract_weight_names`), leaving out block groups where it is NA.
+#              Where that population is 0, e.g. for the environmental indicators of a tract without residents, the 
+#              plain average is used. The demographic indexes in `col_names.tract_index_components` are then rebuilt
+#              as the average of their rolled up components, since the components have different population bases.
+#              
+#              The `col_names.tract_recalculated_names` columns (the exceedance counts) are left out and recalculated
+#              by buildDataset from the tract percentiles. Every other column, i.e. STATE_NAME, ST_ABBREV, CNTY_NAME,
+#              REGION and any extra column that is not summed, is copied from the first block group of each tract.
+# 
+# Returns:
+#   tract_df - data frame with the columns of source_df, one row per tract in the order tracts first appear
+#   tract_extra_df - data frame with the columns of extra_df
+#-------------------------------------------------------------------------------
 
-    #sets the index as the percentile column
-    ejscreen_lookup.index.name='PCTILE' 
+def rollupTracts(source_df, extra_df):
 
-    #put columns in correct order
-    ejscreen_full = ejscreen_full[col_names.cols_all] 
-    
-    ejscreen_full.to_csv(output_csv)
-    ejscreen_lookup.to_excel(output_lookup)
+    tract_codes, tract_ids = pd.factorize(source_df["ID"].str[:col_names.tract_id_length])
+    tract_count = len(tract_ids)
+    first_rows = np.unique(tract_codes, return_index = True)[1]
 
-    if to_featureclass == True:
-        exportSpatial(geom_source, ejscreen_full, output_fc, schema)
+    def rollup(df):
+        tract_columns = {}
+        for column in df.columns:
+            if column in col_names.tract_recalculated_names:
+                continue
+            elif column == "ID":
+                tract_columns[column] = pd.Series(tract_ids, dtype = df[column].dtype)
+            elif column in col_names.tract_sum_names:
+                tract_columns[column] = df[column].groupby(tract_codes).sum(min_count = 1).reset_index(drop = True)
+            elif column in col_names.data_names:
+                tract_columns[column] = pd.Series(getWeightedMeans(df[column].to_numpy(dtype = float), getWeights(column), tract_codes, tract_count), dtype = df[column].dtype)
+            else:
+                tract_columns[column] = df[column].iloc[first_rows].reset_index(drop = True)
+        return(pd.DataFrame(tract_columns))
+
+    def getWeights(column):
+        weight_column = col_names.tract_weight_names.get(column, "ACSTOTPOP")
+        return(np.nan_to_num(source_df[weight_column].to_numpy(dtype = float)) if weight_column in source_df.columns else np.ones(len(source_df)))
+
+    tract_df = rollup(source_df)
+
+    for index_column, components in col_names.tract_index_components.items():
+        if index_column in tract_df.columns and all(component in tract_df.columns for component in components):
+            component_means = pd.DataFrame({component: tract_df[component].astype(float) for component in components}).mean(axis = 1)
+            tract_df[index_column] = component_means.astype(tract_df[index_column].dtype)
+
+    return(tract_df, rollup(extra_df))
 
 #-------------------------------------------------------------------------------
-# Name:        percentileCal
-# Purpose:     Calculate percentile fields and create lookup table at the national level. 
+# Name:        calTractExceedCounts
+# Purpose:     Internal function that counts how many EJ index (2 factor) and supplemental index (5 factor) percentiles
+#              of each tract are at or above the 80th percentile. rollupTracts leaves out the block group counts, so 
+#              EXCEED_COUNT_80 and EXCEED_COUNT_80_SUP are counted here from the tract P_D2_ and P_D5_ columns.
+# 
+#-------------------------------------------------------------------------------
+
+def calTractExceedCounts(tract_df):
+
+    counts = {}
+    for count_column, prefix in [("EXCEED_COUNT_80", "D2_"), ("EXCEED_COUNT_80_SUP", "D5_")]:
+        counts[count_column] = np.zeros(len(tract_df), dtype = np.int64)
+        for col in ["P_" + name for name in col_names.index_names if name.startswith(prefix)]:
+            counts[count_column] += (tract_df[col].to_numpy(dtype = float) >= 80)
+
+    #EXCEED_COUNT_80 keeps the float type calExceedCounts gives it for block groups
+    counts["EXCEED_COUNT_80"] = counts["EXCEED_COUNT_80"].astype(float)
+
+    return(joinColumns(tract_df, counts))
+
+#-------------------------------------------------------------------------------
+# Name:        getWeightedMeans
+# Purpose:     Internal function that returns the weighted mean of `values` in each group of `codes`, leaving out NA
+#              values. Groups whose weights add up to 0 get the plain mean, and groups with no values get NA.
+# 
+#-------------------------------------------------------------------------------
+
+def getWeightedMeans(values, weights, codes, group_count):
+
+    present = ~np.isnan(values)
+    present_values = np.where(present, values, 0)
+    present_weights = np.where(present, weights, 0)
+
+    weighted_sums = np.bincount(codes, present_values * present_weights, group_count)
+    weight_sums = np.bincount(codes, present_weights, group_count)
+    plain_sums = np.bincount(codes, present_values, group_count)
+    value_counts = np.bincount(codes, present, group_count)
+
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return(np.where(weight_sums > 0, weighted_sums / weight_sums, plain_sums / value_counts))
+
+#-------------------------------------------------------------------------------
+# Name:        getRowCount
+# Purpose:     Internal function that returns the number of rows of all the geographies of buildDataset.
+# 
+#-------------------------------------------------------------------------------
+
+def getRowCount(datasets):
+
+    return(sum(len(dataset["data"]) for dataset in datasets))
+
+#-------------------------------------------------------------------------------
+# Name:        saveCheckpoint
+# Purpose:     Internal function that saves the output of a stage of buildDataset with what the stages after it need,
+#              for each geography under its prefix. The index of a lookup table mixes numbers and text, which Feather
+#              cannot store, so it is dropped and rebuilt by setLookupIndex when the checkpoint is loaded.
+# 
+#-------------------------------------------------------------------------------
+
+def saveCheckpoint(checkpoints, stage, datasets, prefixes):
+
+    frames = {}
+
+    for dataset, prefix in zip(datasets, prefixes):
+        for name, frame in dataset.items():
+            if frame is not None:
+                frames[prefix + name] = frame.reset_index(drop = True) if name.endswith("lookup") else frame
+
+    checkpoints.save(stage, frames)
+
+#-------------------------------------------------------------------------------
+# Name:        setLookupIndex
+# Purpose:     Internal function that rebuilds the index of a national or state lookup table: the percentiles 0 to
+#              100 and "mean", as text for the national table and once for each state for the state table.
+# 
+#-------------------------------------------------------------------------------
+
+def setLookupIndex(lookup):
+
+    if lookup is None:
+        return(None)
+
+    if "REGION" in lookup.columns:
+        lookup.index = pd.Index((list(range(0, 101)) + ["mean"]) * (len(lookup) // 102), dtype = object)
+    else:
+        lookup.index = pd.Index([str(pct) for pct in range(0, 101)] + ["mean"], dtype = object)
+
+    return(lookup)
+
+#-------------------------------------------------------------------------------
+# Name:        getCheckpoints
+# Purpose:     Internal function that returns the stage_checkpoints.StageCheckpoints of a run. Checkpoints are kept
+#              separately for each input file, percentile level, indicator data type, dtype schema, preview size and
+#              whether tracts are built.
+# 
+#-------------------------------------------------------------------------------
+
+def getCheckpoints(checkpoint_dir, resume, input_csv, level, indicator_dtype, dtype_schema = "", preview_rows = 0, tracts = False):
+
+    if checkpoint_dir == "":
+        return(stage_checkpoints.StageCheckpoints())
+
+    #exact block group runs keep the fingerprint they had before preview mode and tracts existed. Tract runs include
+    #the version of the rollup, so checkpoints of an earlier rollup are not resumed
+    settings = [level, indicator_dtype, dtype_schema] + ([preview_rows] if preview_rows > 0 else []) + (["tracts", tract_rollup_version] if tracts else [])
+
+    return(stage_checkpoints.StageCheckpoints(checkpoint_dir, stage_checkpoints.getFingerprint(input_csv, *settings), resume))
+
+#-------------------------------------------------------------------------------
+# Name:        ejscreenCombined_cal
+# Purpose:     Build both the national and the state EJScreen datasets in one run. The output is identical to running
+#              ejscreen_cal and then ejscreenState_cal, but the input is read once, the indicator values are 
+#              gathered into one array once, and the rows of every state are found once. Both levels share them.
+#              State percentiles read each state's rows through that shared order, so no column is sorted or copied
+#              per level.
 # 
 # Parameters:
-#   ejscreen_data_df - dataframe containing EJScreen raw data. Must at least contain the columns designated by column_names parameter
-#   output_csv_percentiles - path to output csv that will contain EJScreen dataset
-#   output_xlsx_lookup - path to output xlsx that will contain the percentile lookup table
-#   output - (True/False) whether or not data will be written to csv and excel file respectively
-#   column_names = list containing the columns for which percentiles will be calculated
+#   input_csv - path to csv file containing EJScreen indicator data and ID
+#   output_csv - path, or list of paths, to output file(s) that will contain the national EJScreen dataset
+#   output_lookup - path to output file that will contain the national percentile lookup table
+#   output_state_csv - path, or list of paths, to output file(s) that will contain the state EJScreen dataset
+#   output_state_lookup - path to output file that will contain the state percentile lookup table
+#   to_featureclass - (True/False) whether or not both datasets will be joined to geometry and output to a file geodatabase
+#   geom_source = path to featureclass containing geometry that will be joined to the EJScreen datasets. 
+#   output_fc = path to output national EJScreen featureclass 
+#   output_state_fc = path to output state EJScreen featureclass 
+#   schema = path to csv file containing field update schema.
+#   workers = number of processes used to calculate percentiles. Results are identical for any number of workers
+#   csv_engine = parser used to read input_csv. "pyarrow" reads with multiple threads (requires the pyarrow package)
+#   indicator_dtype = data type of the `col_names.data_names` columns, "float64" or "float32"
+#   output_compression = compression codec of Parquet/Feather output. None uses the format default
+#   row_group_size = number of rows per Parquet row group / Feather record batch. None uses the format default
+#   output_artifact = optional path to output .npz file that will contain the national lookup tables in binary form
+#   output_state_artifact = optional path to output .npz file that will contain the state lookup tables in binary form
+#   group_column = column that divides the rows into the groups of the second level. "ST_ABBREV" (default) builds
+#                  the state dataset. Any other grouping column, such as "REGION", builds percentiles for its groups instead
+#   report_path = optional path to output JSON run report with the time and memory of each stage
+#   report = optional run_report.RunReport used to record the stages. A default RunReport is used when None
+#   cache_dir = optional directory of cached percentiles, shared by both levels. See ejscreen_cal
+#   dtype_schema = optional path to a schema csv used to store columns in compact types. See ejscreen_cal
+#   output_workers = number of outputs of each level written at the same time. See ejscreen_cal
+#   
+#   col_names.py will need to be up to date for all fields to be processed correctly. 
 #-------------------------------------------------------------------------------
 
-def percentileCal(ejscreen_data_df, output_csv_percentiles = "", output_xlsx_lookup = "", output = False, percentile_column_names = col_names.data_names): 
+def ejscreenCombined_cal(input_csv, output_csv, output_lookup, output_state_csv, output_state_lookup, to_featureclass = False, geom_source = "", output_fc = "", output_state_fc = "", schema = "", workers = 1, csv_engine = "c", indicator_dtype = "float64", output_compression = None, row_group_size = None, output_artifact = "", output_state_artifact = "", group_column = "ST_ABBREV", report_path = "", report = None, cache_dir = "", dtype_schema = "", output_workers = 1):
 
-     #create list of percentiles
-     pct_list = np.arange(0,101) 
+    #eliminates a warning that has no effect on results
+    warnings.filterwarnings("ignore", message="All-NaN slice encountered")
 
-     #create empty lookup table with percentile column
-     lookup = pd.DataFrame(pct_list, columns=["PCTILE"]) 
+    #records the time and memory of each stage
+    if report is None:
+        report = run_report.RunReport()
+    report.info.update({"function": "ejscreenCombined_cal", "input": input_csv, "workers": workers, "group_column": group_column})
 
-     #change PCTILE column to string so "mean" can be added later
-     lookup = lookup.astype(str) 
+    #import dataset and the extra fields to add back at end in a single read
+    schema_types = readSchemaTypes(dtype_schema)
 
-     #set PCTILE as the index so you dont output an extra column
-     lookup = lookup.set_index(['PCTILE']) 
+    with report.stage("ingest") as stage:
+        source_df, extra_df = readInput(input_csv, csv_engine, indicator_dtype)
+        source_df = applySchemaTypes(source_df, schema_types)
+        extra_df = applySchemaTypes(extra_df, schema_types)
+        stage["rows"] = row_count = len(source_df)
 
-     #generate statistics for every column
-     desc = ejscreen_data_df[percentile_column_names].describe() 
-     
-     #extract mean for every column from stats
-     means = desc.iloc[[1]] 
-     
-     for col in percentile_column_names:
-          print(col)
-          
-          #Create lookup table
+    #the indicator values and the rows of every group are found once and shared by both levels
+    with report.stage("grouping", row_count):
+        indicator_values = getColumnValues(source_df, col_names.data_names)
+        grouping = getGroups(source_df[group_column])
 
-          #find the value of every percentile from 0-100 ignoring NA values
-          lookup[col]= np.nanpercentile(ejscreen_data_df[col], pct_list) 
-          
-          #format lookup for next step
-          lookupList = (lookup[col].values.tolist()) 
-          
-          #Calculate EJScreen Percentiles
-          ejscreen_data_df[("P_" + col)] = ejscreen_data_df[col].apply(lambda x: getPctile(lookupList, x))
+    levels = [("national", None, output_csv, output_lookup, output_artifact, output_fc),
+              ("state", grouping, output_state_csv, output_state_lookup, output_state_artifact, output_state_fc)]
 
-     #append means to lookup table     
-     lookup = pd.concat([lookup, means], axis = 0) 
+    for level, level_grouping, level_csv, level_lookup, level_artifact, level_fc in levels:
 
-     #update field name that doesnt follow naming convention
-     if "P_PRE1960PCT" in ejscreen_data_df.columns:   
-        ejscreen_data_df.rename(columns={"P_PRE1960PCT":"P_LDPNT"}, inplace = True) 
+        #calculate percentiles for socioeconomic and pollution & sources
+        with report.stage(level + "_indicator_percentiles", row_count):
+            pctile_columns, indicator_lookup = calLevelPercentiles(source_df, col_names.data_names, level_grouping, indicator_values, workers, report, cache_dir)
+            indicator_pctiles = applySchemaTypes(joinColumns(source_df, pctile_columns), schema_types, source_df.columns)
 
-     #if true, output to excel and csv respectively
-     if(output == True): 
-          lookup.to_excel(output_xlsx_lookup)
-          ejscreen_data_df.to_csv(output_csv_percentiles)
+        #calculate raw EJ index and Supplemental index values
+        with report.stage(level + "_calIndexes", row_count):
+            indicator_indexes = applySchemaTypes(calIndexes(indicator_pctiles), schema_types, indicator_pctiles.columns)
 
-     return(ejscreen_data_df, lookup)
+        #calculate percentiles for EJ & Supplemental indexes
+        with report.stage(level + "_index_percentiles", row_count):
+            pctile_columns, index_lookup = calLevelPercentiles(indicator_indexes, col_names.index_names, level_grouping, workers = workers, report = report, cache_dir = cache_dir)
+            ejscreen_pctiles = applySchemaTypes(joinColumns(indicator_indexes, pctile_columns), schema_types, indicator_indexes.columns)
+
+        #calcualte B_ and T_ fields
+        with report.stage(level + "_calBinTxt", row_count):
+            ejscreen_full = applySchemaTypes(calBinTxt(ejscreen_pctiles, output=False, text_categories = (schema_types is not None)), schema_types, ejscreen_pctiles.columns)
+
+        with report.stage(level + "_calExceedCounts", row_count):
+
+            #add extra columns back in
+            if len(col_names.extra_cols) > 0:
+                ejscreen_full = joinColumns(ejscreen_full, extra_df) 
+
+            #count how many EJ Indexes exceed the 80th percentile
+            ejscreen_full = applySchemaTypes(calExceedCounts(ejscreen_full), schema_types, ejscreen_full.columns)
+
+            #put columns in correct order
+            ejscreen_full = selectColumns(ejscreen_full, col_names.cols_all) 
+
+        #combines the indicators lookup with the indexes lookup
+        ejscreen_lookup = combineLookups(indicator_lookup, index_lookup)
+
+        writers = [(level + "_write_dataset", row_count, lambda pool: writeDataset(ejscreen_full, level_csv, output_compression, row_group_size, pool), True),
+                   (level + "_write_lookup", None, lambda pool: writeLookupFiles(ejscreen_lookup, level_lookup, level_artifact, group_column), True)]
 
+        if to_featureclass == True:
+            writers.append((level + "_exportSpatial", row_count, lambda pool: exportSpatial(geom_source, ejscreen_full, level_fc, schema, report = report), geopackage.isGeoPackage(level_fc)))
+
+        writeOutputs(writers, report, output_workers)
+        del writers
+
+        #only the input columns are kept for the next level
+        del indicator_pctiles, indicator_indexes, ejscreen_pctiles, ejscreen_full
+
+    if report_path != "":
+        report.write(report_path)
 
 #-------------------------------------------------------------------------------
-# Name:        percentileCalState
-# Purpose:     Calculate percentile fields and create lookup table at the state level. 
+# Name:        ejscreenScore_cal
+# Purpose:     Build EJScreen dataset from the lookup tables of a previous run instead of calculating new ones.
+#              Percentiles of any input are found with the saved lookup values, so no percentiles are recalculated.
+#              National or state percentiles are used depending on the run that created the lookup artifact.
 # 
 # Parameters:
-#   ejscreen_data_df - dataframe containing EJScreen raw data. Must at least contain the columns designated by column_names parameter
-#   output_csv_percentiles - path to output csv that will contain EJScreen dataset
-#   output_xlsx_lookup - path to output xlsx that will contain the percentile lookup table
-#   output - (True/False) whether or not data will be written to csv and excel file respectively
-#   column_names = list containing the columns for which percentiles will be calculated
+#   input_csv - path to csv file containing EJScreen indicator data and ID
+#   lookup_artifact - path to .npz lookup artifact written by ejscreen_cal or ejscreenState_cal (output_artifact)
+#   output_csv - path, or list of paths, to output file(s) that will contain EJScreen dataset. The format of each 
+#                file is set by its extension: .csv, .parquet, .feather/.arrow (Arrow IPC) or .npz (dataset store, 
+#                see saveDatasetStore)
+#   to_featureclass - (True/False) whether or not the EJScreen dataset will be joined to geometry and output to a file geodatabase
+#   geom_source = path to featureclass containing geometry that will be joined to the EJScreen dataset. 
+#   output_fc = path to output EJScreen featureclass 
+#   schema = path to csv file containing field update schema.
+#   csv_engine = parser used to read input_csv. "pyarrow" reads with multiple threads (requires the pyarrow package)
+#   indicator_dtype = data type of the `col_names.data_names` columns, "float64" or "float32"
+#   output_compression = compression codec of Parquet/Feather output. None uses the format default
+#   row_group_size = number of rows per Parquet row group / Feather record batch. None uses the format default
+#   report_path = optional path to output JSON run report with the time and memory of each stage
+#   report = optional run_report.RunReport used to record the stages. A default RunReport is used when None
+#-------------------------------------------------------------------------------
+
+def ejscreenScore_cal(input_csv, lookup_artifact, output_csv, to_featureclass = False, geom_source = "", output_fc = "", schema = "", csv_engine = "c", indicator_dtype = "float64", output_compression = None, row_group_size = None, report_path = "", report = None):
+
+    #records the time and memory of each stage
+    if report is None:
+        report = run_report.RunReport()
+    report.info.update({"function": "ejscreenScore_cal", "input": input_csv, "lookup_artifact": lookup_artifact})
+
+    #import dataset and the extra fields to add back at end in a single read
+    with report.stage("ingest") as stage:
+        lookup_arrays = loadLookupArtifact(lookup_artifact)
+        source_df, extra_df = readInput(input_csv, csv_engine, indicator_dtype)
+        stage["rows"] = row_count = len(source_df)
+
+    #find percentiles, indexes, bins and text using the saved lookup tables
+    with report.stage("scoreDataset", row_count):
+        ejscreen_full = scoreDataset(source_df, extra_df, lookup_arrays)
+
+    with report.stage("write_dataset", row_count):
+        writeDataset(ejscreen_full, output_csv, output_compression, row_group_size)
+
+    if to_featureclass == True:
+        with report.stage("exportSpatial", row_count):
+            exportSpatial(geom_source, ejscreen_full, output_fc, schema, report = report)
+
+    if report_path != "":
+        report.write(report_path)
+
+#-------------------------------------------------------------------------------
+# Name:        ejscreenStream_cal
+# Purpose:     Build EJScreen dataset from an input that is too large to hold in memory. The output is identical
+#              to ejscreen_cal (national) or ejscreenState_cal (state).
+#
+#              The input is read twice, one chunk of rows at a time. The first pass copies the indicator columns 
+#              to memory mapped files in temp_dir and calculates the exact lookup tables one column at a time. 
+#              The second pass builds each chunk of the dataset with those lookup tables and appends it to the 
+#              output csv. Peak memory is set by the chunk size plus a few single columns, rather than by the 
+#              whole table.
+# 
+# Parameters:
+#   input_csv - path to csv file containing EJScreen indicator data and ID. May be compressed
+#   output_csv - path to output csv that will contain EJScreen dataset.
+#   output_lookup - path to output file that will contain the percentile lookup table (.xlsx, .csv, .parquet or .npz)
+#   state - (True/False) whether state percentiles are calculated instead of national percentiles
+#   chunksize - number of rows read and processed at a time
+#   temp_dir - directory for the memory mapped column files. None uses the system temp directory
+#   indicator_dtype = data type of the `col_names.data_names` columns, "float64" or "float32"
+#   output_artifact = optional path to output .npz file that will contain the lookup tables in binary form
+#   report_path = optional path to output JSON run report with the time and memory of each stage
+#   report = optional run_report.RunReport used to record the stages. A default RunReport is used when None
+#-------------------------------------------------------------------------------
+
+def ejscreenStream_cal(input_csv, output_csv, output_lookup, state = False, chunksize = 100000, temp_dir = None, indicator_dtype = "float64", output_artifact = "", report_path = "", report = None):
+
+    #eliminates a warning that has no effect on results
+    warnings.filterwarnings("ignore", message="All-NaN slice encountered")
+
+    if getOutputFormat(output_csv) != "csv":
+        raise ValueError("Streaming mode writes csv output only")
+
+    #records the time and memory of each stage
+    if report is None:
+        report = run_report.RunReport()
+    report.info.update({"function": "ejscreenStream_cal", "input": input_csv, "state": state, "chunksize": chunksize})
+
+    with tempfile.TemporaryDirectory(dir = temp_dir) as column_dir:
+
+        #first pass: copy the indicator columns to disk and calculate the lookup tables
+        ejscreen_lookup, float_columns, row_count = streamLookup(input_csv, column_dir, state, chunksize, indicator_dtype, report)
+
+    lookup_arrays = lookupToArrays(ejscreen_lookup)
+
+    #second pass: build and write the dataset one chunk at a time. The chunks are appended to a temporary file that
+    #replaces output_csv after the last chunk, so a failed run does not leave a truncated dataset
+    with report.stage("write_dataset", row_count):
+        writeAtomic(output_csv, lambda temp_path: streamDataset(input_csv, temp_path, chunksize, indicator_dtype, lookup_arrays, float_columns, report))
+
+    with report.stage("write_lookup"):
+
+        writeLookup(ejscreen_lookup, output_lookup)
+
+        if output_artifact != "":
+            saveLookupArtifact(output_artifact, ejscreen_lookup)
+
+    if report_path != "":
+        report.write(report_path)
+
+#-------------------------------------------------------------------------------
+# Name:        streamDataset
+# Purpose:     Internal function used for the second pass of ejscreenStream_cal. Reads the input one chunk at a time,
+#              builds each chunk of the dataset with the lookup tables and appends it to output_csv.
+# 
+#-------------------------------------------------------------------------------
+
+def streamDataset(input_csv, output_csv, chunksize, indicator_dtype, lookup_arrays, float_columns, report):
+
+    input_chunks = pd.read_csv(input_csv, usecols = (col_names.info_names + col_names.data_names + col_names.extra_cols), dtype = getInputDtypes(indicator_dtype), chunksize = chunksize)
+
+    for chunk_number, input_df in enumerate(input_chunks):
+
+        with report.step("chunk " + str(chunk_number), len(input_df)):
+
+            #the chunk columns are copied so new columns are not added to a slice of the chunk
+            source_df = input_df[col_names.info_names + col_names.data_names].copy()
+            extra_df = input_df[col_names.extra_cols]
+
+            ejscreen_chunk = scoreDataset(source_df, extra_df, lookup_arrays)
+
+            #a column that is only whole numbers in this chunk is written as float if it is float in the whole dataset
+            chunk_float_columns = [col for col in ejscreen_chunk.columns if col in float_columns and pd.api.types.is_integer_dtype(ejscreen_chunk[col])]
+            ejscreen_chunk = ejscreen_chunk.astype({col: float for col in chunk_float_columns})
+
+            ejscreen_chunk.to_csv(output_csv, mode = ("w" if chunk_number == 0 else "a"), header = (chunk_number == 0))
+
+#-------------------------------------------------------------------------------
+# Name:        streamLookup
+# Purpose:     Internal function used for the first pass of ejscreenStream_cal. Copies the indicator columns 
+#              of the input to memory mapped files, calculates the indicator lookup tables, writes the raw 
+#              index values to more memory mapped files, and calculates the index lookup tables.
+# 
+# Returns:
+#   ejscreen_lookup - combined lookup table, the same as ejscreen_cal/ejscreenState_cal build
+#   float_columns - set of output columns that are float in the whole dataset
+#   row_count - number of rows in the input
+#-------------------------------------------------------------------------------
+
+def streamLookup(input_csv, column_dir, state, chunksize, indicator_dtype, report):
+
+    float_columns = set()
+    groups = {}
+    row_count = 0
+
+    with report.stage("ingest") as stage:
+
+        column_files = {col: open(os.path.join(column_dir, col + ".dat"), "wb") for col in col_names.data_names + ["group_codes"]}
+
+        try:
+            input_chunks = pd.read_csv(input_csv, usecols = (col_names.info_names + col_names.data_names + col_names.extra_cols), dtype = getInputDtypes(indicator_dtype), chunksize = chunksize)
+
+            for input_df in input_chunks:
+
+                #a column that is float in any chunk is float when the whole file is read
+                float_columns.update(col for col in input_df.columns if pd.api.types.is_float_dtype(input_df[col]))
+
+                for col in col_names.data_names:
+                    column_files[col].write(input_df[col].to_numpy(dtype = float).tobytes())
+
+                #groups are numbered in order of first appearance, the same order getGroups uses
+                if state:
+                    for group in pd.unique(input_df['ST_ABBREV']):
+                        if not pd.isna(group):
+                            groups.setdefault(group, len(groups))
+                
+                group_codes = pd.Index(list(groups)).get_indexer(input_df['ST_ABBREV']) if state else np.zeros(len(input_df))
+                column_files["group_codes"].write(np.asarray(group_codes, dtype = np.int64).tobytes())
+
+                row_count += len(input_df)
+        finally:
+            for column_file in column_files.values():
+                column_file.close()
+
+        stage["rows"] = row_count
+
+    if state:
+        group_codes = np.fromfile(os.path.join(column_dir, "group_codes.dat"), dtype = np.int64)
+        order, bounds = getGroupBounds(group_codes, len(groups))
+        del group_codes
+    else:
+        order, bounds = None, [(0, row_count)]
+
+    #calculate percentiles for socioeconomic and pollution & sources
+    with report.stage("indicator_percentiles", row_count):
+        indicator_lookup, pctile_na = streamColumnsLookup(column_dir, col_names.data_names, row_count, order, bounds, list(groups), report)
+        indicator_arrays = lookupToArrays(indicator_lookup)
+
+    #calculate raw EJ index and Supplemental index values from the indicator percentiles, one chunk at a time
+    with report.stage("calIndexes", row_count):
+
+        group_names = np.array(list(groups) + [None], dtype = object)
+        index_files = {col: open(os.path.join(column_dir, col + ".dat"), "wb") for col in col_names.index_names}
+
+        try:
+            for start in range(0, row_count, chunksize):
+                stop = min(start + chunksize, row_count)
+
+                chunk_df = pd.DataFrame({col: readColumnFile(column_dir, col, row_count)[start:stop] for col in col_names.data_names})
+                if state:
+                    chunk_df['ST_ABBREV'] = group_names[readColumnFile(column_dir, "group_codes", row_count, np.int64)[start:stop]]
+
+                chunk_df = calIndexes(percentileScore(chunk_df, indicator_arrays))
+
+                for col in col_names.index_names:
+                    index_files[col].write(chunk_df[col].to_numpy(dtype = float).tobytes())
+        finally:
+            for index_file in index_files.values():
+                index_file.close()
+
+    #calculate percentiles for EJ & Supplemental indexes
+    with report.stage("index_percentiles", row_count):
+        index_lookup, index_pctile_na = streamColumnsLookup(column_dir, col_names.index_names, row_count, order, bounds, list(groups), report)
+        pctile_na.update(index_pctile_na)
+
+    #P_ and B_ columns are float when they have NA values, or always at the state level
+    for col, has_na in pctile_na.items():
+        if has_na or state:
+            p_col = getPctileName(col)
+            float_columns.update([p_col, p_col.replace("P_", "B_")])
+
+    return(combineLookups(indicator_lookup, index_lookup), float_columns, row_count)
+
+#-------------------------------------------------------------------------------
+# Name:        streamColumnsLookup
+# Purpose:     Internal function that builds the national or state lookup table of memory mapped columns, 
+#              loading one column at a time.
+# 
+# Returns:
+#   lookup - national or state lookup table
+#   pctile_na - dictionary of whether each column has any NA percentiles
 #-------------------------------------------------------------------------------
 
+def streamColumnsLookup(column_dir, column_names, row_count, order, bounds, groups, report):
+
+    breakpoints = []
+    means = []
+    pctile_na = {}
+
+    for col in column_names:
+        with report.step(col, row_count, "column"):
+
+            values = np.array(readColumnFile(column_dir, col, row_count))
+
+            pctiles = np.full(row_count, np.nan)
+            column_breakpoints, column_means = scoreColumn(values, bounds, pctiles, order = order)
+
+            breakpoints.append(column_breakpoints)
+            means.append(column_means)
+            pctile_na[col] = bool(np.isnan(pctiles).any())
+
+    breakpoints = np.stack(breakpoints, axis = 2)
+    means = np.stack(means, axis = 1)
+
+    if order is None:
+        return(buildNationalLookup(breakpoints[0], means[0], column_names), pctile_na)
+
+    return(buildStateLookup(groups, breakpoints, means, column_names), pctile_na)
+
+#-------------------------------------------------------------------------------
+# Name:        readColumnFile
+# Purpose:     Internal function that memory maps one column file written by streamLookup.
+# 
+#-------------------------------------------------------------------------------
+
+def readColumnFile(column_dir, column_name, row_count, dtype = float):
+
+    if row_count == 0:
+        return(np.empty(0, dtype = dtype))
+
+    return(np.memmap(os.path.join(column_dir, column_name + ".dat"), dtype = dtype, mode = "r", shape = (row_count,)))
+
+#-------------------------------------------------------------------------------
+# Name:        scoreDataset
+# Purpose:     Internal function that builds the EJScreen dataset from input data and the arrays of a lookup artifact.
+#              Used by ejscreenScore_cal and, one chunk at a time, by ejscreenStream_cal.
+# 
+# Parameters:
+#   source_df - data frame of the `col_names.info_names` and `col_names.data_names` columns
+#   extra_df - data frame of the `col_names.extra_cols` columns
+#   lookup_arrays - dictionary returned by loadLookupArtifact
+#
+# Returns:
+#   Data frame of the `col_names.cols_all` columns
+#-------------------------------------------------------------------------------
+
+def scoreDataset(source_df, extra_df, lookup_arrays):
+
+    #find percentiles for socioeconomic and pollution & sources
+    indicator_pctiles = percentileScore(source_df, lookup_arrays) 
+
+    #calculate raw EJ index and Supplemental index values
+    indicator_indexes = calIndexes(indicator_pctiles) 
+
+    #find percentiles for EJ & Supplemental indexes
+    ejscreen_pctiles = percentileScore(indicator_indexes, lookup_arrays, percentile_column_names = col_names.index_names) 
+    
+    #calcualte B_ and T_ fields
+    ejscreen_full = calBinTxt(ejscreen_pctiles, output=False) 
+
+    #add extra columns back in
+    if len(col_names.extra_cols) > 0:
+        ejscreen_full = joinColumns(ejscreen_full, extra_df) 
+
+    #count how many EJ Indexes exceed the 80th percentile
+    ejscreen_full = calExceedCounts(ejscreen_full)
+
+    #put columns in correct order
+    return(selectColumns(ejscreen_full, col_names.cols_all))
+
+#-------------------------------------------------------------------------------
+# Name:        readInput
+# Purpose:     Read the input dataset in a single pass with explicit data types for the known columns.
+#              Compressed files (.gz, .zst, .bz2, .xz, .zip) are decompressed as they are read.
+# 
+# Parameters:
+#   input_csv - path to csv file containing EJScreen indicator data and ID. May be compressed
+#   csv_engine - parser passed to pandas.read_csv. "c" is the default pandas parser, "pyarrow" is multithreaded
+#   indicator_dtype - data type of the `col_names.data_names` columns
+#
+# Returns:
+#   source_df - data frame of the `col_names.info_names` and `col_names.data_names` columns
+#   extra_df - data frame of the `col_names.extra_cols` columns
+#-------------------------------------------------------------------------------
+
+def readInput(input_csv, csv_engine = "c", indicator_dtype = "float64"):
+
+    source_names = col_names.info_names + col_names.data_names
+
+    input_df = pd.read_csv(input_csv, usecols = (source_names + col_names.extra_cols), dtype = getInputDtypes(indicator_dtype), engine = csv_engine, compression = "infer")
+
+    #both frames share the columns that were read instead of copying them
+    return(selectColumns(input_df, source_names), selectColumns(input_df, col_names.extra_cols))
+
+#-------------------------------------------------------------------------------
+# Name:        getInputDtypes
+# Purpose:     Internal function that returns the data type of each input column that does not rely on type inference.
+#              ID is kept as text so leading zeros are not lost, and the repeated names are stored as categories.
+# 
+#-------------------------------------------------------------------------------
+
+def getInputDtypes(indicator_dtype = "float64"):
+
+    dtypes = {"ID": str}
+
+    for col in ["STATE_NAME", "ST_ABBREV", "REGION"]:
+        if col in col_names.info_names:
+            dtypes[col] = "category"
+
+    for col in col_names.data_names:
+        dtypes[col] = indicator_dtype
+
+    return(dtypes)
+
+#-------------------------------------------------------------------------------
+# Name:        joinColumns
+# Purpose:     Internal function that adds a block of new columns to a data frame. Neither the data frame nor the
+#              new columns are copied: the result is built from the existing column arrays. New columns that are 
+#              already in the data frame replace them in place, the rest are added at the end in order.
+# 
+# Parameters:
+#   df - data frame
+#   new_columns - dictionary of column name to array or Series (or a data frame) with the same rows as df
+#-------------------------------------------------------------------------------
+
+def joinColumns(df, new_columns):
+
+     columns = {col: (new_columns[col] if col in new_columns else df[col]) for col in df.columns}
+
+     for col in new_columns:
+          if col not in columns:
+               columns[col] = new_columns[col]
+
+     return(pd.DataFrame(columns, index = df.index, copy = False))
+
+#-------------------------------------------------------------------------------
+# Name:        selectColumns
+# Purpose:     Internal function that returns the listed columns of a data frame in that order, without copying them.
+# 
+#-------------------------------------------------------------------------------
+
+def selectColumns(df, column_names):
+
+     return(pd.DataFrame({col: df[col] for col in column_names}, index = df.index, copy = False))
+
+#-------------------------------------------------------------------------------
+# Name:        getColumnValues
+# Purpose:     Internal function that copies columns of a data frame into one preallocated 2 dimensional float array 
+#              (rows x columns) with each column stored contiguously. Rows are put in `order` when it is given.
+# 
+#-------------------------------------------------------------------------------
+
+def getColumnValues(df, column_names, order = None):
+
+     values = np.empty((len(df), len(column_names)), order = "F")
+
+     for i, col in enumerate(column_names):
+          column_values = df[col].to_numpy(dtype = float)
+
+          if order is None:
+               values[:, i] = column_values
+          else:
+               np.take(column_values, order, out = values[:, i])
+
+     return(values)
+
+#-------------------------------------------------------------------------------
+# Name:        getPctileColumns
+# Purpose:     Internal function that turns the percentiles of each column into a dictionary of P_ columns.
+#              Float columns are used as they are rather than copied. PRE1960PCT percentiles are named P_LDPNT.
+# 
+# Parameters:
+#   pctiles - list of the percentile array of each column, or a 2 dimensional array (rows x columns)
+#   column_names - list of the columns the percentiles were calculated for
+#   keep_integers - (True/False) whether columns without NA values are stored as integers
+#-------------------------------------------------------------------------------
+
+def getPctileColumns(pctiles, column_names, keep_integers):
+
+     if isinstance(pctiles, np.ndarray):
+          pctiles = list(pctiles.T)
+
+     pctile_columns = {}
+
+     for col, pctile in zip(column_names, pctiles):
+
+          if keep_integers and not np.isnan(pctile).any():
+               pctile = pctile.astype(np.int64)
+
+          pctile_columns[getPctileName(col)] = pctile
+
+     return(pctile_columns)
+
+#-------------------------------------------------------------------------------
+# Name:        getPctileName
+# Purpose:     Internal function that returns the percentile field name of a column. 
+#              PRE1960PCT is the one field name that doesnt follow the naming convention.
+# 
+#-------------------------------------------------------------------------------
+
+def getPctileName(column_name):
+
+     if column_name == "PRE1960PCT":
+          return("P_LDPNT")
+
+     return("P_" + column_name)
+
+#-------------------------------------------------------------------------------
+# Name:        writeDataset
+# Purpose:     Write the EJScreen dataset to one or more files. The format of each file is set by its extension.
+#              Parquet and Feather/Arrow IPC keep column types: B_ bins are written as integers and T_ text 
+#              as categories. Both require the pyarrow package.
+# 
+# Parameters:
+#   ejscreen_df - data frame containing the EJScreen dataset, in output column order
+#   output_paths - path or list of paths. Extensions: .csv, .parquet, .feather, .arrow, or .npz for a dataset store
+#                  that is read with ejscreen_store.DatasetStore, see saveDatasetStore
+#   compression - compression codec of Parquet/Feather output. None uses the format default
+#   row_group_size - number of rows per Parquet row group / Feather record batch. None uses the format default
+#   pool - optional ProcessPoolExecutor. Uncompressed csv output is formatted in segments on it, see writeCsvSegments
+#-------------------------------------------------------------------------------
+
+def writeDataset(ejscreen_df, output_paths, compression = None, row_group_size = None, pool = None):
+
+    if isinstance(output_paths, str):
+        output_paths = [output_paths]
+
+    columnar_df = None
+
+    for output_path in output_paths:
+
+        output_format = getOutputFormat(output_path)
+
+        if output_format == "csv":
+            if pool is not None and output_path.lower().endswith(".csv"):
+                writeAtomic(output_path, lambda temp_path: writeCsvSegments(ejscreen_df, temp_path, pool))
+            else:
+                writeAtomic(output_path, ejscreen_df.to_csv)
+            continue
+
+        if output_format == "store":
+            saveDatasetStore(output_path, ejscreen_df)
+            continue
+
+        #typed columns are only built once, no matter how many columnar files are written
+        if columnar_df is None:
+            columnar_df = getColumnarTypes(ejscreen_df)
+
+        if output_format == "parquet":
+            writeAtomic(output_path, lambda temp_path: columnar_df.to_parquet(temp_path, engine = "pyarrow", index = False, compression = compression if compression else "snappy", row_group_size = row_group_size))
+        else:
+            writeAtomic(output_path, lambda temp_path: columnar_df.to_feather(temp_path, compression = compression, chunksize = row_group_size))
+
+#-------------------------------------------------------------------------------
+# Name:        writeAtomic
+# Purpose:     Internal function that calls write_function with a temporary path in the folder of output_path, and
+#              renames the file to output_path once it is complete. If writing fails, the temporary file is removed,
+#              so an output is either the complete file or the file of an earlier run, never a partial file.
+#              The temporary name keeps the extensions of output_path, since they set the format and compression.
+# 
+#-------------------------------------------------------------------------------
+
+def writeAtomic(output_path, write_function):
+
+    directory, name = os.path.split(output_path)
+    temp_path = os.path.join(directory, ".partial_" + name)
+
+    try:
+        write_function(temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+#-------------------------------------------------------------------------------
+# Name:        writeCsvSegments
+# Purpose:     Internal function that writes the dataset to a csv file in segments of `csv_segment_rows` rows. 
+#              Each segment is formatted by a process of `pool` into its own file, and the segments are joined in 
+#              order as they finish. The file is identical to DataFrame.to_csv.
+# 
+#-------------------------------------------------------------------------------
+
+def writeCsvSegments(ejscreen_df, output_path, pool):
+
+    if len(ejscreen_df) <= csv_segment_rows:
+        ejscreen_df.to_csv(output_path)
+        return
+
+    with tempfile.TemporaryDirectory(dir = os.path.dirname(output_path) or ".") as segment_dir:
+
+        futures = [pool.submit(formatCsvSegment, ejscreen_df.iloc[start:start + csv_segment_rows], os.path.join(segment_dir, str(start) + ".csv"), start == 0)
+                   for start in range(0, len(ejscreen_df), csv_segment_rows)]
+
+        with open(output_path, "wb") as output_file:
+            for future in futures:
+                segment_path = future.result()
+                with open(segment_path, "rb") as segment_file:
+                    shutil.copyfileobj(segment_file, output_file, 1 << 20)
+                os.remove(segment_path)
+
+#-------------------------------------------------------------------------------
+# Name:        formatCsvSegment
+# Purpose:     Internal function run by a worker process that writes rows of the dataset to a csv segment. Only the
+#              first segment has the header. Returns the path of the segment.
+# 
+#-------------------------------------------------------------------------------
+
+def formatCsvSegment(segment_df, segment_path, header):
+
+    segment_df.to_csv(segment_path, header = header)
+
+    return(segment_path)
+
+#-------------------------------------------------------------------------------
+# Name:        writeOutputs
+# Purpose:     Internal function that runs the writers of a run's outputs (dataset files, lookup tables, spatial 
+#              export). With output_workers of 1 each writer is its own stage of the run report, one after another.
+#              With more, the writers that can run concurrently share one "write_outputs" stage: they run on a pool
+#              of output_workers threads, and the csv datasets are formatted in segments on a pool of as many 
+#              processes. The time of each writer is recorded in the stage's "writers". When a writer fails, the
+#              others are allowed to finish, every failure is printed, and the first error is raised. Writers 
+#              use writeAtomic, so the failed outputs are not left behind as partial files.
+#
+# Parameters:
+#   writers - list of (name, rows, function, concurrent). function takes the process pool, or None, and writes 
+#             one output. Writers with `concurrent` False (the ArcGIS export) run after the others in their own stage
+#   report - run_report.RunReport of the run
+#   output_workers - number of writers that run at a time
+# 
+#-------------------------------------------------------------------------------
+
+def writeOutputs(writers, report, output_workers = 1):
+
+     concurrent_writers = [writer for writer in writers if output_workers > 1 and writer[3]]
+
+     if len(concurrent_writers) > 0:
+
+          with report.stage("write_outputs", sum(rows for name, rows, function, concurrent in concurrent_writers if rows)) as stage:
+
+               def timeWriter(function):
+                    start = time.perf_counter()
+                    function(pool)
+                    return(time.perf_counter() - start)
+
+               with ProcessPoolExecutor(max_workers = output_workers) as pool, ThreadPoolExecutor(max_workers = output_workers) as threads:
+                    futures = [threads.submit(timeWriter, function) for name, rows, function, concurrent in concurrent_writers]
+                    wait(futures)
+
+               stage["writers"] = {}
+               errors = []
+               for (name, rows, function, concurrent), future in zip(concurrent_writers, futures):
+                    if future.exception() is None:
+                         stage["writers"][name] = round(future.result(), 4)
+                    else:
+                         stage["writers"][name] = "failed: " + repr(future.exception())
+                         errors.append(future.exception())
+                         print(name + " failed: " + repr(future.exception()))
+
+               if len(errors) > 0:
+                    raise errors[0]
+
+     for writer in writers:
+          if not any(writer is concurrent_writer for concurrent_writer in concurrent_writers):
+               name, rows, function, concurrent = writer
+               with report.stage(name, rows):
+                    function(None)
+
+#-------------------------------------------------------------------------------
+# Name:        getOutputFormat
+# Purpose:     Internal function that returns the output format ("csv", "parquet", "feather" or "store") of a path from its extension.
+#              Compression extensions such as .gz are allowed after .csv.
+# 
+#-------------------------------------------------------------------------------
+
+def getOutputFormat(output_path):
+
+    extensions = os.path.basename(output_path).lower().split(".")[1:]
+
+    if "parquet" in extensions:
+        return("parquet")
+    if "feather" in extensions or "arrow" in extensions:
+        return("feather")
+    if "csv" in extensions:
+        return("csv")
+    if extensions[-1:] == ["npz"]:
+        return("store")
+
+    raise ValueError("Unknown output format for " + output_path + ". Use .csv, .parquet, .feather, .arrow or .npz")
+
+#-------------------------------------------------------------------------------
+# Name:        getColumnarTypes
+# Purpose:     Internal function that returns the dataset with column types for columnar output: 
+#              B_ bins as nullable integers and T_ text as categories with one category per percentile.
+#              The other columns are shared with the dataset rather than copied.
+# 
+#-------------------------------------------------------------------------------
+
+def getColumnarTypes(ejscreen_df):
+
+    typed_columns = {}
+
+    for col in ejscreen_df.columns:
+        if col.startswith("B_"):
+            typed_columns[col] = pd.array(ejscreen_df[col].values, dtype = "Int8")
+        elif col.startswith("T_"):
+            typed_columns[col] = pd.Categorical(ejscreen_df[col].values, categories = getTxtLabels())
+
+    columnar_df = joinColumns(ejscreen_df, typed_columns)
+    columnar_df.index = pd.RangeIndex(len(columnar_df))
+
+    return(columnar_df)
+
+#-------------------------------------------------------------------------------
+# Name:        percentileCal
+# Purpose:     Calculate percentile fields and create lookup table at the national level. 
+# 
+# Parameters:
+#   ejscreen_data_df - dataframe containing EJScreen raw data. Must at least contain the columns designated by column_names parameter
+#   output_csv_percentiles - path to output csv that will contain EJScreen dataset
+#   output_xlsx_lookup - path to output xlsx that will contain the percentile lookup table
+#   output - (True/False) whether or not data will be written to csv and excel file respectively
+#   column_names = list containing the columns for which percentiles will be calculated
+#   workers - number of processes used to calculate the percentiles. 1 runs everything in the current process
+#   report - optional run_report.RunReport that records the time of each column (and state) when its detail is turned on
+#   cache_dir - optional directory of cached percentiles. See calLevelPercentiles
+#-------------------------------------------------------------------------------
+
+def percentileCal(ejscreen_data_df, output_csv_percentiles = "", output_xlsx_lookup = "", output = False, percentile_column_names = col_names.data_names, workers = 1, report = None, cache_dir = "", preview_rows = 0): 
+
+     #the whole dataset is a single group at the national level
+     pctile_columns, lookup = calLevelPercentiles(ejscreen_data_df, percentile_column_names, workers = workers, report = report, cache_dir = cache_dir, preview_rows = preview_rows)
+
+     ejscreen_data_df = joinColumns(ejscreen_data_df, pctile_columns)
+
+     #if true, output to excel and csv respectively
+     if(output == True): 
+          lookup.to_excel(output_xlsx_lookup)
+          ejscreen_data_df.to_csv(output_csv_percentiles)
+
+     return(ejscreen_data_df, lookup)
+
+
+#-------------------------------------------------------------------------------
+# Name:        calLevelPercentiles
+# Purpose:     Internal function that calculates the percentile columns and lookup table of one level: national when
+#              `grouping` is None, otherwise one lookup table per group (state, region...). Used by percentileCal, 
+#              percentileCalState and ejscreenCombined_cal.
+# 
+# Parameters:
+#   ejscreen_data_df - dataframe containing the columns in column_names
+#   column_names - list containing the columns for which percentiles will be calculated
+#   grouping - optional (groups, order, bounds) returned by getGroups. Rows are never sorted: each group is read 
+#              through `order`, so one grouping and one values array can be shared by several levels and stages
+#   values - optional array of the column values returned by getColumnValues. Read from the data frame when None
+#   workers - number of processes used to calculate the percentiles
+#   report - optional run_report.RunReport
+#   cache_dir - optional directory of cached percentiles. Each column's percentiles, lookup values and means are 
+#               stored under the key getColumnKeys gives it, which changes whenever any input it depends on changes. 
+#               Columns with a cache entry are read instead of calculated, and new results are added to the cache. 
+#               The data frame must hold the `col_names.data_names` columns
+#   preview_rows - when greater than 0, lookup tables are found from a sample of this many rows of each group, and 
+#                  the error of every column is printed and recorded in the report. The cache is not used
+#
+# Returns:
+#   pctile_columns - dictionary of P_ columns. National percentiles are integers when a column has no NA values,
+#                    the same as Series.apply(getPctile) returned them
+#   lookup - national or group lookup table
+#-------------------------------------------------------------------------------
+
+def calLevelPercentiles(ejscreen_data_df, column_names, grouping = None, values = None, workers = 1, report = None, cache_dir = "", preview_rows = 0):
+
+     if grouping is None:
+          groups, order, bounds = None, None, [(0, len(ejscreen_data_df))]
+     else:
+          groups, order, bounds = grouping
+
+     #preview percentiles are not exact, so they are never read from or added to the cache
+     if preview_rows > 0:
+          cache_dir = ""
+
+     #(percentiles, lookup values, means) of each column, read from the cache when it has them
+     results = {}
+     if cache_dir != "":
+          column_keys = getColumnKeys(ejscreen_data_df, grouping)
+          results = {col: loadCachedPercentiles(cache_dir, column_keys[getPctileName(col)]) for col in column_names}
+          results = {col: result for col, result in results.items() if result is not None}
+
+     calculate_names = [col for col in column_names if col not in results]
+
+     if report is not None and cache_dir != "":
+          report.note("cached_columns", len(column_names) - len(calculate_names))
+          report.note("calculated_columns", calculate_names)
+
+     if len(calculate_names) > 0:
+
+          if values is None:
+               values = getColumnValues(ejscreen_data_df, calculate_names)
+          elif len(calculate_names) < len(column_names):
+               values = np.asfortranarray(values[:, [column_names.index(col) for col in calculate_names]])
+
+          preview_errors = np.zeros((len(bounds), len(calculate_names)))
+          breakpoints, means, pctiles = calGroupPercentiles(values, bounds, calculate_names, workers, report, groups, order, preview_rows, preview_errors)
+
+          if preview_rows > 0:
+               getIndexPreviewErrors(ejscreen_data_df, calculate_names, bounds, order, breakpoints, pctiles, preview_rows, preview_errors)
+               printPreviewErrors(calculate_names, preview_errors, report)
+
+          for i, col in enumerate(calculate_names):
+               results[col] = (pctiles[:, i], breakpoints[:, :, i], means[:, i])
+
+               if cache_dir != "":
+                    saveCachedPercentiles(cache_dir, column_keys[getPctileName(col)], *results[col])
+
+     breakpoints = np.stack([results[col][1] for col in column_names], axis = 2)
+     means = np.stack([results[col][2] for col in column_names], axis = 1)
+
+     if grouping is None:
+          lookup = buildNationalLookup(breakpoints[0], means[0], column_names)
+     else:
+          lookup = buildStateLookup(groups, breakpoints, means, column_names)
+
+     return(getPctileColumns([results[col][0] for col in column_names], column_names, keep_integers = (grouping is None)), lookup)
+
+#-------------------------------------------------------------------------------
+# Name:        printPreviewErrors
+# Purpose:     Internal function that prints the largest difference between preview and exact percentiles of each 
+#              column, over all groups, and records it in the run report.
+# 
+#-------------------------------------------------------------------------------
+
+def printPreviewErrors(column_names, preview_errors, report = None):
+
+     column_errors = {col: int(error) for col, error in zip(column_names, preview_errors.max(axis = 0, initial = 0))}
+
+     print("Preview percentiles, largest difference from exact on a validation sample:")
+     for col, error in column_errors.items():
+          print("  " + col.ljust(24) + str(error))
+
+     if report is not None:
+          report.note("preview_errors", column_errors)
+
+#-------------------------------------------------------------------------------
+# Name:        getIndexPreviewErrors
+# Purpose:     Internal function that measures the error of preview index percentiles from end to end. Index values
+#              are built from preview indicator percentiles, so comparing the index percentiles with exact percentiles
+#              of those same values leaves out the error of the indicator percentiles. Instead, the indicator 
+#              percentiles of every sampled group are recalculated exactly with getExactBreakpoints, the indexes are 
+#              rebuilt from them with calIndexes, and the preview index percentiles are compared with the exact 
+#              percentiles of the rebuilt indexes on the validation sample. The errors of the `col_names.index_names` 
+#              columns in preview_errors are replaced. Other columns, and indexes of a data frame without the 
+#              indicator columns, keep the error of their own lookup table.
+# 
+# Parameters:
+#   ejscreen_data_df - dataframe containing the indicator, P_ and index columns
+#   column_names - columns whose percentiles were calculated
+#   bounds, order - groups of rows, see calLevelPercentiles
+#   breakpoints - preview lookup values of each group and column (groups x 101 x columns)
+#   pctiles - preview percentiles of each row and column (rows x columns)
+#   preview_rows - rows sampled for each lookup table
+#   preview_errors - array (groups x columns) of errors to update
+#-------------------------------------------------------------------------------
+
+def getIndexPreviewErrors(ejscreen_data_df, column_names, bounds, order, breakpoints, pctiles, preview_rows, preview_errors):
+
+     index_columns = [i for i, col in enumerate(column_names) if col in col_names.index_names]
+     pctile_names = set("P_" + col[3:] for col in col_names.index_names)
+     indicator_names = [col for col in col_names.data_names if getPctileName(col) in pctile_names]
+
+     needed_columns = indicator_names + list(pctile_names) + ["DEMOGIDX_2", "DEMOGIDX_5"] + [column_names[j] for j in index_columns]
+     if len(index_columns) == 0 or any(col not in ejscreen_data_df.columns for col in needed_columns):
+          return
+
+     sampled = [(i, slice(start, stop) if order is None else order[start:stop]) for i, (start, stop) in enumerate(bounds) if stop - start > preview_rows]
+
+     #exact indicator percentiles. Groups that were not sampled already have them
+     exact_columns = {}
+     for col in indicator_names:
+          values = ejscreen_data_df[col].to_numpy(dtype = float)
+          exact_pctiles = ejscreen_data_df[getPctileName(col)].to_numpy(dtype = float, copy = True)
+
+          for i, group_rows in sampled:
+               exact_pctiles[group_rows] = getPctileArray(getExactBreakpoints(values[group_rows], exact_pctiles[group_rows]), values[group_rows])
+
+          #the percentiles are given the type of the preview column, so the indexes are built the same way as in an exact run
+          exact_columns[getPctileName(col)] = pd.Series(exact_pctiles, index = ejscreen_data_df.index).astype(ejscreen_data_df[getPctileName(col)].dtype)
+
+     exact_columns.update({col: ejscreen_data_df[col] for col in ["DEMOGIDX_2", "DEMOGIDX_5"]})
+     exact_indexes = calIndexes(pd.DataFrame(exact_columns, index = ejscreen_data_df.index, copy = False))
+
+     for j in index_columns:
+          col = column_names[j]
+          exact_values = exact_indexes[col].astype(ejscreen_data_df[col].dtype).to_numpy(dtype = float)
+
+          for i, group_rows in sampled:
+               group_values = exact_values[group_rows]
+               exact_breakpoints = getExactBreakpoints(group_values, getPctileArray(breakpoints[i, :, j], group_values))
+
+               validation_rows = getSampleRows(len(group_values), preview_validation_rows, i, purpose = 1)
+               differences = np.abs(getPctileArray(exact_breakpoints, group_values[validation_rows]) - pctiles[group_rows, j][validation_rows])
+               differences = differences[~np.isnan(differences)]
+
+               preview_errors[i, j] = float(differences.max()) if len(differences) > 0 else 0
+
+#-------------------------------------------------------------------------------
+# Name:        getColumnDependencies
+# Purpose:     Internal function that returns the dependency graph of the calculated columns, matching what the
+#              pipeline does: each indicator X gives P_X, P_X and DEMOGIDX_2 (or DEMOGIDX_5) give the index D2_X 
+#              (or D5_X), each index gives its P_D2_X percentile, and each percentile gives its B_ and T_ fields.
+#              Columns are listed so that every column comes after the columns it depends on.
+# 
+# Returns:
+#   Dictionary of column name to the list of columns it is calculated from
+#-------------------------------------------------------------------------------
+
+def getColumnDependencies():
+
+     dependencies = {}
+
+     for col in col_names.data_names:
+          dependencies[getPctileName(col)] = [col]
+
+     for colname in col_names.index_names:
+          if (colname[0:3] == "D2_"):
+               dependencies[colname] = ["P_" + colname[3:], "DEMOGIDX_2"]
+          if (colname[0:3] == "D5_"):
+               dependencies[colname] = ["P_" + colname[3:], "DEMOGIDX_5"]
+
+          dependencies[getPctileName(colname)] = [colname]
+
+     for p_col in [col for col in dependencies if col.startswith("P_")]:
+          dependencies[p_col.replace("P_", "B_")] = [p_col]
+          dependencies[p_col.replace("P_", "T_")] = [p_col]
+
+     return(dependencies)
+
+#-------------------------------------------------------------------------------
+# Name:        getColumnKeys
+# Purpose:     Internal function that gives every input column a hash of its content, and every calculated column 
+#              a hash of the keys of the columns it depends on (see getColumnDependencies). A calculated column's key 
+#              changes only when an input upstream of it changes. Percentile keys also depend on the grouping 
+#              (national, or which rows are in which group).
+# 
+# Returns:
+#   Dictionary of column name to key
+#-------------------------------------------------------------------------------
+
+def getColumnKeys(ejscreen_data_df, grouping = None):
+
+     if grouping is None:
+          level_key = "national"
+     else:
+          groups, order, bounds = grouping
+          level_hash = hashlib.blake2b(np.ascontiguousarray(order, dtype = np.int64), digest_size = 16)
+          level_hash.update(repr((bounds, [str(group) for group in groups])).encode())
+          level_key = level_hash.hexdigest()
+
+     column_keys = {}
+
+     for col in col_names.data_names:
+          column_hash = hashlib.blake2b(np.ascontiguousarray(ejscreen_data_df[col].to_numpy(dtype = float)), digest_size = 16)
+          column_keys[col] = column_hash.hexdigest()
+
+     for col, inputs in getColumnDependencies().items():
+          key_parts = [str(column_cache_version), col, (level_key if col.startswith("P_") else "")] + [column_keys[input_col] for input_col in inputs]
+          column_keys[col] = hashlib.blake2b("|".join(key_parts).encode(), digest_size = 16).hexdigest()
+
+     return(column_keys)
+
+#-------------------------------------------------------------------------------
+# Name:        loadCachedPercentiles
+# Purpose:     Internal function that reads the percentiles, lookup values and means cached under a key. 
+#              Returns None when the cache has no entry for the key.
+# 
+#-------------------------------------------------------------------------------
+
+def loadCachedPercentiles(cache_dir, key):
+
+     cache_path = os.path.join(cache_dir, key + ".npz")
+
+     if not os.path.exists(cache_path):
+          return(None)
+
+     with np.load(cache_path, allow_pickle = False) as cached:
+          return(cached["pctiles"], cached["breakpoints"], cached["means"])
+
+#-------------------------------------------------------------------------------
+# Name:        saveCachedPercentiles
+# Purpose:     Internal function that caches the percentiles, lookup values and means of one column under a key.
+#              The file is written under a temporary name and then renamed, so a run that stops partway never 
+#              leaves a partial cache entry.
+# 
+#-------------------------------------------------------------------------------
+
+def saveCachedPercentiles(cache_dir, key, pctiles, breakpoints, means):
+
+     os.makedirs(cache_dir, exist_ok = True)
+
+     temp_path = os.path.join(cache_dir, key + ".tmp.npz")
+     np.savez(temp_path, pctiles = pctiles, breakpoints = breakpoints, means = means)
+     os.replace(temp_path, os.path.join(cache_dir, key + ".npz"))
+
+#-------------------------------------------------------------------------------
+# Name:        buildNationalLookup
+# Purpose:     Internal function that builds the national lookup table: 101 percentile rows indexed by PCTILE, 
+#              followed by a mean row.
+# 
+# Parameters:
+#   breakpoints - array (101 x columns) of lookup values
+#   means - array of the mean of every column
+#   column_names - list of column names
+#-------------------------------------------------------------------------------
+
+def buildNationalLookup(breakpoints, means, column_names):
+
+     #create list of percentiles
+     pct_list = np.arange(0,101) 
+
+     #create empty lookup table with percentile column
+     lookup = pd.DataFrame(pct_list, columns=["PCTILE"]) 
+
+     #change PCTILE column to string so "mean" can be added later
+     lookup = lookup.astype(str) 
+
+     #set PCTILE as the index so you dont output an extra column
+     lookup = lookup.set_index(['PCTILE']) 
+
+     for i, col in enumerate(column_names):
+          lookup[col] = breakpoints[:, i]
+
+     #extract mean for every column. Only the mean is used, so the rest of describe() is skipped
+     means = pd.DataFrame([means], columns = column_names, index = ["mean"])
+
+     #append means to lookup table     
+     return(pd.concat([lookup, means], axis = 0))
+
+
+#-------------------------------------------------------------------------------
+# Name:        percentileCalState
+# Purpose:     Calculate percentile fields and create lookup table at the state level. 
+# 
+# Parameters:
+#   ejscreen_data_df - dataframe containing EJScreen raw data. Must at least contain the columns designated by column_names parameter
+#   output_csv_percentiles - path to output csv that will contain EJScreen dataset
+#   output_xlsx_lookup - path to output xlsx that will contain the percentile lookup table
+#   output - (True/False) whether or not data will be written to csv and excel file respectively
+#   column_names = list containing the columns for which percentiles will be calculated
+#   workers - number of processes used to calculate the percentiles. 1 runs everything in the current process
+#   report - optional run_report.RunReport that records the time of each column (and state) when its detail is turned on
+#   cache_dir - optional directory of cached percentiles. See calLevelPercentiles
+#   group_column - column whose values divide the rows into groups. "ST_ABBREV" (default) for states, or e.g. "REGION"
+#-------------------------------------------------------------------------------
+
+
+def percentileCalState(ejscreen_data_df, output_csv_percentiles = "", output_xlsx_lookup = "", output = False, percentile_column_names = col_names.data_names, workers = 1, report = None, group_column = "ST_ABBREV", cache_dir = "", preview_rows = 0): 
+
+     #find the rows of every state once
+     grouping = getGroups(ejscreen_data_df[group_column])
+
+     #build the combined lookup table: 101 percentile rows and a mean row for every state
+     pctile_columns, lookup = calLevelPercentiles(ejscreen_data_df, percentile_column_names, grouping, workers = workers, report = report, cache_dir = cache_dir, preview_rows = preview_rows)
+
+     #append ejscreen percentiles to original dataset
+     ejscreen_data_df = joinColumns(ejscreen_data_df, pctile_columns)
+     
+     #if true, output to excel and csv respectively
+     if(output == True): 
+          ejscreen_data_df.to_csv(output_csv_percentiles)
+          lookup.to_excel(output_xlsx_lookup)
+    
+     return(ejscreen_data_df, lookup)
+
+#-------------------------------------------------------------------------------
+# Name:        getGroups
+# Purpose:     Internal function that sorts rows by group (e.g. state) so that each group is one contiguous block.
+#              Groups are kept in order of first appearance and rows keep their original order within a group.
+#              Rows with no group value are placed first and are not part of any group.
+# 
+# Returns:
+#   groups - list of group values
+#   order - array of row positions sorted by group
+#   bounds - list of (start, stop) positions of each group in the sorted order
+#-------------------------------------------------------------------------------
+
+def getGroups(group_series):
+
+     groups = [group for group in pd.unique(group_series) if not pd.isna(group)]
+
+     #-1 for rows without a group, so they sort to the front and are skipped
+     codes = pd.Index(groups).get_indexer(group_series)
+
+     order, bounds = getGroupBounds(codes, len(groups))
+
+     return(groups, order, bounds)
+
+#-------------------------------------------------------------------------------
+# Name:        getGroupBounds
+# Purpose:     Internal function that returns the stable sort order of integer group codes (-1 for no group) 
+#              and the (start, stop) positions of each group in that order.
+# 
+#-------------------------------------------------------------------------------
+
+def getGroupBounds(codes, group_count):
+
+     order = np.argsort(codes, kind = 'stable')
+
+     counts = np.bincount(codes[codes >= 0], minlength = group_count)
+     stops = np.cumsum(counts) + np.count_nonzero(codes < 0)
+     bounds = list(zip((stops - counts).tolist(), stops.tolist()))
+
+     return(order, bounds)
+
+#-------------------------------------------------------------------------------
+# Name:        combineLookups
+# Purpose:     Internal function that combines the indicator lookup table with the index lookup table.
+#              State lookup tables keep one REGION column and use PCTILE as the index name.
+# 
+#-------------------------------------------------------------------------------
+
+def combineLookups(indicator_lookup, index_lookup):
+
+     if "REGION" not in indicator_lookup.columns:
+          return(pd.concat([indicator_lookup, index_lookup], axis=1))
+
+     #combines the indicators lookup with the indexes lookup
+     ejscreen_lookup = pd.concat([indicator_lookup, index_lookup.drop(["PCTILE", "REGION"], axis = 1)], axis=1) 
+
+     #removes the percentile column
+     ejscreen_lookup = ejscreen_lookup.drop(['PCTILE'], axis = 1) 
+
+     #sets the index as the percentile column
+     ejscreen_lookup.index.name='PCTILE' 
+
+     return(ejscreen_lookup)
+
+#-------------------------------------------------------------------------------
+# Name:        buildStateLookup
+# Purpose:     Internal function that assembles the state lookup table in a single step. Each state gets 
+#              101 percentile rows followed by a mean row, with PCTILE and REGION columns.
+# 
+#-------------------------------------------------------------------------------
+
+def buildStateLookup(states, state_breakpoints, state_means, column_names):
+
+     pct_list = np.arange(0,101) 
+
+     rows_per_state = len(pct_list) + 1
+     
+     if len(states) == 0:
+          return(pd.DataFrame(columns = ["PCTILE", "REGION"] + list(column_names)))
+
+     values = np.concatenate([state_breakpoints, state_means[:, np.newaxis, :]], axis = 1).reshape(-1, len(column_names))
+
+     lookup = pd.DataFrame(values, columns = column_names, index = pd.Index((pct_list.tolist() + ["mean"]) * len(states), dtype = object))
+     lookup.insert(0, "PCTILE", np.tile(np.append(pct_list, np.nan), len(states)))
+     lookup.insert(1, "REGION", np.repeat(np.array(states, dtype = object), rows_per_state))
+
+     return(lookup)
+
+#-------------------------------------------------------------------------------
+# Name:        percentileScore
+# Purpose:     Calculate percentile fields using the lookup tables of a lookup artifact instead of building new ones.
+#              With a state artifact, each row uses the lookup table of its ST_ABBREV (or the artifact's group column). 
+#              Rows of states that are not in the artifact have no percentiles.
+# 
+# Parameters:
+#   ejscreen_data_df - dataframe containing EJScreen raw data. Must at least contain the columns designated by column_names parameter
+#   lookup_arrays - dictionary returned by loadLookupArtifact
+#   percentile_column_names = list containing the columns for which percentiles will be found
+#-------------------------------------------------------------------------------
+
+def percentileScore(ejscreen_data_df, lookup_arrays, percentile_column_names = col_names.data_names):
+
+     artifact_columns = list(lookup_arrays["columns"])
+     artifact_regions = list(lookup_arrays["regions"])
+
+     missing_columns = [col for col in percentile_column_names if col not in artifact_columns]
+     if len(missing_columns) > 0:
+          raise ValueError("Lookup artifact has no lookup table for " + ", ".join(missing_columns))
+
+     if lookup_arrays["level"] == "state":
+          groups, order, bounds = getGroups(ejscreen_data_df[lookup_arrays.get("group_column", "ST_ABBREV")])
+          values = getColumnValues(ejscreen_data_df, percentile_column_names, order)
+
+          #artifact regions are stored as text, so numeric groups such as REGION are compared as text
+          for group in groups:
+               if str(group) not in artifact_regions:
+                    print("No lookup table for " + str(group) + ", percentiles will be empty")
+
+          region_indexes = [artifact_regions.index(str(group)) if str(group) in artifact_regions else -1 for group in groups]
+     else:
+          order = None
+          values = getColumnValues(ejscreen_data_df, percentile_column_names)
+          bounds = [(0, len(values))]
+          region_indexes = [0]
+
+     pctiles = np.full(values.shape, np.nan, order = "F")
+
+     for i, col in enumerate(percentile_column_names):
+
+          column_index = artifact_columns.index(col)
+
+          for (start, stop), region_index in zip(bounds, region_indexes):
+               if region_index >= 0:
+                    pctiles[start:stop, i] = getPctileArray(lookup_arrays["breakpoints"][region_index, :, column_index], values[start:stop, i])
+
+     if order is not None:
+          sorted_pctiles = pctiles
+          pctiles = np.empty_like(sorted_pctiles)
+          pctiles[order] = sorted_pctiles
+          del sorted_pctiles
+
+     #national percentiles are kept as integers when there are no NA values, the same as percentileCal
+     return(joinColumns(ejscreen_data_df, getPctileColumns(pctiles, percentile_column_names, keep_integers = (order is None))))
+
+#-------------------------------------------------------------------------------
+# Name:        saveLookupArtifact
+# Purpose:     Save a combined lookup table (as built by ejscreen_cal or ejscreenState_cal) as a binary .npz artifact.
+#              The artifact holds, for every region (USA, or each state), the 101 lookup values and the mean of every column.
+# 
+# Parameters:
+#   output_path - path to output .npz file
+#   lookup - combined national or state lookup table
+#   group_column - column that holds the group of each row when the lookup has one table per group. "ST_ABBREV"
+#                  for state lookups, or e.g. "REGION" for lookups built by ejscreenCombined_cal with group_column
+#-------------------------------------------------------------------------------
+
+def saveLookupArtifact(output_path, lookup, group_column = "ST_ABBREV"):
+
+     lookup_arrays = lookupToArrays(lookup)
+
+     #np.savez adds the extension when it is missing
+     if not output_path.endswith(".npz"):
+          output_path += ".npz"
+
+     #saved without compression so the arrays can be memory mapped
+     writeAtomic(output_path, lambda temp_path: np.savez(temp_path,
+                                                          version = np.array(lookup_artifact_version),
+                                                          level = np.array(lookup_arrays["level"]),
+                                                          group_column = np.array(group_column),
+                                                          regions = np.array(lookup_arrays["regions"], dtype = str),
+                                                          columns = np.array(lookup_arrays["columns"], dtype = str),
+                                                          breakpoints = lookup_arrays["breakpoints"],
+                                                          means = lookup_arrays["means"]))
+
+#-------------------------------------------------------------------------------
+# Name:        saveDatasetStore
+# Purpose:     Save the EJScreen dataset as an uncompressed .npz store that ejscreen_store.DatasetStore memory maps, so
+#              records can be read by ID or by state without loading the dataset, and processes that read the same 
+#              store share its pages. Every column is stored as a fixed width array:
+#                numeric and boolean columns keep their type
+#                nullable integer, float and boolean columns are stored as their numpy type with a "mask_<n>" of NA rows
+#                category columns are stored as int32 codes with their categories in "labels_<n>"
+#                other columns are dictionary encoded as text: int32 codes into the sorted values in "labels_<n>"
+#              NA codes are -1. The ID column is stored as the position of each ID in the ID index ("index_ids", the
+#              IDs as text in sorted order, with the row of each in "index_rows"). The columns of each type are stored side by side in one "block_<k>" (rows x columns),
+#              so the values of one record are a short read from each block instead of one read per column. Column n
+#              is column column_positions[n] of block column_blocks[n].
+#
+#              The rows of each state are listed in "group_rows", from group_offsets[i] to group_offsets[i + 1] for 
+#              the i-th of the sorted "groups".
+# 
+# Parameters:
+#   output_path - path to the output .npz file
+#   ejscreen_df - data frame containing the EJScreen dataset
+#   id_column - column of unique IDs that records are read by
+#   group_column - column that records are grouped by. Rows with no value are left out of the groups. The store has
+#                  no groups when the data frame does not have the column
+#-------------------------------------------------------------------------------
+
+def saveDatasetStore(output_path, ejscreen_df, id_column = "ID", group_column = "ST_ABBREV"):
+
+     arrays = {"version": np.array(dataset_store_version),
+               "columns": np.array(ejscreen_df.columns.tolist(), dtype = str)}
+     column_types = []
+     column_values = []
+
+     ids = ejscreen_df[id_column].astype(str).to_numpy()
+     if not pd.Index(ids).is_unique:
+          raise ValueError("ID column " + id_column + " is not unique")
+
+     id_order = np.argsort(ids, kind = "stable")
+     arrays["id_column"] = np.array(id_column)
+     arrays["index_ids"] = np.array(ids[id_order], dtype = str)
+     arrays["index_rows"] = id_order.astype(np.int64)
+
+     for i, col in enumerate(ejscreen_df.columns):
+
+          values = ejscreen_df[col]
+
+          if col == id_column:
+               #the ID index holds every ID in sorted order, so the ID column is stored as positions in it
+               id_positions = np.empty(len(ids), dtype = np.int32)
+               id_positions[id_order] = np.arange(len(ids), dtype = np.int32)
+               column_types.append("id")
+               column_values.append(id_positions)
+          elif isinstance(values.dtype, pd.CategoricalDtype):
+               column_types.append("category")
+               column_values.append(values.cat.codes.to_numpy().astype(np.int32))
+               arrays["labels_" + str(i)] = np.array([str(label) for label in values.cat.categories], dtype = str)
+          elif pd.api.types.is_extension_array_dtype(values.dtype) and (pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype)):
+               column_types.append(str(values.dtype))
+               column_values.append(values.to_numpy(dtype = values.dtype.numpy_dtype, na_value = 0))
+               arrays["mask_" + str(i)] = values.isna().to_numpy()
+          elif values.dtype.kind in "biuf":
+               column_types.append(str(values.dtype))
+               column_values.append(values.to_numpy())
+          else:
+               codes, labels = pd.factorize(values, sort = True)
+               column_types.append("text")
+               column_values.append(codes.astype(np.int32))
+               arrays["labels_" + str(i)] = np.array([str(label) for label in labels], dtype = str)
+
+     #columns of the same type share a block, in column order
+     block_types = list(dict.fromkeys(values.dtype for values in column_values))
+     column_blocks = [block_types.index(values.dtype) for values in column_values]
+     column_positions = [column_blocks[:i].count(block) for i, block in enumerate(column_blocks)]
+
+     for block, block_type in enumerate(block_types):
+          block_columns = [values for values in column_values if values.dtype == block_type]
+          arrays["block_" + str(block)] = np.empty((len(ejscreen_df), len(block_columns)), dtype = block_type)
+          for position, values in enumerate(block_columns):
+               arrays["block_" + str(block)][:, position] = values
+
+     del column_values
+     arrays["column_types"] = np.array(column_types, dtype = str)
+     arrays["column_blocks"] = np.array(column_blocks, dtype = np.int64)
+     arrays["column_positions"] = np.array(column_positions, dtype = np.int64)
+
+     if group_column in ejscreen_df.columns:
+          group_codes, groups = pd.factorize(ejscreen_df[group_column], sort = True)
+          group_order = np.argsort(group_codes, kind = "stable")
+          group_counts = np.bincount(group_codes[group_codes >= 0], minlength = len(groups))
+          arrays["group_rows"] = group_order[group_codes[group_order] >= 0].astype(np.int64)
+          arrays["groups"] = np.array([str(group) for group in groups], dtype = str)
+     else:
+          group_column = ""
+          group_counts = np.array([], dtype = np.int64)
+          arrays["group_rows"] = np.array([], dtype = np.int64)
+          arrays["groups"] = np.array([], dtype = str)
+
+     arrays["group_column"] = np.array(group_column)
+     arrays["group_offsets"] = np.concatenate([[0], np.cumsum(group_counts)]).astype(np.int64)
+
+     writeAtomic(output_path, lambda temp_path: saveAlignedArrays(temp_path, arrays))
+
+#-------------------------------------------------------------------------------
+# Name:        saveAlignedArrays
+# Purpose:     Internal function that saves arrays to an uncompressed .npz file, like np.savez, with the data of each
+#              array starting at a multiple of 64 bytes in the file. Memory mapped arrays are then aligned, which 
+#              numpy needs for fast searches and reads. Each zip entry is padded with an extra field before its .npy 
+#              file (whose header already ends at a multiple of 64 bytes). np.load reads the file as usual.
+# 
+#-------------------------------------------------------------------------------
+
+def saveAlignedArrays(output_path, arrays):
+
+     with open(output_path, "wb") as output_file, zipfile.ZipFile(output_file, "w", zipfile.ZIP_STORED, allowZip64 = True) as output_zip:
+
+          for name, values in arrays.items():
+
+               entry = zipfile.ZipInfo(name + ".npy", date_time = (1980, 1, 1, 0, 0, 0))
+
+               #the local file header is 30 bytes, the file name, the padding field and the 20 byte zip64 field
+               data_start = output_file.tell() + 30 + len(entry.filename.encode("utf8")) + 4 + 20
+               padding = -data_start % 64
+               entry.extra = struct.pack("<HH", 0xD935, padding) + bytes(padding)
+
+               with output_zip.open(entry, "w", force_zip64 = True) as entry_file:
+                    np.lib.format.write_array(entry_file, np.asanyarray(values), allow_pickle = False)
+
+#-------------------------------------------------------------------------------
+# Name:        loadLookupArtifact
+# Purpose:     Load a lookup artifact saved by saveLookupArtifact.
+#              With memory_map True, breakpoints and means are read-only memory maps of the artifact file instead of 
+#              copies, so processes that load the same artifact share its pages.
+# 
+# Returns:
+#   Dictionary with:
+#     level - "national" or "state"
+#     group_column - column that holds the group of each row for a state level artifact
+#     regions - list of region names ("USA" or state abbreviations)
+#     columns - list of column names
+#     breakpoints - array (regions x 101 x columns) of lookup values
+#     means - array (regions x columns) of column means
+#-------------------------------------------------------------------------------
+
+def loadLookupArtifact(artifact_path, memory_map = False):
+
+     with np.load(artifact_path, allow_pickle = False) as artifact:
+
+          version = int(artifact["version"])
+          if version > lookup_artifact_version:
+               raise ValueError(artifact_path + " is lookup artifact version " + str(version) + ", this tool reads version " + str(lookup_artifact_version) + " or lower")
+
+          return({"level": str(artifact["level"]),
+                  "group_column": str(artifact["group_column"]) if "group_column" in artifact else "ST_ABBREV",
+                  "regions": artifact["regions"].tolist(),
+                  "columns": artifact["columns"].tolist(),
+                  "breakpoints": mapArtifactArray(artifact_path, "breakpoints") if memory_map else artifact["breakpoints"],
+                  "means": mapArtifactArray(artifact_path, "means") if memory_map else artifact["means"]})
+
+#-------------------------------------------------------------------------------
+# Name:        mapArtifactArray
+# Purpose:     Internal function that memory maps one array of an uncompressed .npz file. The array is found from its
+#              zip entry and .npy header, and the data after the header is mapped read-only.
+# 
+#-------------------------------------------------------------------------------
+
+def mapArtifactArray(artifact_path, name):
+
+     with zipfile.ZipFile(artifact_path) as artifact_zip:
+          entry = artifact_zip.getinfo(name + ".npy")
+
+     if entry.compress_type != zipfile.ZIP_STORED:
+          raise ValueError(artifact_path + " is compressed and cannot be memory mapped")
+
+     with open(artifact_path, "rb") as artifact_file:
+          offset, shape, fortran_order, dtype = readArrayHeader(artifact_file, entry)
+
+     return(np.memmap(artifact_path, dtype = dtype, mode = "r", offset = offset, shape = shape, order = "F" if fortran_order else "C"))
+
+#-------------------------------------------------------------------------------
+# Name:        readArrayHeader
+# Purpose:     Internal function that reads the zip entry and .npy header of one array of an uncompressed .npz file.
+#              Returns the offset of the array's data in the file, its shape, whether it is in Fortran order and its 
+#              dtype.
+# 
+#-------------------------------------------------------------------------------
+
+def readArrayHeader(artifact_file, entry):
+
+     #the local file header is 30 bytes followed by the file name and an extra field of variable length
+     artifact_file.seek(entry.header_offset + 26)
+     name_length, extra_length = struct.unpack("<HH", artifact_file.read(4))
+     artifact_file.seek(entry.header_offset + 30 + name_length + extra_length)
+
+     #the header is the length of a Python dict literal followed by the dict. It is read with ast.literal_eval, which
+     #is several times faster than the numpy reader, so a dataset store can find hundreds of columns quickly
+     version = np.lib.format.read_magic(artifact_file)
+     if version == (1, 0):
+          header_length = struct.unpack("<H", artifact_file.read(2))[0]
+     else:
+          header_length = struct.unpack("<I", artifact_file.read(4))[0]
+
+     header = ast.literal_eval(artifact_file.read(header_length).decode("utf8" if version >= (3, 0) else "latin1"))
+
+     return(artifact_file.tell(), tuple(header["shape"]), header["fortran_order"], np.lib.format.descr_to_dtype(header["descr"]))
+
+#-------------------------------------------------------------------------------
+# Name:        writeLookup
+# Purpose:     Write a combined lookup table to a file. The format is set by the extension:
+#                .xlsx - written one row at a time with a write-only workbook, so memory use does not grow with the table
+#                .csv - plain text table
+#                .parquet - columnar table with PCTILE as a text column (requires the pyarrow package)
+#                .npz - binary lookup artifact (see saveLookupArtifact)
+#              Every format keeps the same layout: the PCTILE index, the REGION column of state tables and a mean row
+#              after the 101 percentile rows of each region.
+# 
+# Parameters:
+#   lookup - combined national or state lookup table
+#   output_path - path to output file
+#-------------------------------------------------------------------------------
 
-def percentileCalState(ejscreen_data_df, output_csv_percentiles = "", output_xlsx_lookup = "", output = False, percentile_column_names = col_names.data_names): 
-    
-     #create a copy of the input data. The percentiles will be appended to this at the end. 
-     final_df = ejscreen_data_df.copy() 
+def writeLookup(lookup, output_path):
 
-     #generate list of percentiles
-     pct_list = np.arange(0,101) 
+     extension = os.path.splitext(output_path)[1].lower()
 
-     #create empty dataframe that state lookup tables will be copied into
-     lookup = pd.DataFrame() 
+     if extension == ".npz":
+          saveLookupArtifact(output_path, lookup)
+     elif extension == ".csv":
+          writeAtomic(output_path, lookup.to_csv)
+     elif extension == ".parquet":
+          writeAtomic(output_path, lookup.rename_axis("PCTILE").reset_index().astype({"PCTILE": str}).to_parquet)
+     elif extension in [".xlsx", ".xlsm"]:
+          writeAtomic(output_path, lambda temp_path: writeLookupExcel(lookup, temp_path))
+     else:
+          writeAtomic(output_path, lookup.to_excel)
 
-     print("Generating Lookup Table...")
-     for state in pd.unique(ejscreen_data_df['ST_ABBREV']):
+#-------------------------------------------------------------------------------
+# Name:        writeLookupFiles
+# Purpose:     Internal function that writes a lookup table to output_lookup and to the lookup artifact 
+#              output_artifact. Either path can be "" to skip it.
+# 
+#-------------------------------------------------------------------------------
 
-          #create temp lookup table for state
-          temp_lookup = pd.DataFrame(pct_list, columns = ["PCTILE"]) 
+def writeLookupFiles(lookup, output_lookup, output_artifact, group_column = "ST_ABBREV"):
 
-          #set region column to the state name
-          temp_lookup['REGION'] = state 
+     if output_lookup != "":
+          writeLookup(lookup, output_lookup)
 
-          #create dataframe of only the data of the state being operated on
-          state_data = ejscreen_data_df[ejscreen_data_df['ST_ABBREV'] == state] 
+     if output_artifact != "":
+          saveLookupArtifact(output_artifact, lookup, group_column)
 
-          #generate statistics for columns in state dataset
-          desc = state_data[percentile_column_names].describe() 
+#-------------------------------------------------------------------------------
+# Name:        writeLookupExcel
+# Purpose:     Internal function that writes a lookup table to an Excel workbook one row at a time. The cells are the 
+#              same as DataFrame.to_excel writes, including the bold header row and index column.
+# 
+#-------------------------------------------------------------------------------
 
-          #extract mean for every column from stats
-          means = desc.iloc[[1]] 
+def writeLookupExcel(lookup, output_path):
 
-          for col in percentile_column_names:
-               
-               #Create lookup table
+     from openpyxl import Workbook
+     from openpyxl.cell import WriteOnlyCell
+     from openpyxl.styles import Alignment, Border, Font, Side
 
-               #find the value of every percentile from 0-100 ignoring NA values
-               temp_lookup[col]= np.nanpercentile(state_data[col], pct_list) 
+     workbook = Workbook(write_only = True)
+     sheet = workbook.create_sheet("Sheet1")
 
-          #append mean values to end of lookup table
-          temp_lookup = pd.concat([temp_lookup, means], axis = 0)     
-          
-          #set REGION cell in mean row to the state name. This is done twice, but doing so this way preserves row order.
-          temp_lookup['REGION'] = state  
-          
-          #append state lookup table to the combined lookup table.
-          lookup = pd.concat([lookup, temp_lookup]) 
-          
+     thin = Side(style = "thin")
 
-     print("Lookup Table Complete")
+     def headerCell(value):
+          cell = WriteOnlyCell(sheet, value = value)
+          cell.font = Font(bold = True)
+          cell.border = Border(left = thin, right = thin, top = thin, bottom = thin)
+          cell.alignment = Alignment(horizontal = "center", vertical = "top")
+          return(cell)
 
-     for state in pd.unique(ejscreen_data_df['ST_ABBREV']):
+     sheet.append([headerCell(lookup.index.name)] + [headerCell(col) for col in lookup.columns])
 
-          print(state)
+     for index_value, row in zip(lookup.index, lookup.itertuples(index = False, name = None)):
+          sheet.append([headerCell(index_value)] + [None if pd.isna(value) else value for value in row])
 
-          #get state lookup table for state being operated on
-          state_lookup = lookup[lookup['REGION'] == state] 
+     workbook.save(output_path)
 
-          #isolate state data from source dataset
-          state_data = ejscreen_data_df[ejscreen_data_df['ST_ABBREV'] == state] 
+#-------------------------------------------------------------------------------
+# Name:        lookupToArrays
+# Purpose:     Internal function that converts a national or state lookup table to the arrays of a lookup artifact.
+#              Each region has 101 percentile rows followed by a mean row.
+# 
+#-------------------------------------------------------------------------------
 
-          for col in percentile_column_names:
-               
-               #isolate column in lookup table
-               lookupList = (state_lookup[col].values.tolist())  
+def lookupToArrays(lookup):
 
-               #Calculate EJScreen Percentiles
-               ejscreen_data_df.update(state_data[col].apply(lambda x: getPctile(lookupList, x))) #calculate percentiles for input data
+     rows_per_region = 102
 
-     print('Renaming Columns...')
-     for col in percentile_column_names:
-        
-        #rename columns in ejscreen percentiles dataset
-        ejscreen_data_df.rename(columns = {col: ("P_" + col)}, inplace = True)
+     if "REGION" in lookup.columns:
+          level = "state"
+          regions = [str(region) for region in pd.unique(lookup["REGION"])]
+          columns = [col for col in lookup.columns if col not in ["PCTILE", "REGION"]]
+     else:
+          level = "national"
+          regions = ["USA"]
+          columns = list(lookup.columns)
 
-        #append ejscreen percentiles dataset to original dataset
-        final_df[("P_" + col)] = ejscreen_data_df[("P_" + col)]
+     values = lookup[columns].to_numpy(dtype=float).reshape(len(regions), rows_per_region, len(columns))
 
-     #update field name that doesnt follow naming convention
-     if "P_PRE1960PCT" in final_df.columns:   
-        final_df.rename(columns={"P_PRE1960PCT":"P_LDPNT"}, inplace = True)
-     
-     #if true, output to excel and csv respectively
-     if(output == True): 
-          final_df.to_csv(output_csv_percentiles)
-          lookup.to_excel(output_xlsx_lookup)
-    
-     return(final_df, lookup)
+     return({"level": level,
+             "regions": regions,
+             "columns": columns,
+             "breakpoints": values[:, :rows_per_region - 1, :],
+             "means": values[:, rows_per_region - 1, :]})
 
 #-------------------------------------------------------------------------------
 # Name:        calBinTxt
@@ -349,47 +2144,89 @@ def percentileCalState(ejscreen_data_df, output_csv_percentiles = "", output_xls
 #   df - Required. Input data frame containing percentile columns starting with P_.
 #   out_table - Optional. path to output csv that will contain output dataset.
 #   output - Required. If False, csv output will not be written.
+#   text_categories - Optional. If True, T_ fields are categoricals with one category per percentile instead of text.
 # 
 # Returns:
 #   Original data frame with Bin "B_" and Text "T_" fields appended. 
 #-------------------------------------------------------------------------------
 
-def calBinTxt(df, out_table = "", output = False): 
+def calBinTxt(df, out_table = "", output = False, text_categories = False): 
     
-     print("Initializing...")
-
      p_col = [col for col in df if col.startswith("P_")]
      
-     print("Getting percentile columns...")
-     print(p_col)
-     
+     #new columns are collected here and added to the data frame in one block
+     bin_columns = {}
+     text_columns = {}
 
-     print("Working on Bin fields...")
-
-     bindf = pd.DataFrame()
      for col in p_col:
           
+          #Calculate EJScreen Bins
+          bin_columns[(col.replace("P_", "B_"))] = getBinArray(df[col].values)
           
-          #Calculate EJScreen Percentiles
-          df[(col.replace("P_", "B_"))] = df[col].apply(lambda x: getBin(x))
-          
-     print("Working on Text fields...")
      for col in p_col:
          
-         df[(col.replace("P_", "T_"))] = (df[col].astype('Int64').astype("str") + " %ile")
-     
-         #df[(col.replace("P_", "T_"))] = (df[col].astype('Int64').astype("str").fillna("delete")+ " %ile")
-         df[(col.replace("P_", "T_"))] = df[(col.replace("P_", "T_"))].replace("<NA> %ile", None)
+         text_columns[(col.replace("P_", "T_"))] = getTxtArray(df[col].values, text_categories)
      
+     df = joinColumns(df, {**bin_columns, **text_columns})
         
      if(output == True):
-         print("Writing to csv...")
          df.to_csv(out_table)
-     
-     print("Complete")
     
      return(df)
 
+#-------------------------------------------------------------------------------
+# Name:        getBinArray
+# Purpose:     Internal function used for calculating bins for a whole column of percentiles at once.
+#              Returns the same values as calling getBin on every row.
+# 
+#-------------------------------------------------------------------------------
+
+def getBinArray(pctiles):
+
+     pctiles = np.asarray(pctiles, dtype = float)
+
+     #lowest percentile of bins 2 through 11. Anything lower is bin 1
+     bin_thresholds = np.array([10, 20, 30, 40, 50, 60, 70, 80, 90, 95])
+
+     #the number of thresholds at or below the percentile gives the bin
+     bins = np.searchsorted(bin_thresholds, pctiles, side = 'right') + 1
+
+     na_values = np.isnan(pctiles)
+     if na_values.any():
+          bins = bins.astype(float)
+          bins[na_values] = np.nan
+
+     return(bins)
+
+#-------------------------------------------------------------------------------
+# Name:        getTxtArray
+# Purpose:     Internal function used for creating the text ("50 %ile") for a whole column of percentiles at once.
+#              Labels are taken from a table indexed by percentile. NA percentiles have no text.
+#              With categorical True, the percentiles are used as the codes of a categorical and no text is copied.
+# 
+#-------------------------------------------------------------------------------
+
+def getTxtArray(pctiles, categorical = False):
+
+     pctiles = np.asarray(pctiles, dtype = float)
+
+     na_values = np.isnan(pctiles)
+     indexes = np.where(na_values, 0, pctiles).astype(np.int64)
+
+     #percentiles are normally 0-100, but the table grows if a larger value is ever passed in
+     label_count = max(101, int(indexes.max()) + 1) if len(indexes) > 0 else 101
+
+     if categorical:
+          indexes[na_values] = -1
+          return(pd.Categorical.from_codes(indexes, categories = getTxtLabels(label_count)))
+
+     labels = np.array(getTxtLabels(label_count) + [None], dtype = object)
+
+     #the last entry of the label table is None, used for NA percentiles
+     indexes[na_values] = label_count
+
+     return(labels[indexes])
+
 def getBin(pct):
 
      if pd.isna(pct):
@@ -419,49 +2256,314 @@ def getBin(pct):
             return 1
 
 
+#-------------------------------------------------------------------------------
+# Name:        calExceedCounts
+# Purpose:     Internal function used for counting how many 2 factor and 5 factor EJ Indexes exceed the 80th percentile.
+# 
+#-------------------------------------------------------------------------------
+
+def calExceedCounts(ejscreen_full):
+
+    #get 2 factor percentile columns
+    index_names_2f = [i for i in col_names.index_names if i.startswith('P_D2_')] 
+    
+    #get 5 factor percentiles columns
+    index_names_5f = [i for i in col_names.index_names if i.startswith('P_D5_')] 
+
+    #columns are counted one at a time, because selecting a list of columns would consolidate the whole data frame
+    #a count of no columns is float, the same as DataFrame.sum(axis=1) returns
+    def countExceeding(index_names):
+        counts = np.zeros(len(ejscreen_full), dtype = (np.int64 if len(index_names) > 0 else float))
+        for col in index_names:
+            counts += (ejscreen_full[col].to_numpy(dtype = float) >= 80)
+        return(counts)
+
+    exceed_counts = {}
+
+    #count how many 2 factor EJ Indexes exceed the 80th percentile
+    exceed_counts['EXCEED_COUNT_80'] = countExceeding(index_names_2f) 
+    
+    #count how many 5 factor EJ Indexes exceed the 80th percentile
+    exceed_counts['EXCEED_COUNT_80_SUPP'] = countExceeding(index_names_5f) 
+
+    return(joinColumns(ejscreen_full, exceed_counts))
+
+#-------------------------------------------------------------------------------
+# Name:        readSchemaTypes
+# Purpose:     Read the field types of a schema csv in the format of the Batch Update Fields tool (e.g. ejscreen_schema.csv).
+#              Returns a dictionary of source field to "text", "integer" or "float", or None when schema_path is "".
+# 
+#-------------------------------------------------------------------------------
+
+def readSchemaTypes(schema_path):
+
+    if schema_path == "":
+        return(None)
+
+    schema_df = pd.read_csv(schema_path, dtype = str)
+
+    kinds = {"text": "text", "short": "integer", "long": "integer", "biginteger": "integer", "float": "float", "double": "float"}
+
+    schema_types = {}
+    for source_field, field_type in zip(schema_df["Source field"], schema_df["Type"]):
+        if str(field_type).strip().lower() in kinds:
+            schema_types[source_field] = kinds[str(field_type).strip().lower()]
+
+    return(schema_types)
+
+#-------------------------------------------------------------------------------
+# Name:        applySchemaTypes
+# Purpose:     Internal function that stores each column of a data frame in the most compact type that keeps both
+#              its values and its csv output the same, based on the schema field type of the column:
+#                  integer and float fields - integer columns use the smallest integer type that holds their values
+#                      (int8 for percentiles, bins and counts). Float columns of whole numbers, such as percentiles
+#                      and bins with NA values, are stored as float32, which holds them exactly. Other float
+#                      columns would lose precision as float32 and are not changed.
+#                  text fields - text with repeated values (e.g. state and county names) is stored as a categorical.
+#                      Text that is mostly unique, such as ID, is not changed.
+#              Columns that are not in the schema or are in skip_columns (e.g. columns that were already typed) 
+#              are not changed. The data frame is returned as it is when schema_types is None.
+# 
+# Parameters:
+#   df - data frame
+#   schema_types - dictionary returned by readSchemaTypes, or None
+#   skip_columns - columns that are not changed
+#-------------------------------------------------------------------------------
+
+def applySchemaTypes(df, schema_types, skip_columns = ()):
+
+    if schema_types is None:
+        return(df)
+
+    typed_columns = {}
+
+    for col in df.columns:
+        if col in schema_types and col not in skip_columns:
+            typed = getCompactColumn(df[col], schema_types[col])
+            if typed is not None:
+                typed_columns[col] = typed
+
+    if len(typed_columns) == 0:
+        return(df)
+
+    return(joinColumns(df, typed_columns))
+
+#-------------------------------------------------------------------------------
+# Name:        getCompactColumn
+# Purpose:     Internal function that returns a column in a compact type (see applySchemaTypes), or None when it 
+#              is already compact or cannot be stored more compactly.
+# 
+#-------------------------------------------------------------------------------
+
+def getCompactColumn(column, kind):
+
+    dtype = column.dtype
+
+    if kind == "text":
+        if dtype == object and column.nunique(dropna = False) <= len(column) // 2:
+            return(pd.Categorical(column.to_numpy()))
+        return(None)
+
+    if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+        return(None)
+
+    values = column.to_numpy()
+
+    if dtype.kind in "iu":
+        for int_type in [np.int8, np.int16, np.int32]:
+            if np.dtype(int_type).itemsize >= dtype.itemsize:
+                return(None)
+            if len(values) == 0 or (values.min() >= np.iinfo(int_type).min and values.max() <= np.iinfo(int_type).max):
+                return(values.astype(int_type))
+        return(None)
+
+    #float32 holds every whole number below 2**24 exactly
+    whole_values = values[~np.isnan(values)]
+    if dtype.itemsize > 4 and np.all(np.abs(whole_values) < 2**24) and np.all(whole_values == np.floor(whole_values)):
+        return(values.astype(np.float32))
+
+    return(None)
+
+#-------------------------------------------------------------------------------
+# Name:        getTxtLabels
+# Purpose:     Internal function that returns the text of each percentile: ["0 %ile", "1 %ile", ... "100 %ile"]
+# 
+#-------------------------------------------------------------------------------
+
+def getTxtLabels(label_count = 101):
+
+     return([str(i) + " %ile" for i in range(label_count)])
+
+
 #-------------------------------------------------------------------------------
 # Name:        exportSpatial
-# Purpose:     Joins data frame to geometry and writes to geodatabase
+# Purpose:     Joins data frame to geometry and writes to geodatabase. When output_fc is in a GeoPackage, the
+#              join is done by exportGeoPackage without ArcGIS Pro instead.
 # 
 # Parameters:
 #   areas - Path to feature class containing geometry being joined to data frame
 #   data_df - Data frame to be joined to the geometry
-#   output_fc - Path to output feature class in geodatabase
+#   output_fc - Path to output feature class in geodatabase, or to a GeoPackage layer (e.g. "data/EJSCREEN.gpkg/EJSCREEN_Full")
 #   schema = path to csv file containing field update schema. Format can be found here: https://pro.arcgis.com/en/pro-app/latest/tool-reference/data-management/batch-update-fields.htm
 #   join_field = the name of the ID field that will be used to join the dataframe to the spatial dataset
+#   report = optional run_report.RunReport that records the time of each step when its detail is turned on
+#   batch_size = number of features read and written at a time by exportGeoPackage
 # 
 #-------------------------------------------------------------------------------
 
-def exportSpatial(areas, data_df, output_fc, schema = "", join_field = "ID"):
+def exportSpatial(areas, data_df, output_fc, schema = "", join_field = "ID", report = None, batch_size = 10000):
+
+    #GeoPackage output does not need ArcGIS Pro
+    if geopackage.isGeoPackage(output_fc):
+        exportGeoPackage(areas, data_df, output_fc, schema, join_field, report, batch_size)
+        return
 
     import arcpy
     from arcgis import GeoAccessor, GeoSeriesAccessor
 
-    
-    print("Reading Spatial Dataset...")
+    if report is None:
+        report = run_report.RunReport(verbose = False)
 
     #convert block group feature class to spatial dataframe
-    sdf = pd.DataFrame.spatial.from_featureclass(areas) 
-
-    print("Merging Datasets...")
+    with report.step("read_geometry"):
+        sdf = pd.DataFrame.spatial.from_featureclass(areas) 
 
     #join ejscreen data to spatial dataframe based on ID
-    ejscreen_df = pd.merge(sdf, data_df, on=join_field) 
+    with report.step("merge"):
+        ejscreen_df = pd.merge(sdf, data_df, on=join_field) 
 
     
     #set path of initial output featureclass to be the same as the source
     temp_path = os.path.dirname(areas) + "\output"  
 
-    print("Writing to geodatabase...")
-    
     #export joined spatial dataframe to feature class.
-    temp = ejscreen_df.spatial.to_featureclass(location=temp_path, sanitize_columns = False) 
+    with report.step("write_featureclass", len(ejscreen_df)):
+        temp = ejscreen_df.spatial.to_featureclass(location=temp_path, sanitize_columns = False) 
 
     if(schema != ""):
-        print("Using schema to update fields...")
 
         #this allows you to set field order, aliases, data types, and string lenghts. 
-        arcpy.management.BatchUpdateFields(temp, output_fc, schema) 
+        with report.step("update_fields"):
+            arcpy.management.BatchUpdateFields(temp, output_fc, schema) 
+
+#-------------------------------------------------------------------------------
+# Name:        exportGeoPackage
+# Purpose:     Joins data frame to the geometry of a GeoPackage layer and writes a new GeoPackage, reading and 
+#              writing batch_size features at a time, so the geometry is never all in memory. Each batch of
+#              features is matched to its rows of the data frame through a hash index of the join field, and
+#              features without a matching row are left out, the same as the inner join of exportSpatial. The 
+#              output fields, their order, types and aliases are set from the schema when the table is created, 
+#              so the output is written once. Without a schema, the output has the fields of the layer followed 
+#              by the columns of the data frame.
+# 
+# Parameters:
+#   areas - Path to a GeoPackage, optionally followed by the layer name (e.g. "data/BlockGroups.gpkg/BlockGroups").
+#           The first feature table is used when there is no layer name
+#   data_df - Data frame to be joined to the geometry. The join field must be unique
+#   output_gpkg - Path to the output GeoPackage, optionally followed by the layer name. The layer is named 
+#                 after the file when there is no layer name. An existing file is replaced
+#   schema = path to csv file in the format of the Batch Update Fields tool. The Source field of each output
+#            field is a column of the data frame or a field of the layer
+#   join_field = the name of the ID field that will be used to join the dataframe to the spatial dataset
+#   report = optional run_report.RunReport that records the time of each step when its detail is turned on
+#   batch_size = number of features read and written at a time
+# 
+#-------------------------------------------------------------------------------
+
+def exportGeoPackage(areas, data_df, output_gpkg, schema = "", join_field = "ID", report = None, batch_size = 10000):
+
+    if report is None:
+        report = run_report.RunReport(verbose = False)
+
+    source_path, source_layer = geopackage.splitPath(areas)
+    output_path, output_layer = geopackage.splitPath(output_gpkg)
+    if output_layer is None:
+        output_layer = os.path.splitext(os.path.basename(output_path))[0]
+
+    source = geopackage.openGeoPackage(source_path)
+    layer_info = geopackage.readLayerInfo(source, source_layer)
+    layer_fields = [name for name, field_type in layer_info["fields"]]
+
+    #output fields as (name, type, alias), and the column or layer field each one is read from
+    if schema != "":
+        schema_fields = geopackage.readSchema(schema)
+        fields = [(target, field_type, alias) for target, source_field, field_type, alias in schema_fields]
+        source_fields = [source_field for target, source_field, field_type, alias in schema_fields]
+    else:
+        fields = [(name, field_type, name) for name, field_type in layer_info["fields"] if name not in data_df.columns]
+        fields += [(col, getGeoPackageType(data_df[col].dtype), col) for col in data_df.columns]
+        source_fields = [name for name, field_type, alias in fields]
+
+    missing = [col for col in source_fields if col not in data_df.columns and col not in layer_fields]
+    if len(missing) > 0:
+        raise ValueError("Source fields not found in the data frame or the layer: " + ", ".join(missing))
+
+    if join_field not in layer_fields:
+        raise ValueError("Join field " + join_field + " not found in the layer")
+
+    #hash index from the join field to the row of the data frame
+    with report.step("index"):
+        id_index = pd.Index(data_df[join_field])
+        if not id_index.is_unique:
+            raise ValueError("Join field " + join_field + " is not unique in the data frame")
+
+        data_columns = {col: data_df[col].to_numpy() for col in source_fields if col in data_df.columns}
+
+    #fields read from the layer with each feature, after the geometry and the join field
+    read_fields = [col for col in source_fields if col not in data_columns]
+
+    output_names = [name for name, field_type, alias in fields]
+
+    #written to a temporary file that replaces output_path once it is complete
+    def writeLayer(temp_path):
+
+        output = geopackage.createGeoPackage(temp_path, output_layer, source, layer_info, fields)
+
+        try:
+            with report.step("write_geopackage", len(data_df)):
+
+                for batch in geopackage.readFeatures(source, layer_info, [join_field] + read_fields, batch_size):
+
+                    batch_columns = list(zip(*batch))
+                    positions = id_index.get_indexer(batch_columns[1])
+                    matched = np.flatnonzero(positions >= 0)
+                    rows = positions[matched]
+
+                    values = []
+                    for col in source_fields:
+                        if col in data_columns:
+                            values.append(data_columns[col][rows].tolist())
+                        else:
+                            layer_values = batch_columns[2 + read_fields.index(col)]
+                            values.append([layer_values[i] for i in matched])
+
+                    geometries = [batch_columns[0][i] for i in matched]
+
+                    geopackage.writeFeatures(output, output_layer, layer_info["geometry_column"], output_names, zip(geometries, *values))
+        finally:
+            output.close()
+
+    try:
+        writeAtomic(output_path, writeLayer)
+    finally:
+        source.close()
+
+#-------------------------------------------------------------------------------
+# Name:        getGeoPackageType
+# Purpose:     Internal function that returns the GeoPackage data type of a data frame column.
+# 
+#-------------------------------------------------------------------------------
+
+def getGeoPackageType(dtype):
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return("BOOLEAN")
+    if pd.api.types.is_integer_dtype(dtype):
+        return("INTEGER")
+    if pd.api.types.is_float_dtype(dtype):
+        return("DOUBLE")
+
+    return("TEXT")
 
 #-------------------------------------------------------------------------------
 # Name:        getPctile
@@ -492,6 +2594,336 @@ def getPctile(lookup_list, data_value):
           
           return(pctile)
 
+#-------------------------------------------------------------------------------
+# Name:        getPctileArray
+# Purpose:     Internal function used for calculating percentiles for a whole column at once.
+#              Returns the same values as calling getPctile on every row: NA values stay NA, values
+#              between two lookup values fall back one percentile, and tied lookup values return the
+#              lowest percentile. Values above the last lookup value are given the last percentile.
+# 
+# Parameters:
+#   lookup_values - array of lookup table values for one column, ordered by percentile
+#   data_values - array of values to convert to percentiles
+#
+# Returns:
+#   Array of percentiles. Integer if there are no NA values, float otherwise (matching Series.apply(getPctile)).
+#-------------------------------------------------------------------------------
+
+def getPctileArray(lookup_values, data_values):
+
+     lookup_values = np.asarray(lookup_values, dtype=float)
+     data_values = np.asarray(data_values, dtype=float)
+
+     #a running maximum is always sorted, and its first value >= x is at the same place as the 
+     #first lookup value >= x, so it can be searched even if interpolation left the lookup slightly out of order
+     search_values = np.maximum.accumulate(lookup_values)
+
+     #retrieves the index of the first value in the lookup table that is greater than or equal to each input value
+     lookup_index = np.searchsorted(search_values, data_values, side='left')
+
+     above_max = lookup_index >= len(lookup_values)
+     lookup_index[above_max] = len(lookup_values) - 1
+
+     #Fall back one percentile (unless the input value is equal to the lookup table value)
+     fall_back = (lookup_index > 0) & (lookup_values[lookup_index] != data_values) & ~above_max
+     lookup_index = lookup_index - fall_back
+
+     #in the case of tied values, the lowest percentile is taken
+     pctiles = getFirstIndexes(lookup_values)[lookup_index]
+
+     na_values = np.isnan(data_values)
+     if na_values.any():
+          pctiles = pctiles.astype(float)
+          pctiles[na_values] = np.nan
+
+     return(pctiles)
+
+#-------------------------------------------------------------------------------
+# Name:        getFirstIndexes
+# Purpose:     Internal function that maps each position of a lookup table to the first position holding 
+#              the same value. This is the vectorized equivalent of lookup_list.index(lookup_list[i]).
+# 
+#-------------------------------------------------------------------------------
+
+def getFirstIndexes(lookup_values):
+
+     first_index = {}
+     
+     return(np.array([first_index.setdefault(value, index) for index, value in enumerate(np.asarray(lookup_values).tolist())], dtype=np.int64))
+
+#-------------------------------------------------------------------------------
+# Name:        calGroupPercentiles
+# Purpose:     Internal function used for calculating lookup tables, means and percentiles for every column 
+#              of a dataset whose rows are divided into groups (a single group at the national level).
+#              Every column is independent, so with more than 1 worker the columns are spread across a 
+#              process pool. The workers read and write the data through memory mapped files instead of 
+#              receiving pickled copies. Each column is calculated the same way in both cases, so the results 
+#              do not depend on the number of workers.
+# 
+# Parameters:
+#   values - 2 dimensional array (rows x columns) of values, sorted by group unless `order` is given
+#   bounds - list of (start, stop) row positions of each group, in the sorted order
+#   column_names - list of the column names, used for the run report
+#   workers - number of processes to use
+#   report - optional run_report.RunReport that records the time of each column
+#   group_names - optional list of the group names. When given, the time of each group is recorded as well
+#   order - optional array of row positions sorted by group (see getGroups). When given, values are in their 
+#           original row order and so are the returned percentiles
+#   preview_rows - when greater than 0, the lookup table of each group with more rows than this is found from a 
+#                  random sample of preview_rows of its rows (see scoreColumn)
+#   preview_errors - optional array (groups x columns) that receives the largest difference between the preview
+#                    percentiles and the exact percentiles of each group's validation sample
+#
+# Returns:
+#   breakpoints - array (groups x 101 x columns) of lookup table values
+#   means - array (groups x columns) of column means
+#   pctiles - array (rows x columns) of percentiles. Rows that are not in a group are NA
+#-------------------------------------------------------------------------------
+
+def calGroupPercentiles(values, bounds, column_names, workers = 1, report = None, group_names = None, order = None, preview_rows = 0, preview_errors = None):
+
+     row_count, column_count = values.shape
+
+     if workers > 1 and column_count > 1 and row_count > 0:
+          
+          with tempfile.TemporaryDirectory() as temp_dir:
+
+               values_path = os.path.join(temp_dir, "values.dat")
+               pctiles_path = os.path.join(temp_dir, "pctiles.dat")
+
+               #columns are stored one after another so each worker only maps the column it works on
+               values_map = np.memmap(values_path, dtype = float, mode = "w+", shape = values.shape, order = "F")
+               values_map[:] = values
+               values_map.flush()
+               del values_map
+               
+               pctiles_map = np.memmap(pctiles_path, dtype = float, mode = "w+", shape = values.shape, order = "F")
+               del pctiles_map
+
+               order_path = None
+               if order is not None:
+                    order_path = os.path.join(temp_dir, "order.dat")
+                    np.asarray(order, dtype = np.int64).tofile(order_path)
+
+               with ProcessPoolExecutor(max_workers = workers) as pool:
+                    futures = [pool.submit(scoreMappedColumn, values_path, pctiles_path, row_count, i, bounds, order_path, preview_rows) for i in range(column_count)]
+
+                    results = [future.result() for future in futures]
+
+               pctiles_map = np.memmap(pctiles_path, dtype = float, mode = "r", shape = values.shape, order = "F")
+               pctiles = np.array(pctiles_map)
+               del pctiles_map
+
+     else:
+
+          pctiles = np.full(values.shape, np.nan, order = "F")
+
+          results = []
+          for i in range(column_count):
+               group_seconds = np.zeros(len(bounds))
+               group_errors = np.zeros(len(bounds))
+               column_breakpoints, column_means = scoreColumn(values[:, i], bounds, pctiles[:, i], group_seconds, order, preview_rows, group_errors)
+               results.append((column_breakpoints, column_means, group_seconds, group_errors))
+
+     breakpoints = np.stack([column_breakpoints for column_breakpoints, column_means, group_seconds, group_errors in results], axis = 2)
+     means = np.stack([column_means for column_breakpoints, column_means, group_seconds, group_errors in results], axis = 1)
+
+     if preview_errors is not None:
+          for i, (column_breakpoints, column_means, group_seconds, group_errors) in enumerate(results):
+               preview_errors[:, i] = group_errors
+
+     #record the time of every column, and of every group summed over the columns
+     if report is not None:
+          for col, (column_breakpoints, column_means, group_seconds, group_errors) in zip(column_names, results):
+               report.detail(col, group_seconds.sum(), row_count, "column")
+
+          if group_names is not None:
+               total_seconds = np.sum([group_seconds for column_breakpoints, column_means, group_seconds, group_errors in results], axis = 0)
+               for group, seconds, (start, stop) in zip(group_names, total_seconds, bounds):
+                    report.detail(group, seconds, stop - start, "state")
+
+     return(breakpoints, means, pctiles)
+
+#-------------------------------------------------------------------------------
+# Name:        scoreColumn
+# Purpose:     Internal function that calculates the lookup table, mean and percentiles of each group of one column.
+#              Percentiles are written into column_pctiles. The time spent on each group is added to group_seconds
+#              when it is given.
+#              Without `order`, each group is the rows from start to stop. With `order` (row positions sorted by group,
+#              as returned by getGroups), each group is the rows at order[start:stop], so the column does not have to 
+#              be sorted first.
+#              With preview_rows greater than 0, the lookup table of a group with more rows than that is found from a
+#              random sample of preview_rows of its rows, and every row is scored against it. The largest difference
+#              from the exact percentiles on a validation sample is written to preview_errors (0 for exact groups).
+# 
+#-------------------------------------------------------------------------------
+
+def scoreColumn(column_values, bounds, column_pctiles, group_seconds = None, order = None, preview_rows = 0, preview_errors = None):
+
+     pct_list = np.arange(0,101) 
+
+     breakpoints = np.full((len(bounds), len(pct_list)), np.nan)
+     means = np.full(len(bounds), np.nan)
+
+     for i, (start, stop) in enumerate(bounds):
+
+          start_time = time.perf_counter()
+
+          group_rows = slice(start, stop) if order is None else order[start:stop]
+          group_values = column_values[group_rows]
+
+          #find the value of every percentile from 0-100 ignoring NA values, from a sample of the rows in preview mode
+          preview = preview_rows > 0 and stop - start > preview_rows
+          if preview:
+               breakpoints[i] = np.nanpercentile(group_values[getSampleRows(stop - start, preview_rows, i)], pct_list)
+          else:
+               breakpoints[i] = np.nanpercentile(group_values, pct_list)
+
+          #mean ignoring NA values, calculated the same way as describe()
+          means[i] = pd.Series(group_values).mean()
+
+          #Calculate EJScreen Percentiles
+          group_pctiles = getPctileArray(breakpoints[i], group_values)
+          column_pctiles[group_rows] = group_pctiles
+
+          if preview and preview_errors is not None:
+               preview_errors[i] = getPreviewError(group_values, group_pctiles, i)
+
+          if group_seconds is not None:
+               group_seconds[i] += time.perf_counter() - start_time
+
+     return(breakpoints, means)
+
+#-------------------------------------------------------------------------------
+# Name:        scoreMappedColumn
+# Purpose:     Internal function run by the worker processes of calGroupPercentiles. Opens one column of the 
+#              memory mapped values and percentiles files and scores it with scoreColumn. Returns the lookup
+#              table and means of the column, the time spent on each group and the preview error of each group.
+# 
+#-------------------------------------------------------------------------------
+
+def scoreMappedColumn(values_path, pctiles_path, row_count, column, bounds, order_path = None, preview_rows = 0):
+
+     offset = column * row_count * np.dtype(float).itemsize
+
+     order = None
+     if order_path is not None:
+          order = np.memmap(order_path, dtype = np.int64, mode = "r", shape = (row_count,))
+
+     column_values = np.memmap(values_path, dtype = float, mode = "r", offset = offset, shape = (row_count,))
+     column_pctiles = np.memmap(pctiles_path, dtype = float, mode = "r+", offset = offset, shape = (row_count,))
+
+     #rows that are not part of any group have no percentile
+     column_pctiles[:] = np.nan
+
+     group_seconds = np.zeros(len(bounds))
+     group_errors = np.zeros(len(bounds))
+     breakpoints, means = scoreColumn(column_values, bounds, column_pctiles, group_seconds, order, preview_rows, group_errors)
+
+     column_pctiles.flush()
+     del column_values, column_pctiles, order
+
+     return(breakpoints, means, group_seconds, group_errors)
+
+#-------------------------------------------------------------------------------
+# Name:        getSampleRows
+# Purpose:     Internal function that returns the positions of a random sample of sample_size of row_count rows, drawn
+#              with replacement, which is several times faster than without and estimates percentiles as well.
+#              The sample only depends on the arguments, so every column and worker process draws the same rows.
+# 
+#-------------------------------------------------------------------------------
+
+def getSampleRows(row_count, sample_size, seed, purpose = 0):
+
+     rng = np.random.default_rng([preview_seed, purpose, seed])
+
+     return(rng.integers(0, row_count, sample_size))
+
+#-------------------------------------------------------------------------------
+# Name:        getPreviewError
+# Purpose:     Internal function that measures the error of the preview percentiles of one group: the largest 
+#              absolute difference between the preview percentile and the exact percentile of the values in a 
+#              validation sample. The exact lookup table is found with getExactBreakpoints, which uses the preview
+#              percentiles to avoid a second np.nanpercentile over the whole group.
+# 
+#-------------------------------------------------------------------------------
+
+def getPreviewError(group_values, group_pctiles, seed):
+
+     exact_breakpoints = getExactBreakpoints(group_values, group_pctiles)
+
+     validation_rows = getSampleRows(len(group_values), preview_validation_rows, seed, purpose = 1)
+     differences = np.abs(getPctileArray(exact_breakpoints, group_values[validation_rows]) - group_pctiles[validation_rows])
+
+     #NA values have no percentile in either lookup table
+     differences = differences[~np.isnan(differences)]
+
+     return(float(differences.max()) if len(differences) > 0 else 0)
+
+#-------------------------------------------------------------------------------
+# Name:        getExactBreakpoints
+# Purpose:     Internal function that returns the same lookup table as np.nanpercentile(values, range(101)), using
+#              percentiles found with an approximate lookup table. Percentiles only grow with the value, so every
+#              row of a percentile is smaller than every row of the next one. The rows are grouped by percentile with
+#              a counting sort, and each value the lookup table needs is found in its own small group instead of in
+#              the whole column. If the percentiles are ever out of order, np.nanpercentile is used instead.
+# 
+# Parameters:
+#   values - values of one group
+#   pctiles - percentiles of values against any lookup table, NA where the value is NA
+#-------------------------------------------------------------------------------
+
+def getExactBreakpoints(values, pctiles):
+
+     pct_list = np.arange(0,101)
+
+     na_values = np.isnan(pctiles)
+     count = len(values) - np.count_nonzero(na_values)
+     if count == 0:
+          return(np.full(len(pct_list), np.nan))
+
+     #NA values are put after the last percentile
+     bins = np.where(na_values, len(pct_list), pctiles).astype(np.uint8)
+     bin_counts = np.bincount(bins, minlength = len(pct_list) + 1)[:len(pct_list)]
+     bin_stops = np.cumsum(bin_counts)
+     bin_starts = bin_stops - bin_counts
+
+     #values sorted by percentile, in row order within each percentile
+     sorted_values = values[np.argsort(bins, kind = "stable")][:count]
+
+     #check that no percentile has a value larger than the smallest value of the next one
+     starts = bin_starts[bin_counts > 0]
+     if np.any(np.maximum.reduceat(sorted_values, starts)[:-1] > np.minimum.reduceat(sorted_values, starts)[1:]):
+          return(np.nanpercentile(values, pct_list))
+
+     #positions in the sorted values that np.percentile interpolates between (its "linear" method)
+     virtual_indexes = (count - 1) * (pct_list / 100)
+     below = np.floor(virtual_indexes).astype(np.int64)
+     above = below + 1
+     at_end = virtual_indexes >= count - 1
+     below[at_end] = count - 1
+     above[at_end] = count - 1
+
+     #find the value at each of those positions within its percentile's rows
+     ranks = np.unique(np.concatenate([below, above]))
+     rank_bins = np.searchsorted(bin_stops, ranks, side = "right")
+     rank_values = np.empty(len(ranks))
+
+     #ranks are sorted, so the ranks of each percentile are next to each other
+     bin_list, first_ranks = np.unique(rank_bins, return_index = True)
+     for rank_bin, first, last in zip(bin_list.tolist(), first_ranks.tolist(), first_ranks[1:].tolist() + [len(ranks)]):
+          start, stop = bin_starts[rank_bin], bin_stops[rank_bin]
+          kth = ranks[first:last] - start
+          rank_values[first:last] = np.partition(sorted_values[start:stop], kth)[kth]
+
+     below_values = rank_values[np.searchsorted(ranks, below)]
+     above_values = rank_values[np.searchsorted(ranks, above)]
+
+     #interpolate the same way as np.percentile
+     gamma = virtual_indexes - below
+     difference = above_values - below_values
+     return(np.where(gamma >= 0.5, above_values - difference * (1 - gamma), below_values + difference * gamma))
+
 #-------------------------------------------------------------------------------
 # Name:        calIndexes
 # Purpose:     Internal function used for calulating 2 factor and 5 factor index raw values.
@@ -500,10 +2932,12 @@ def getPctile(lookup_list, data_value):
 
 def calIndexes(ejdf):
     
+    index_columns = {}
+
     for colname in col_names.index_names:
         if (colname[0:3] == "D2_"):
-            ejdf[colname] = ejdf["P_" + colname[3:]] * ejdf["DEMOGIDX_2"]
+            index_columns[colname] = ejdf["P_" + colname[3:]] * ejdf["DEMOGIDX_2"]
         if (colname[0:3] == "D5_"):
-            ejdf[colname] = ejdf["P_" + colname[3:]] * ejdf["DEMOGIDX_5"]
+            index_columns[colname] = ejdf["P_" + colname[3:]] * ejdf["DEMOGIDX_5"]
     
-    return(ejdf)
\ No newline at end of file
+    return(joinColumns(ejdf, index_columns))
\ No newline at end of file
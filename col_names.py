@@ -40,5 +40,24 @@ percentile_bin_text_names = ["P_DEMOGIDX_2","P_DEMOGIDX_5","P_PEOPCOLORPCT","P_L
 #Set value to [] if you do not with to utilize this list
 extra_cols = ["AREALAND", "AREAWATER", "NPL_CNT", "TSDF_CNT", "EXCEED_COUNT_80" ,"EXCEED_COUNT_80_SUP"]
 
+#Columns that are added together when block groups are rolled up to tracts
+tract_sum_names = ["ACSTOTPOP","ACSIPOVBAS","ACSEDUCBAS","ACSTOTHH","ACSTOTHU","ACSUNEMPBAS","PEOPCOLOR","LOWINCOME","UNEMPLOYED","LINGISO","LESSHS","UNDER5","OVER64","PRE1960",
+                   "AREALAND","AREAWATER","NPL_CNT","TSDF_CNT"]
+
+#When block groups are rolled up to tracts, each `data_names` column is averaged weighted by the population it describes.
+#Columns that are not listed here are weighted by total population (ACSTOTPOP)
+tract_weight_names = {"LOWINCPCT": "ACSIPOVBAS", "UNEMPPCT": "ACSUNEMPBAS", "LINGISOPCT": "ACSTOTHH", "LESSHSPCT": "ACSEDUCBAS", "PRE1960PCT": "ACSTOTHU"}
+
+#When block groups are rolled up to tracts, these demographic indexes are rebuilt as the average of their rolled up components
+#(leaving out components that are NA) instead of being averaged themselves, since each component has its own population base
+tract_index_components = {"DEMOGIDX_2": ["PEOPCOLORPCT","LOWINCPCT"],
+                          "DEMOGIDX_5": ["LOWINCPCT","UNEMPPCT","LINGISOPCT","LESSHSPCT","LIFEEXPPCT"]}
+
+#Columns of `extra_cols` that are recalculated for tracts instead of being copied from the first block group of each tract
+tract_recalculated_names = ["EXCEED_COUNT_80","EXCEED_COUNT_80_SUP"]
+
+#Number of characters at the start of a block group ID that are the ID of its tract
+tract_id_length = 11
+
 #A list of all columns in order. 
 cols_all = info_names + data_names + index_names + percentile_bin_text_names + extra_cols
\ No newline at end of file
@@ -0,0 +1,342 @@
+#****************************************************************************************
+# Name:        ejscreen_batch
+# Purpose:     Run many EJScreen dataset jobs (e.g. block groups and tracts, national and state, territories or
+#              prior years) from a manifest file, several at a time, within a memory budget.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   ejscreen_dataset: each job is one call of ejscreen_dataset.main
+#   run_report: records the rows, time and peak memory of each job
+#   argparse: command line options
+#   concurrent.futures: jobs run on a pool of worker processes. Each worker imports pandas, numpy and EJScreenTool
+#       once and runs job after job
+#   contextlib/io: the progress output of each job is written to its log file instead of the console
+#   json: manifest and summary files
+#   os/time/traceback: memory size of the machine, job times, and the errors of failed jobs
+#
+# Usage:
+#   python ejscreen_batch.py jobs.json --processes 4 --memory-mb 24000 --summary batch_summary.json
+#
+# Manifest:
+#   A json file with a list of jobs, or an object with "jobs" and optional "defaults" that apply to every job.
+#   Each job uses the parameter names of ejscreen_dataset.py, plus an optional "name" and "memory_mb":
+#
+#   {"defaults": {"workers": 1, "dtype_schema_path": "ejscreen_schema.csv"},
+#    "jobs": [{"name": "bg_national", "level": 1, "input_csv_path": "data/EJSCREEN_BG.csv",
+#              "output_csv_path": "data/EJSCREEN_BG_Output.csv", "lookuptable_xlsx_path": "data/lookup_bg.xlsx"},
+#             {"name": "bg_state", "level": 2, "input_csv_path": "data/EJSCREEN_BG.csv",
+#              "output_csv_path": "data/EJSCREEN_BG_State_Output.csv", "lookuptable_xlsx_path": "data/lookup_bg_state.xlsx",
+#              "output_to_featureclass": true, "geometry_featureclass_path": "data/BlockGroups.gpkg/BG",
+#              "output_featureclass_path": "data/EJSCREEN_BG_State.gpkg", "schema_csv_path": "ejscreen_schema.csv"}]}
+#
+#****************************************************************************************
+
+import ejscreen_dataset
+import run_report
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+#parameter of ejscreen_dataset.main for each manifest key. The keys are the parameter names used in ejscreen_dataset.py
+job_parameters = {"level": "usa_st",
+                  "input_csv_path": "input_table",
+                  "output_csv_path": "output_data_csv",
+                  "lookuptable_xlsx_path": "output_lookup",
+                  "output_to_featureclass": "to_gdb",
+                  "geometry_featureclass_path": "source_geom",
+                  "output_featureclass_path": "output_fc",
+                  "schema_csv_path": "schema",
+                  "workers": "workers",
+                  "csv_engine": "csv_engine",
+                  "indicator_dtype": "indicator_dtype",
+                  "output_compression": "output_compression",
+                  "row_group_size": "row_group_size",
+                  "lookup_artifact_path": "output_artifact",
+                  "chunksize": "chunksize",
+                  "run_report_path": "report_path",
+                  "report_detail": "report_detail",
+                  "profile_stage": "profile_stage",
+                  "output_state_csv_path": "output_state_csv",
+                  "state_lookuptable_xlsx_path": "output_state_lookup",
+                  "output_state_featureclass_path": "output_state_fc",
+                  "state_lookup_artifact_path": "output_state_artifact",
+                  "group_column": "group_column",
+                  "cache_dir": "cache_dir",
+                  "checkpoint_dir": "checkpoint_dir",
+                  "resume": "resume",
+                  "dtype_schema_path": "dtype_schema",
+                  "preview_rows": "preview_rows",
+                  "output_tract_csv_path": "output_tract_csv",
+                  "tract_lookuptable_xlsx_path": "output_tract_lookup",
+                  "tract_lookup_artifact_path": "output_tract_artifact",
+                  "output_workers": "output_workers"}
+
+#manifest keys every job must have
+required_keys = ["level", "input_csv_path", "output_csv_path", "lookuptable_xlsx_path"]
+
+#memory estimate of a job without "memory_mb": a fixed amount for the interpreter and libraries, plus a multiple
+#of the input file size. Compressed inputs are several times larger once read
+base_memory_mb = 150
+memory_per_input_mb = 8
+compressed_input_ratio = 4
+
+#-------------------------------------------------------------------------------
+# Name:        readManifest
+# Purpose:     Read and check a manifest. Returns the list of jobs with the defaults applied, a unique name and a
+#              memory estimate each. Raises ValueError for unknown keys or missing values, before any job runs.
+#-------------------------------------------------------------------------------
+
+def readManifest(manifest_path):
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    if isinstance(manifest, list):
+        manifest = {"jobs": manifest}
+
+    jobs = []
+    names = set()
+
+    for i, job_settings in enumerate(manifest["jobs"]):
+
+        job = {**manifest.get("defaults", {}), **job_settings}
+        job.setdefault("name", "job" + str(i + 1))
+
+        unknown = [key for key in job if key not in job_parameters and key not in ("name", "memory_mb")]
+        if len(unknown) > 0:
+            raise ValueError("Job " + str(job["name"]) + " has unknown keys: " + ", ".join(unknown))
+
+        missing = [key for key in required_keys if job.get(key) in (None, "")]
+        if job.get("output_to_featureclass"):
+            missing += [key for key in ["geometry_featureclass_path", "output_featureclass_path", "schema_csv_path"] if not job.get(key)]
+        if len(missing) > 0:
+            raise ValueError("Job " + str(job["name"]) + " is missing: " + ", ".join(missing))
+
+        if job["level"] not in (1, 2, 3):
+            raise ValueError("Job " + str(job["name"]) + ": `level` must have a value of 1, 2 or 3")
+
+        if job["name"] in names:
+            raise ValueError("Job name " + str(job["name"]) + " is used more than once")
+        names.add(job["name"])
+
+        job.setdefault("memory_mb", estimateMemory(job["input_csv_path"]))
+        jobs.append(job)
+
+    return(jobs)
+
+#-------------------------------------------------------------------------------
+# Name:        estimateMemory
+# Purpose:     Estimate the peak memory of a job in MB from the size of its input file. Set "memory_mb" on a job
+#              to use a measured value instead, e.g. the peak_rss_mb of an earlier run's summary.
+#-------------------------------------------------------------------------------
+
+def estimateMemory(input_path):
+
+    if not os.path.exists(input_path):
+        return(base_memory_mb)
+
+    input_mb = os.path.getsize(input_path) / 2**20
+    if os.path.splitext(input_path)[1].lower() in (".gz", ".zst", ".bz2", ".xz", ".zip"):
+        input_mb *= compressed_input_ratio
+
+    return(round(base_memory_mb + memory_per_input_mb * input_mb))
+
+#-------------------------------------------------------------------------------
+# Name:        getTotalMemory
+# Purpose:     Total physical memory of the machine in MB, or None when it cannot be found.
+#-------------------------------------------------------------------------------
+
+def getTotalMemory():
+
+    try:
+        return(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20)
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    try:
+        import psutil
+        return(psutil.virtual_memory().total / 2**20)
+    except ImportError:
+        return(None)
+
+#-------------------------------------------------------------------------------
+# Name:        runJob
+# Purpose:     Run one job in a worker process and return its summary: status, wall time, rows, rows per second
+#              and peak memory. A failed job returns its error instead of raising, so the other jobs keep running.
+#              The progress output of the job is written to `<log_dir>/<name>.log`, or discarded without a log_dir.
+#-------------------------------------------------------------------------------
+
+def runJob(job, log_dir = ""):
+
+    arguments = {job_parameters[key]: value for key, value in job.items() if key in job_parameters}
+    arguments.setdefault("to_gdb", False)
+    arguments.setdefault("source_geom", "")
+    arguments.setdefault("output_fc", "")
+    arguments.setdefault("schema", "")
+
+    report = run_report.RunReport(detail = job.get("report_detail", False), profile_stage = job.get("profile_stage"))
+
+    summary = {"name": job["name"], "level": job["level"], "input": job["input_csv_path"], "memory_mb": job["memory_mb"], "pid": os.getpid()}
+    start = time.perf_counter()
+
+    log = open(os.path.join(log_dir, str(job["name"]) + ".log"), "w") if log_dir else io.StringIO()
+    try:
+        with log, contextlib.redirect_stdout(log):
+            ejscreen_dataset.main(**arguments, report = report)
+        summary["status"] = "ok"
+    except Exception:
+        summary["status"] = "failed"
+        summary["error"] = traceback.format_exc()
+
+    summary["wall_seconds"] = round(time.perf_counter() - start, 2)
+    summary["rows"] = max([stage["rows"] for stage in report.stages if stage["rows"]], default = 0)
+    summary["rows_per_second"] = round(summary["rows"] / summary["wall_seconds"]) if summary["wall_seconds"] > 0 else 0
+    summary["peak_rss_mb"] = max([stage["peak_rss_mb"] for stage in report.stages if stage["peak_rss_mb"] is not None], default = None)
+    summary["stages"] = {stage["stage"]: stage["wall_seconds"] for stage in report.stages}
+
+    return(summary)
+
+#-------------------------------------------------------------------------------
+# Name:        warmWorker
+# Purpose:     Internal function run once when each worker process starts. The imports are done here, once per
+#              worker, rather than once per job.
+#-------------------------------------------------------------------------------
+
+def warmWorker():
+
+    import pandas
+    import numpy
+    import EJScreenTool
+
+#-------------------------------------------------------------------------------
+# Name:        runJobs
+# Purpose:     Run jobs on a pool of `processes` worker processes. A job is started when a worker is free and its
+#              memory estimate fits in what is left of memory_budget_mb. Jobs are started in manifest order, but
+#              a later job that fits is started ahead of an earlier one that does not. A job larger than the whole
+#              budget runs once no other job is running. Returns the job summaries in the order they finished.
+#-------------------------------------------------------------------------------
+
+def runJobs(jobs, processes = 1, memory_budget_mb = None, log_dir = "", verbose = True):
+
+    pending = list(jobs)
+    running = {}
+    summaries = []
+
+    with ProcessPoolExecutor(max_workers = processes, initializer = warmWorker) as pool:
+
+        while len(pending) > 0 or len(running) > 0:
+
+            for job in list(pending):
+
+                if len(running) >= processes:
+                    break
+
+                memory_in_use = sum(running_job["memory_mb"] for running_job in running.values())
+                if memory_budget_mb is None or len(running) == 0 or memory_in_use + job["memory_mb"] <= memory_budget_mb:
+                    running[pool.submit(runJob, job, log_dir)] = job
+                    pending.remove(job)
+
+                    if verbose:
+                        print("Started " + str(job["name"]) + " (estimated " + format(job["memory_mb"], ",") + " MB)")
+
+            finished, not_finished = wait(running, return_when = FIRST_COMPLETED)
+
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    summary = future.result()
+                except Exception:
+                    #the worker process itself failed, e.g. it ran out of memory
+                    summary = {"name": job["name"], "level": job["level"], "input": job["input_csv_path"], "memory_mb": job["memory_mb"],
+                               "status": "failed", "error": traceback.format_exc(), "wall_seconds": 0, "rows": 0, "rows_per_second": 0, "peak_rss_mb": None}
+
+                summaries.append(summary)
+
+                if verbose:
+                    print(formatSummary(summary))
+
+    return(summaries)
+
+#-------------------------------------------------------------------------------
+# Name:        formatSummary
+# Purpose:     Internal function that formats the line printed when a job finishes.
+#-------------------------------------------------------------------------------
+
+def formatSummary(summary):
+
+    line = "{:<8} {:<24} {:>9.1f} s {:>12,} rows {:>10,} rows/s".format(summary["status"].upper(), str(summary["name"]), summary["wall_seconds"], summary["rows"], summary["rows_per_second"])
+
+    if summary["peak_rss_mb"] is not None:
+        line += " {:>9,.0f} MB peak".format(summary["peak_rss_mb"])
+
+    if summary["status"] != "ok":
+        line += "\n" + summary["error"]
+
+    return(line)
+
+#-------------------------------------------------------------------------------
+# Name:        printSummaries
+# Purpose:     Internal function that prints the table of job summaries and the overall throughput.
+#-------------------------------------------------------------------------------
+
+def printSummaries(summaries, total_seconds):
+
+    print("{:<24} {:>6} {:>8} {:>10} {:>12} {:>12} {:>10} {:>10}".format("job", "level", "status", "seconds", "rows", "rows/second", "peak MB", "est. MB"))
+
+    for summary in summaries:
+        peak = format(summary["peak_rss_mb"], ",.0f") if summary["peak_rss_mb"] is not None else ""
+        print("{:<24} {:>6} {:>8} {:>10.1f} {:>12,} {:>12,} {:>10} {:>10,}".format(str(summary["name"]), summary["level"], summary["status"], summary["wall_seconds"], summary["rows"], summary["rows_per_second"], peak, summary["memory_mb"]))
+
+    total_rows = sum(summary["rows"] for summary in summaries)
+    print(str(len(summaries)) + " jobs, " + format(total_rows, ",") + " rows in " + format(total_seconds, ".1f") + " s (" + format(round(total_rows / total_seconds) if total_seconds > 0 else 0, ",") + " rows/s overall)")
+
+#-------------------------------------------------------------------------------
+# Name:        main
+# Purpose:     Command line entry point. Returns 1 if any job failed.
+#
+#-------------------------------------------------------------------------------
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Run the EJScreen dataset jobs of a manifest file, several at a time.")
+    parser.add_argument("manifest", help = "json file with the list of jobs")
+    parser.add_argument("--processes", type = int, default = os.cpu_count() or 1, help = "number of jobs that can run at the same time. Defaults to the number of CPUs")
+    parser.add_argument("--memory-mb", type = float, help = "memory budget shared by the running jobs, in MB. Defaults to 80%% of the physical memory")
+    parser.add_argument("--log-dir", default = "", help = "directory for the progress output of each job, <name>.log. Discarded when not set")
+    parser.add_argument("--summary", help = "write the job summaries to this json file")
+    args = parser.parse_args(argv)
+
+    jobs = readManifest(args.manifest)
+
+    memory_budget_mb = args.memory_mb
+    if memory_budget_mb is None and getTotalMemory() is not None:
+        memory_budget_mb = 0.8 * getTotalMemory()
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok = True)
+
+    print("Running " + str(len(jobs)) + " jobs on " + str(args.processes) + " processes" + (" within " + format(memory_budget_mb, ",.0f") + " MB" if memory_budget_mb else ""))
+
+    start = time.perf_counter()
+    summaries = runJobs(jobs, args.processes, memory_budget_mb, args.log_dir)
+    total_seconds = time.perf_counter() - start
+
+    printSummaries(summaries, total_seconds)
+
+    if args.summary:
+        with open(args.summary, "w") as summary_file:
+            json.dump({"total_wall_seconds": round(total_seconds, 2), "memory_budget_mb": memory_budget_mb, "jobs": summaries}, summary_file, indent = 2)
+
+    return(1 if any(summary["status"] != "ok" for summary in summaries) else 0)
+
+if __name__ == '__main__':
+    raise SystemExit(main())
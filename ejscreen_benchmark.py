@@ -0,0 +1,343 @@
+#****************************************************************************************
+# Name:        ejscreen_benchmark
+# Purpose:     Measure the run time and peak memory of each stage of the EJScreen dataset creator on
+#              synthetic block group data, and compare the results with a stored baseline.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   pandas/numpy: used to generate the synthetic dataset
+#   EJScreenTool: the functions being measured
+#   col_names: the synthetic dataset has exactly the columns listed in col_names.py
+#   argparse: command line options
+#   contextlib/io: used to hide the progress output of the functions being measured
+#   json: baseline and report files
+#   tempfile/os: the synthetic input and the outputs are written to a temporary directory
+#   time: wall clock timing
+#   tracemalloc: peak memory of each stage. numpy and pandas allocations are included
+#
+# Usage:
+#   python ejscreen_benchmark.py --rows 10000 240000 --save-baseline benchmark_baseline.json
+#   python ejscreen_benchmark.py --rows 10000 240000 --baseline benchmark_baseline.json
+#
+#****************************************************************************************
+
+import pandas as pd
+import numpy as np
+import EJScreenTool
+import col_names
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+#state and territory abbreviations used for the synthetic ST_ABBREV column
+state_abbreviations = ["AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI", "ID", "IL", "IN", "IA",
+                       "KS", "KY", "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM",
+                       "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA",
+                       "WV", "WI", "WY", "AS", "GU", "MP", "PR", "VI"]
+
+#stages measured for every dataset size, in the order they run
+benchmark_stages = ["ingest", "percentileCal", "calIndexes", "percentileCal_indexes", "percentileCalState", "calBinTxt", "output", "ejscreen_cal", "ejscreenState_cal"]
+
+#-------------------------------------------------------------------------------
+# Name:        generateBlockGroups
+# Purpose:     Generate a synthetic block group dataset with the columns in col_names.py. The same arguments always
+#              produce the same dataset.
+#
+#              Block groups are numbered within tracts (1-4 block groups per tract) so IDs have realistic 11 character
+#              tract prefixes. Counts are drawn from their base counts, percents are calculated from them, and zero
+#              population block groups have no demographic percents. Indicators have a few percent NA values, and
+#              proximity indicators such as PNPL and UST are mostly zeros, so they have the large ties of the real data.
+#
+# Parameters:
+#   rows - number of block groups
+#   states - number of states, up to 56
+#   seed - random seed
+#
+# Returns:
+#   Data frame with the `col_names.info_names`, `col_names.data_names` and `col_names.extra_cols` columns
+#-------------------------------------------------------------------------------
+
+def generateBlockGroups(rows, states = 56, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    states = max(1, min(states, len(state_abbreviations)))
+
+    #larger states have more block groups
+    state_weights = rng.pareto(1.5, states) + 0.2
+    state_index = np.sort(rng.choice(states, size = rows, p = state_weights / state_weights.sum()))
+
+    #block groups are numbered within tracts, tracts within counties
+    tract_sizes = rng.integers(1, 5, size = rows)
+    tract_number = np.repeat(np.arange(rows), tract_sizes)[:rows]
+    block_group = np.concatenate([np.arange(1, size + 1) for size in tract_sizes])[:rows]
+    county = tract_number // 40 % 1000
+
+    ids = pd.Series(state_index + 1).map("{:02d}".format) + pd.Series(county * 2 + 1).map("{:03d}".format) + pd.Series(tract_number % 1000000).map("{:06d}".format) + pd.Series(block_group).map("{:d}".format)
+
+    df = pd.DataFrame({"ID": ids})
+    abbreviations = np.array(state_abbreviations[:states])
+    df["STATE_NAME"] = pd.Series(abbreviations[state_index]) + " State"
+    df["ST_ABBREV"] = abbreviations[state_index]
+    df["CNTY_NAME"] = pd.Series(county).map("County {:d}".format)
+    df["REGION"] = state_index % 10 + 1
+
+    #population and base counts. About 1% of block groups have no population
+    population = np.round(rng.lognormal(7.1, 0.55, rows)).astype(np.int64)
+    population[rng.random(rows) < 0.01] = 0
+
+    df["ACSTOTPOP"] = population
+    df["ACSIPOVBAS"] = rng.binomial(population, 0.97)
+    df["ACSEDUCBAS"] = rng.binomial(population, 0.68)
+    df["ACSTOTHH"] = rng.binomial(population, 0.38)
+    df["ACSTOTHU"] = df["ACSTOTHH"] + rng.binomial(df["ACSTOTHH"], 0.1)
+    df["ACSUNEMPBAS"] = rng.binomial(population, 0.5)
+
+    #demographic rates vary by state and by block group
+    state_shift = rng.normal(0, 0.5, states)[state_index]
+
+    def rate(center):
+        return(1 / (1 + np.exp(-(np.log(center / (1 - center)) + state_shift + rng.normal(0, 1, rows)))))
+
+    df["PEOPCOLOR"] = rng.binomial(population, rate(0.35))
+    df["LOWINCOME"] = rng.binomial(df["ACSIPOVBAS"], rate(0.3))
+    df["UNEMPLOYED"] = rng.binomial(df["ACSUNEMPBAS"], rate(0.05))
+    df["LINGISO"] = rng.binomial(df["ACSTOTHH"], rate(0.04))
+    df["LESSHS"] = rng.binomial(df["ACSEDUCBAS"], rate(0.11))
+    df["UNDER5"] = rng.binomial(population, rate(0.06))
+    df["OVER64"] = rng.binomial(population, rate(0.16))
+    df["PRE1960"] = rng.binomial(df["ACSTOTHU"], rate(0.3))
+
+    #percents are NA when their base is 0
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        df["PEOPCOLORPCT"] = df["PEOPCOLOR"] / df["ACSTOTPOP"].replace(0, np.nan)
+        df["LOWINCPCT"] = df["LOWINCOME"] / df["ACSIPOVBAS"].replace(0, np.nan)
+        df["UNEMPPCT"] = df["UNEMPLOYED"] / df["ACSUNEMPBAS"].replace(0, np.nan)
+        df["LINGISOPCT"] = df["LINGISO"] / df["ACSTOTHH"].replace(0, np.nan)
+        df["LESSHSPCT"] = df["LESSHS"] / df["ACSEDUCBAS"].replace(0, np.nan)
+        df["UNDER5PCT"] = df["UNDER5"] / df["ACSTOTPOP"].replace(0, np.nan)
+        df["OVER64PCT"] = df["OVER64"] / df["ACSTOTPOP"].replace(0, np.nan)
+        df["PRE1960PCT"] = df["PRE1960"] / df["ACSTOTHU"].replace(0, np.nan)
+
+    lifeexp = rate(0.2)
+    lifeexp[(rng.random(rows) < 0.08) | (population == 0)] = np.nan
+    df["LIFEEXPPCT"] = lifeexp
+
+    df["DEMOGIDX_2"] = (df["PEOPCOLORPCT"] + df["LOWINCPCT"]) / 2
+    df["DEMOGIDX_5"] = df[["LOWINCPCT", "UNEMPPCT", "LINGISOPCT", "LESSHSPCT", "LIFEEXPPCT"]].mean(axis = 1)
+
+    #environmental indicators: (median, spread, share of zeros, share of NA, decimals)
+    indicator_shapes = {"PM25": (8.0, 0.25, 0, 0.005, 3),
+                        "OZONE": (60.0, 0.1, 0, 0.005, 2),
+                        "DSLPM": (0.25, 0.8, 0, 0.005, 4),
+                        "CANCER": (25.0, 0.4, 0, 0.005, 0),
+                        "RESP": (0.3, 0.4, 0, 0.005, 1),
+                        "RSEI_AIR": (500.0, 2.0, 0.05, 0.02, 1),
+                        "PTRAF": (150.0, 1.5, 0.02, 0.03, 2),
+                        "PNPL": (0.05, 1.5, 0.7, 0.01, 3),
+                        "PRMP": (0.3, 1.2, 0.3, 0.01, 2),
+                        "PTSDF": (1.0, 1.3, 0.25, 0.01, 2),
+                        "UST": (2.0, 1.4, 0.4, 0.01, 1),
+                        "PWDIS": (0.5, 3.0, 0.2, 0.15, 3)}
+
+    for col, (median, spread, zeros, missing, decimals) in indicator_shapes.items():
+        values = np.round(rng.lognormal(np.log(median), spread, rows) * np.exp(state_shift * spread / 2), decimals)
+        values[rng.random(rows) < zeros] = 0
+        values[rng.random(rows) < missing] = np.nan
+        df[col] = values
+
+    df["AREALAND"] = np.round(rng.lognormal(14, 1.5, rows)).astype(np.int64)
+    df["AREAWATER"] = np.where(rng.random(rows) < 0.6, 0, np.round(rng.lognormal(11, 2, rows))).astype(np.int64)
+    df["NPL_CNT"] = rng.poisson(0.02, rows)
+    df["TSDF_CNT"] = rng.poisson(0.05, rows)
+    df["EXCEED_COUNT_80"] = rng.integers(0, 14, rows)
+    df["EXCEED_COUNT_80_SUP"] = rng.integers(0, 14, rows)
+
+    return(df[col_names.info_names + col_names.data_names + col_names.extra_cols])
+
+#-------------------------------------------------------------------------------
+# Name:        measure
+# Purpose:     Run a function and return its result, wall time in seconds and peak traced memory in MB.
+#              Progress output printed by the function is hidden.
+#
+#-------------------------------------------------------------------------------
+
+def measure(function, *args, trace_memory = True, **kwargs):
+
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return(result, seconds, peak_mb)
+
+#-------------------------------------------------------------------------------
+# Name:        benchmarkSize
+# Purpose:     Measure every stage for one dataset size.
+#              Times are the fastest of `repeat` runs without memory tracing. Peak memory is measured in a separate
+#              traced run, because tracing slows the stages down.
+#
+# Returns:
+#   Dictionary of stage name to {"seconds": ..., "peak_mb": ..., "rows_per_second": ...}
+#-------------------------------------------------------------------------------
+
+def benchmarkSize(rows, states, work_dir, repeat = 1, workers = 1, seed = 0):
+
+    input_csv = os.path.join(work_dir, "input_" + str(rows) + ".csv")
+    generateBlockGroups(rows, states, seed).to_csv(input_csv, index = False)
+
+    output_csv = os.path.join(work_dir, "output.csv")
+    output_lookup = os.path.join(work_dir, "lookup.xlsx")
+
+    def runStages(trace_memory):
+
+        results = {}
+
+        def run(stage, function, *args, **kwargs):
+            result, seconds, peak_mb = measure(function, *args, trace_memory = trace_memory, **kwargs)
+            results[stage] = (seconds, peak_mb)
+            return(result)
+
+        source_df, extra_df = run("ingest", EJScreenTool.readInput, input_csv)
+
+        indicator_pctiles, indicator_lookup = run("percentileCal", EJScreenTool.percentileCal, source_df.copy(), workers = workers)
+        indicator_indexes = run("calIndexes", EJScreenTool.calIndexes, indicator_pctiles)
+        ejscreen_pctiles, index_lookup = run("percentileCal_indexes", EJScreenTool.percentileCal, indicator_indexes, percentile_column_names = col_names.index_names, workers = workers)
+        run("percentileCalState", EJScreenTool.percentileCalState, source_df.copy(), workers = workers)
+        ejscreen_full = run("calBinTxt", EJScreenTool.calBinTxt, ejscreen_pctiles)
+
+        ejscreen_full = EJScreenTool.calExceedCounts(pd.concat([ejscreen_full, extra_df], axis = 1))[col_names.cols_all]
+        ejscreen_lookup = EJScreenTool.combineLookups(indicator_lookup, index_lookup)
+
+        def writeOutput():
+            EJScreenTool.writeDataset(ejscreen_full, output_csv)
+            EJScreenTool.writeLookup(ejscreen_lookup, output_lookup)
+
+        run("output", writeOutput)
+
+        del source_df, extra_df, indicator_pctiles, indicator_indexes, ejscreen_pctiles, ejscreen_full
+
+        run("ejscreen_cal", EJScreenTool.ejscreen_cal, input_csv, output_csv, output_lookup, workers = workers)
+        run("ejscreenState_cal", EJScreenTool.ejscreenState_cal, input_csv, output_csv, output_lookup, workers = workers)
+
+        return(results)
+
+    timings = [runStages(trace_memory = False) for i in range(repeat)]
+    memory = runStages(trace_memory = True)
+
+    return({stage: {"seconds": round(min(timing[stage][0] for timing in timings), 4),
+                    "peak_mb": round(memory[stage][1], 1),
+                    "rows_per_second": round(rows / min(timing[stage][0] for timing in timings))} for stage in benchmark_stages})
+
+#-------------------------------------------------------------------------------
+# Name:        compareBaseline
+# Purpose:     Compare benchmark results with a baseline. A stage is a regression when its time or peak memory is
+#              more than `tolerance` (a fraction) above the baseline.
+#
+# Returns:
+#   List of regression messages
+#-------------------------------------------------------------------------------
+
+def compareBaseline(results, baseline, tolerance = 0.2):
+
+    regressions = []
+
+    for size, stages in results.items():
+        for stage, result in stages.items():
+
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                continue
+
+            for measurement in ["seconds", "peak_mb"]:
+                if base.get(measurement) and result[measurement] > base[measurement] * (1 + tolerance):
+                    regressions.append(size + " rows " + stage + " " + measurement + ": " + str(result[measurement]) + " (baseline " + str(base[measurement]) + ")")
+
+    return(regressions)
+
+#-------------------------------------------------------------------------------
+# Name:        printResults
+# Purpose:     Print a table of the results, with the change from the baseline when there is one.
+#
+#-------------------------------------------------------------------------------
+
+def printResults(results, baseline = {}):
+
+    print("{:>10} {:<24} {:>10} {:>10} {:>14} {:>9}".format("rows", "stage", "seconds", "peak MB", "rows/second", "vs base"))
+
+    for size, stages in results.items():
+        for stage, result in stages.items():
+
+            base = baseline.get(size, {}).get(stage)
+            change = "{:+.0%}".format(result["seconds"] / base["seconds"] - 1) if base and base.get("seconds") else ""
+
+            print("{:>10} {:<24} {:>10.3f} {:>10.1f} {:>14,} {:>9}".format(size, stage, result["seconds"], result["peak_mb"], result["rows_per_second"], change))
+
+#-------------------------------------------------------------------------------
+# Name:        main
+# Purpose:     Command line entry point. Returns 1 if any stage regressed against the baseline.
+#
+#-------------------------------------------------------------------------------
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Benchmark the EJScreen dataset creator on synthetic block group data.")
+    parser.add_argument("--rows", type = int, nargs = "+", default = [10000, 240000], help = "dataset sizes to measure, e.g. 10000 240000 2000000")
+    parser.add_argument("--states", type = int, default = 56, help = "number of states in the synthetic data (up to 56)")
+    parser.add_argument("--repeat", type = int, default = 1, help = "timing runs per size. The fastest run is reported")
+    parser.add_argument("--workers", type = int, default = 1, help = "workers passed to the percentile functions")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the synthetic data")
+    parser.add_argument("--baseline", help = "baseline json file to compare against")
+    parser.add_argument("--save-baseline", help = "write the results to this baseline json file")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "allowed slowdown or memory growth over the baseline, as a fraction")
+    parser.add_argument("--report", help = "write the results to this json file")
+    parser.add_argument("--generate", help = "only write a synthetic dataset of the first --rows size to this csv path")
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        generateBlockGroups(args.rows[0], args.states, args.seed).to_csv(args.generate, index = False)
+        return(0)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for rows in args.rows:
+            print("Measuring " + str(rows) + " rows...")
+            results[str(rows)] = benchmarkSize(rows, args.states, work_dir, args.repeat, args.workers, args.seed)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    printResults(results, baseline)
+
+    for path in [args.report, args.save_baseline]:
+        if path:
+            with open(path, "w") as report_file:
+                json.dump(results, report_file, indent = 2)
+
+    regressions = compareBaseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+
+    return(1 if regressions else 0)
+
+if __name__ == '__main__':
+    raise SystemExit(main())
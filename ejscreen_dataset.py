@@ -1,12 +1,40 @@
 import EJScreenTool
+import run_report
+import os
 import sys
 
-def main(usa_st, input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema):
+def main(usa_st, input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema, workers = 1, csv_engine = "c", indicator_dtype = "float64", output_compression = None, row_group_size = None, output_artifact = "", chunksize = None, report_path = "", report_detail = False, profile_stage = None, output_state_csv = "", output_state_lookup = "", output_state_fc = "", output_state_artifact = "", group_column = "ST_ABBREV", cache_dir = "", checkpoint_dir = "", resume = False, dtype_schema = "", report = None, preview_rows = 0, output_tract_csv = "", output_tract_lookup = "", output_tract_artifact = "", output_workers = 1):
+
+    if report is None:
+        report = run_report.RunReport(detail = report_detail, profile_stage = profile_stage)
+
+    if chunksize:
+        #streaming builds csv datasets and lookup tables of block groups only, so options of the in-memory run are refused
+        #instead of being ignored
+        unsupported = {"to_gdb": to_gdb, "workers": workers > 1, "csv_engine": csv_engine != "c", "cache_dir": cache_dir, "checkpoint_dir": checkpoint_dir, "resume": resume, "dtype_schema": dtype_schema, "preview_rows": preview_rows > 0, "output_tract_csv": output_tract_csv, "output_workers": output_workers > 1, "group_column": usa_st == 3 and group_column != "ST_ABBREV"}
+        unsupported = [option for option, value in unsupported.items() if value]
+        if len(unsupported) > 0:
+            raise ValueError("chunksize cannot be used with: " + ", ".join(unsupported))
+
+        if usa_st == 1 or usa_st == 3:
+            EJScreenTool.ejscreenStream_cal(input_table, output_data_csv, output_lookup, False, chunksize, indicator_dtype = indicator_dtype, output_artifact = output_artifact, report_path = report_path, report = report)
+        if usa_st == 2:
+            EJScreenTool.ejscreenStream_cal(input_table, output_data_csv, output_lookup, True, chunksize, indicator_dtype = indicator_dtype, output_artifact = output_artifact, report_path = report_path, report = report)
+        if usa_st == 3:
+            #the state run has its own report, written next to the national one
+            state_report_path = os.path.splitext(report_path)[0] + "_state" + os.path.splitext(report_path)[1] if report_path != "" else ""
+            state_report = run_report.RunReport(detail = report.detail_enabled, profile_stage = report.profile_stage, profile_path = os.path.splitext(report.profile_path)[0] + "_state.prof")
+            EJScreenTool.ejscreenStream_cal(input_table, output_state_csv, output_state_lookup, True, chunksize, indicator_dtype = indicator_dtype, output_artifact = output_state_artifact, report_path = state_report_path, report = state_report)
+        
+        print("Complete")
+        return
 
     if usa_st == 1:
-        EJScreenTool.ejscreen_cal(input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema)
+        EJScreenTool.ejscreen_cal(input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema, workers, csv_engine, indicator_dtype, output_compression, row_group_size, output_artifact, report_path, report, cache_dir, checkpoint_dir, resume, dtype_schema, preview_rows, output_tract_csv, output_tract_lookup, output_tract_artifact, output_workers)
     if usa_st == 2:
-        EJScreenTool.ejscreenState_cal(input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema)
+        EJScreenTool.ejscreenState_cal(input_table, output_data_csv, output_lookup, to_gdb, source_geom, output_fc, schema, workers, csv_engine, indicator_dtype, output_compression, row_group_size, output_artifact, report_path, report, cache_dir, checkpoint_dir, resume, dtype_schema, preview_rows, output_tract_csv, output_tract_lookup, output_tract_artifact, output_workers)
+    if usa_st == 3:
+        EJScreenTool.ejscreenCombined_cal(input_table, output_data_csv, output_lookup, output_state_csv, output_state_lookup, to_gdb, source_geom, output_fc, output_state_fc, schema, workers, csv_engine, indicator_dtype, output_compression, row_group_size, output_artifact, output_state_artifact, group_column, report_path, report, cache_dir, dtype_schema, output_workers)
 
     print("Complete")
 
@@ -16,15 +44,18 @@ if __name__ == '__main__':
     
     #set `option` to 1 to generate national percentiles.
     #set `option` to 2 to generate state percentiles
+    #set `option` to 3 to generate both in one run. The state outputs are set below
     level = 1
 
-    #path to input csv dataset
+    #path to input csv dataset. Compressed files (.gz, .zst) can be read directly
     input_csv_path = "data/EJSCREEN_2023_BG_with_AS_CNMI_GU_VI.csv"
 
-    #path to output csv dataset
+    #path to output dataset. The format is set by the extension: .csv, .parquet, .feather or .npz (a dataset store that
+    #reads records by ID or state, see ejscreen_store.py)
+    #a list of paths writes the dataset in each of the formats, e.g. ["data/EJSCREEN_Output.csv", "data/EJSCREEN_Output.parquet"]
     output_csv_path = "data/EJSCREEN_Output.csv"
 
-    #path to output lookuptable excel file
+    #path to output lookuptable file. The format is set by the extension: .xlsx, .csv, .parquet or .npz
     lookuptable_xlsx_path = "data/lookup.xlsx"
 
     #whether or not you wish to join the output to geometry and export to ESRI Feature Class
@@ -33,15 +64,87 @@ if __name__ == '__main__':
     #path to geometry which the output table will be joined
     geometry_featureclass_path = "data/BlockGroups.gdb/BG"
 
-    #path to output ESRI Feature Class
+    #path to output ESRI Feature Class. A GeoPackage layer (e.g. "data/EJSCREEN.gpkg/EJSCREEN_Output") joined to
+    #geometry from a GeoPackage (e.g. "data/BlockGroups.gpkg/BG") is written without ArcGIS Pro
     output_featureclass_path = "data/BlockGroups.gdb/EJSCREEN_Output"
 
     #path to ESRI schema csv file 
     schema_csv_path = "data/ejscreen_schema.csv"
 
+    #number of processes used to calculate percentiles. Set to 1 to use a single process
+    workers = 1
+
+    #parser used to read the input csv. "c" is the pandas default, "pyarrow" reads with multiple threads
+    csv_engine = "c"
+
+    #data type of the indicator columns. "float32" uses half the memory of "float64"
+    indicator_dtype = "float64"
+
+    #compression of parquet/feather output (e.g. "snappy", "zstd", "lz4"). None uses the format default
+    output_compression = None
+
+    #rows per parquet row group / feather record batch. None uses the format default
+    row_group_size = None
+
+    #optional path to output .npz lookup artifact. It can be used to score other inputs with EJScreenTool.ejscreenScore_cal. Set to "" to skip it
+    lookup_artifact_path = ""
+
+    #number of rows to process at a time for inputs that do not fit in memory. None processes the whole input at once
+    #streaming writes csv datasets of block groups only. It cannot be used with a feature class, workers or output_workers
+    #above 1, the "pyarrow" csv_engine, cache_dir, checkpoint_dir, resume, dtype_schema_path, preview_rows, output_tract_csv_path or
+    #a group_column other than "ST_ABBREV", and raises an error if any is set. At level 3 the state run report is written
+    #to the run report path with "_state" added, e.g. "data/run_report_state.json"
+    chunksize = None
+
+    #optional path to output JSON run report with the time, CPU time, peak memory and rows/sec of each stage. Set to "" to skip it
+    run_report_path = ""
+
+    #whether the run report also records the time of each column and state
+    report_detail = False
+
+    #name of one stage to profile with cProfile (e.g. "calBinTxt"), written to "<stage>.prof". None profiles nothing
+    profile_stage = None
+
+    #level 3 only: paths to the state dataset, lookup table, feature class and optional lookup artifact ("" to skip it)
+    output_state_csv_path = "data/EJSCREEN_State_Output.csv"
+    state_lookuptable_xlsx_path = "data/lookup_state.xlsx"
+    output_state_featureclass_path = "data/BlockGroups.gdb/EJSCREEN_State_Output"
+    state_lookup_artifact_path = ""
+
+    #level 3 only: column that divides rows into groups for the second dataset. "ST_ABBREV" for states, or e.g. "REGION"
+    group_column = "ST_ABBREV"
+
+    #optional directory of cached percentiles. Only the percentiles whose inputs changed since the last run are recalculated
+    cache_dir = ""
+
+    #levels 1 and 2: optional directory where the output of each stage is saved. Requires the pyarrow package
+    checkpoint_dir = ""
+
+    #levels 1 and 2: whether to continue a failed run from its last saved stage in checkpoint_dir
+    resume = False
+
+    #optional path to schema csv whose field types are used to store columns in compact types (e.g. int8 percentiles and
+    #categorical T_ text) as soon as they are created, e.g. "data/ejscreen_schema.csv". The output values are unchanged.
+    #Set to "" to keep the default types
+    dtype_schema_path = ""
+
+    #levels 1 and 2: rows sampled for each lookup table in a fast approximate preview run, e.g. 20000. The largest
+    #difference from exact percentiles is printed for each column. Set to 0 for exact percentiles
+    preview_rows = 0
+
+    #levels 1 and 2: optional paths to the tract dataset, lookup table and lookup artifact. The block groups of the input are
+    #rolled up to tracts and ranked in the same run. Set output_tract_csv_path to "" to build block groups only
+    output_tract_csv_path = ""
+    tract_lookuptable_xlsx_path = "data/lookup_tract.xlsx"
+    tract_lookup_artifact_path = ""
+
+    #number of outputs (datasets, lookup tables, GeoPackage layers) written at the same time. Above 1, csv datasets are
+    #also formatted on as many processes. The files are the same for any value. Set to 1 to write one output at a time
+    output_workers = 1
+
 #*************************************************************************************************************************************    
-    if level != 1 and level != 2:
-        sys.exit("`level` must have a value of either 1 or 2")
+    if level != 1 and level != 2 and level != 3:
+        sys.exit("`level` must have a value of 1, 2 or 3")
     
     if output_to_featureclass == True:
         if not geometry_featureclass_path or not output_featureclass_path or not schema_csv_path:
@@ -54,5 +157,29 @@ if __name__ == '__main__':
     output_to_featureclass, 
     geometry_featureclass_path, 
     output_featureclass_path, 
-    schema_csv_path)
+    schema_csv_path,
+    workers,
+    csv_engine,
+    indicator_dtype,
+    output_compression,
+    row_group_size,
+    lookup_artifact_path,
+    chunksize,
+    run_report_path,
+    report_detail,
+    profile_stage,
+    output_state_csv_path,
+    state_lookuptable_xlsx_path,
+    output_state_featureclass_path,
+    state_lookup_artifact_path,
+    group_column,
+    cache_dir,
+    checkpoint_dir,
+    resume,
+    dtype_schema_path,
+    preview_rows = preview_rows,
+    output_tract_csv = output_tract_csv_path,
+    output_tract_lookup = tract_lookuptable_xlsx_path,
+    output_tract_artifact = tract_lookup_artifact_path,
+    output_workers = output_workers)
 
@@ -0,0 +1,474 @@
+#****************************************************************************************
+# Name:        ejscreen_diff
+# Purpose:     Compare two EJScreen outputs (e.g. this release and the last one, or the output of a changed
+#              pipeline) column by column, matching rows on ID, without loading either file whole.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   pandas/numpy: the files are read in chunks and compared with array operations
+#   col_names: columns are compared and reported in the order of `col_names.cols_all`
+#   argparse: command line options
+#   json: report file
+#   itertools: the chunks of the two files are read side by side
+#   os/tempfile/shutil: rows that are not in the same place in both files are set aside in a temporary directory
+#   pyarrow: optional, reads csv outputs faster. Required for Parquet and Feather outputs
+#
+# Usage:
+#   python ejscreen_diff.py data/EJSCREEN_Output_2023.csv data/EJSCREEN_Output.csv --report diff.json
+#   python ejscreen_diff.py old.parquet new.parquet --tolerance 1 --float-tolerance 1e-9
+#
+#   The exit code is 1 when the outputs differ, so the check can be part of a release script.
+#
+#****************************************************************************************
+
+import pandas as pd
+import numpy as np
+import col_names
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+#columns of whole percentiles, bins and counts, compared with `tolerance`. Other numeric columns use `float_tolerance`
+whole_number_prefixes = ("P_", "B_", "T_", "EXCEED_COUNT")
+
+#text columns of the output. T_ text is compared by its percentile when `tolerance` is greater than 0
+text_names = ["ID", "STATE_NAME", "ST_ABBREV", "CNTY_NAME"] + [name for name in col_names.percentile_bin_text_names if name.startswith("T_")]
+
+#-------------------------------------------------------------------------------
+# Name:        compareOutputs
+# Purpose:     Compare two EJScreen outputs and return a report of their differences. Both files are read once,
+#              `chunksize` rows at a time, side by side. Rows with the same ID in the same place in both files are
+#              compared right away, so outputs in the same row order never hold more than one chunk of each file
+#              in memory. Other rows are split by a hash of their ID into `partitions` parts that are saved to a 
+#              temporary directory, and each part is then matched on ID through a hash index and compared, so at 
+#              most about 1/partitions of the rows are in memory at once. ID must be unique in each file.
+#
+#              A checksum of the (ID, value) pairs of each column is kept for both files. It does not depend on
+#              row order, so equal checksums mean the column is the same in both files.
+#
+# Parameters:
+#   old_path, new_path - paths to the two outputs (.csv, .parquet or .feather/.arrow)
+#   chunksize - number of rows read at a time from each file
+#   tolerance - largest allowed difference of P_ and B_ values, T_ percentiles and EXCEED_COUNT values
+#   float_tolerance - largest allowed difference of the other numeric columns, such as indicators and indexes
+#   sample_count - number of example IDs reported for each differing column
+#   partitions - number of parts the rows that are not in the same place in both files are split into. None uses 
+#                one part for each `chunksize` rows of the larger file
+#   temp_dir - directory for the temporary partitions. None uses the system temporary directory
+#
+# Returns:
+#   a dictionary with the row counts, the columns and IDs found in only one file, the columns whose values differ
+#   only within the tolerance, and for each column with a value outside the tolerance: its checksums, the number of
+#   differing rows, the largest difference, the number of differing rows in each state and sample IDs. 
+#   "identical" is True when there are no differences
+#-------------------------------------------------------------------------------
+
+def compareOutputs(old_path, new_path, chunksize = 200000, tolerance = 0, float_tolerance = 0, sample_count = 5, partitions = None, temp_dir = None):
+
+    old_columns, new_columns = readColumnNames(old_path), readColumnNames(new_path)
+    columns = [column for column in orderColumns(old_columns) if column in new_columns and column != "ID"]
+
+    results = {column: {"rows_differing": 0, "rows_within_tolerance": 0, "max_difference": None, "states": {}, "sample_ids": []} for column in columns}
+    checksums = {"old": dict.fromkeys(["ID"] + columns, np.uint64(0)), "new": dict.fromkeys(["ID"] + columns, np.uint64(0))}
+    row_counts = {"old": 0, "new": 0}
+    only = {"old": {"count": 0, "sample_ids": []}, "new": {"count": 0, "sample_ids": []}}
+    settings = {"tolerance": tolerance, "float_tolerance": float_tolerance, "sample_count": sample_count}
+
+    if partitions is None:
+        partitions = max(1, -(-max(estimateRowCount(old_path), estimateRowCount(new_path)) // chunksize))
+
+    partition_dir = tempfile.mkdtemp(prefix = "ejscreen_diff_", dir = temp_dir)
+
+    try:
+        chunks = itertools.zip_longest(readChunks(old_path, ["ID"] + columns, chunksize), readChunks(new_path, ["ID"] + columns, chunksize))
+
+        for chunk_index, (old_chunk, new_chunk) in enumerate(chunks):
+
+            #when one file has more rows, its last chunks are compared with no rows
+            old_chunk = old_chunk if old_chunk is not None else new_chunk.iloc[:0]
+            new_chunk = new_chunk if new_chunk is not None else old_chunk.iloc[:0]
+
+            for side, chunk in [("old", old_chunk), ("new", new_chunk)]:
+                row_counts[side] += len(chunk)
+                addChecksums(checksums[side], chunk, ["ID"] + columns)
+
+            #rows in the same place in both files
+            shared_rows = min(len(old_chunk), len(new_chunk))
+            matched = old_chunk["ID"].to_numpy()[:shared_rows] == new_chunk["ID"].to_numpy()[:shared_rows]
+            compareRows(old_chunk.iloc[:shared_rows][matched], new_chunk.iloc[:shared_rows][matched], columns, results, settings)
+
+            #the other rows are matched on ID once both files have been read
+            for side, chunk in [("old", old_chunk), ("new", new_chunk)]:
+                unmatched = chunk.iloc[np.flatnonzero(np.concatenate([~matched, np.ones(len(chunk) - shared_rows, dtype = bool)]))]
+                if len(unmatched) > 0:
+                    savePartitions(unmatched, partition_dir, side, chunk_index, partitions)
+
+        for partition in range(partitions):
+
+            old_rows, new_rows = loadPartition(partition_dir, "old", partition), loadPartition(partition_dir, "new", partition)
+            if old_rows is None and new_rows is None:
+                continue
+            old_rows = old_rows if old_rows is not None else new_rows.iloc[:0]
+            new_rows = new_rows if new_rows is not None else old_rows.iloc[:0]
+
+            #hash index of the new IDs
+            new_index = pd.Index(new_rows["ID"])
+            if not new_index.is_unique or not pd.Index(old_rows["ID"]).is_unique:
+                raise ValueError("ID is not unique in " + old_path + " or " + new_path)
+            positions = new_index.get_indexer(old_rows["ID"])
+
+            found = positions >= 0
+            compareRows(old_rows[found], new_rows.iloc[positions[found]], columns, results, settings)
+
+            addOnly(only["old"], old_rows["ID"][~found], sample_count)
+            new_found = np.zeros(len(new_rows), dtype = bool)
+            new_found[positions[found]] = True
+            addOnly(only["new"], new_rows["ID"][~new_found], sample_count)
+
+    finally:
+        shutil.rmtree(partition_dir, ignore_errors = True)
+
+    differing = {}
+    within_tolerance = []
+    for column in columns:
+        if results[column]["rows_differing"] == 0:
+            if results[column]["rows_within_tolerance"] > 0:
+                within_tolerance.append(column)
+            continue
+        differing[column] = dict(results[column], checksum_old = format(checksums["old"][column], "016x"), checksum_new = format(checksums["new"][column], "016x"))
+        differing[column]["states"] = dict(sorted(differing[column]["states"].items(), key = lambda item: -item[1]))
+
+    report = {"old": old_path, "new": new_path, "rows": row_counts,
+              "columns_only_in_old": [column for column in old_columns if column not in new_columns],
+              "columns_only_in_new": [column for column in new_columns if column not in old_columns],
+              "ids_only_in_old": only["old"], "ids_only_in_new": only["new"],
+              "columns": differing, "within_tolerance": within_tolerance}
+    report["identical"] = (len(differing) == 0 and len(within_tolerance) == 0 and only["old"]["count"] == 0 and only["new"]["count"] == 0
+                           and len(report["columns_only_in_old"]) == 0 and len(report["columns_only_in_new"]) == 0)
+
+    return(report)
+
+#-------------------------------------------------------------------------------
+# Name:        compareRows
+# Purpose:     Internal function that compares rows of the two files that have the same ID, in the same order,
+#              and adds the differences to `results`.
+#-------------------------------------------------------------------------------
+
+def compareRows(old_rows, new_rows, columns, results, settings):
+
+    if len(old_rows) == 0:
+        return
+
+    ids = new_rows["ID"].to_numpy()
+    states = new_rows["ST_ABBREV"].to_numpy(dtype = object) if "ST_ABBREV" in new_rows.columns else None
+
+    for column in columns:
+
+        old_values, new_values = getValues(old_rows[column]), getValues(new_rows[column])
+        whole_number = column.startswith(whole_number_prefixes)
+        column_tolerance = settings["tolerance"] if whole_number else settings["float_tolerance"]
+
+        if old_values.dtype == object or new_values.dtype == object:
+            old_na, new_na = pd.isna(old_values), pd.isna(new_values)
+            differences = None
+            differs = (old_na != new_na) | (~old_na & ~new_na & (old_values != new_values))
+
+            #T_ text that differs is compared by its percentile
+            if column.startswith("T_") and column_tolerance > 0 and differs.any():
+                text_rows = np.flatnonzero(differs)
+                differences = np.full(len(differs), np.nan)
+                differences[text_rows] = np.abs(getTextPercentiles(old_values[text_rows]) - getTextPercentiles(new_values[text_rows]))
+                within = differences <= column_tolerance
+                differs &= ~within
+                results[column]["rows_within_tolerance"] += int(np.count_nonzero(within))
+        else:
+            with np.errstate(invalid = "ignore"):
+                differences = np.abs(old_values - new_values)
+            old_na, new_na = np.isnan(old_values), np.isnan(new_values)
+            differs = (old_na != new_na) | (differences > column_tolerance)
+            results[column]["rows_within_tolerance"] += int(np.count_nonzero(differences[~differs] > 0))
+
+        rows = np.flatnonzero(differs)
+        if len(rows) == 0:
+            continue
+
+        result = results[column]
+        result["rows_differing"] += len(rows)
+
+        #text and values that are NA in one file only have no difference
+        if differences is not None and np.any(~np.isnan(differences[rows])):
+            result["max_difference"] = max(result["max_difference"] or 0.0, float(np.nanmax(differences[rows])))
+
+        if states is not None:
+            for state, count in zip(*np.unique(pd.Series(states[rows]).fillna("").to_numpy(dtype = str), return_counts = True)):
+                result["states"][state] = result["states"].get(state, 0) + int(count)
+
+        missing = settings["sample_count"] - len(result["sample_ids"])
+        if missing > 0:
+            result["sample_ids"].extend(ids[rows[:missing]].tolist())
+
+#-------------------------------------------------------------------------------
+# Name:        getValues
+# Purpose:     Internal function that returns the values of a column as a float64 array, or an object array for
+#              text. Integer, nullable integer and categorical columns of Parquet and Feather output give the same
+#              values as the csv output.
+#-------------------------------------------------------------------------------
+
+def getValues(column):
+
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = column.astype(column.cat.categories.dtype) if not column.hasnans else column.astype(object)
+
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in "iuf":
+        return(column.to_numpy(dtype = "float64"))
+
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return(column.to_numpy(dtype = "float64", na_value = np.nan))
+
+    return(column.to_numpy(dtype = object))
+
+#-------------------------------------------------------------------------------
+# Name:        getTextPercentiles
+# Purpose:     Internal function that returns T_ text such as "62 %ile" as the percentile 62, so it can be compared
+#              with a tolerance. Text without a percentile is NA, so it only matches the same text.
+#-------------------------------------------------------------------------------
+
+def getTextPercentiles(values):
+
+    return(pd.to_numeric(pd.Series(values, dtype = object).str.extract(r"^(\d+)", expand = False), errors = "coerce").to_numpy(dtype = float))
+
+#-------------------------------------------------------------------------------
+# Name:        addChecksums
+# Purpose:     Internal function that adds the hash of each (ID, value) pair of a chunk to the checksum of its
+#              column. The hashes are added with wraparound, so the checksum does not depend on row order.
+#-------------------------------------------------------------------------------
+
+def addChecksums(checksums, chunk, columns):
+
+    id_hashes = pd.util.hash_array(chunk["ID"].to_numpy(dtype = object))
+
+    for column in columns:
+        values = getValues(chunk[column])
+        if values.dtype == float:
+            values = values + 0.0
+        pair_hashes = pd.util.hash_array(id_hashes ^ pd.util.hash_array(values)) if column != "ID" else id_hashes
+        checksums[column] = np.add.reduce(pair_hashes, dtype = np.uint64, initial = checksums[column])
+
+#-------------------------------------------------------------------------------
+# Name:        addOnly
+# Purpose:     Internal function that counts the IDs found in only one file and keeps sample IDs.
+#-------------------------------------------------------------------------------
+
+def addOnly(only, ids, sample_count):
+
+    only["count"] += len(ids)
+    only["sample_ids"].extend(ids.iloc[:max(0, sample_count - len(only["sample_ids"]))].tolist())
+
+#-------------------------------------------------------------------------------
+# Name:        savePartitions
+# Purpose:     Internal function that splits rows by a hash of their ID and saves each part to its partition.
+#-------------------------------------------------------------------------------
+
+def savePartitions(rows, partition_dir, side, chunk_index, partition_count):
+
+    partitions = pd.util.hash_array(rows["ID"].to_numpy(dtype = object)) % np.uint64(partition_count)
+
+    for partition in np.unique(partitions):
+        rows[partitions == partition].to_pickle(os.path.join(partition_dir, side + "_" + str(partition) + "_" + str(chunk_index) + ".pkl"))
+
+#-------------------------------------------------------------------------------
+# Name:        loadPartition
+# Purpose:     Internal function that returns the rows of one file saved to a partition, or None.
+#-------------------------------------------------------------------------------
+
+def loadPartition(partition_dir, side, partition):
+
+    prefix = side + "_" + str(partition) + "_"
+    paths = sorted((path for path in os.listdir(partition_dir) if path.startswith(prefix)), key = lambda path: int(path[len(prefix):-4]))
+
+    if len(paths) == 0:
+        return(None)
+
+    return(pd.concat([pd.read_pickle(os.path.join(partition_dir, path)) for path in paths], ignore_index = True))
+
+#-------------------------------------------------------------------------------
+# Name:        readChunks
+# Purpose:     Internal function that yields `columns` of an output `chunksize` rows at a time. csv values are
+#              parsed exactly, so a value compares equal to the float64 it was written from. With pyarrow the csv
+#              is read by its streaming reader, which is about twice as fast as the exact pandas parser.
+#-------------------------------------------------------------------------------
+
+def readChunks(path, columns, chunksize):
+
+    output_format = getFileFormat(path)
+    text_columns = [column for column in text_names if column in columns]
+
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        if output_format != "csv":
+            raise
+        yield from pd.read_csv(path, usecols = columns, dtype = dict.fromkeys(text_columns, str), chunksize = chunksize, float_precision = "round_trip")
+        return
+
+    if output_format == "csv":
+        #the column names and types are given, so they match the pandas parser and do not depend on the first rows
+        column_types = {column: pyarrow.string() if column in text_columns else pyarrow.float64() for column in columns if column in col_names.cols_all or column in text_columns}
+        read_options = pyarrow.csv.ReadOptions(column_names = readColumnNames(path), skip_rows = 1)
+        convert_options = pyarrow.csv.ConvertOptions(include_columns = columns, column_types = column_types, strings_can_be_null = True)
+        batches = pyarrow.csv.open_csv(path, read_options = read_options, convert_options = convert_options)
+    elif output_format == "parquet":
+        import pyarrow.parquet
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size = chunksize, columns = columns)
+    else:
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+        batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+
+    #batches are regrouped into chunks of exactly `chunksize` rows, so the chunks of two files line up
+    pending = []
+    for batch in batches:
+        pending.append(batch)
+        table = pyarrow.Table.from_batches(pending)
+        while table.num_rows >= chunksize:
+            yield(table.slice(0, chunksize).to_pandas())
+            table = table.slice(chunksize)
+        pending = table.to_batches()
+
+    if sum(batch.num_rows for batch in pending) > 0:
+        yield(pyarrow.Table.from_batches(pending).to_pandas())
+
+#-------------------------------------------------------------------------------
+# Name:        readColumnNames
+# Purpose:     Internal function that returns the column names of an output without reading its rows.
+#-------------------------------------------------------------------------------
+
+def readColumnNames(path):
+
+    output_format = getFileFormat(path)
+
+    if output_format == "csv":
+        return(list(pd.read_csv(path, nrows = 0).columns))
+
+    import pyarrow
+    if output_format == "parquet":
+        import pyarrow.parquet
+        return(pyarrow.parquet.ParquetFile(path).schema_arrow.names)
+
+    return(pyarrow.ipc.open_file(pyarrow.memory_map(path)).schema.names)
+
+#-------------------------------------------------------------------------------
+# Name:        estimateRowCount
+# Purpose:     Internal function that returns the number of rows of an output without reading it. For csv it is
+#              estimated from the file size and the length of the first rows.
+#-------------------------------------------------------------------------------
+
+def estimateRowCount(path):
+
+    output_format = getFileFormat(path)
+
+    if output_format == "csv":
+        with open(path, "rb") as csv_file:
+            csv_file.readline()
+            sample = csv_file.readlines(1 << 20)
+        return(int(os.path.getsize(path) / max(1, sum(len(line) for line in sample) / max(1, len(sample)))))
+
+    import pyarrow
+    if output_format == "parquet":
+        import pyarrow.parquet
+        return(pyarrow.parquet.ParquetFile(path).metadata.num_rows)
+
+    reader = pyarrow.ipc.open_file(pyarrow.memory_map(path))
+    return(sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches)))
+
+#-------------------------------------------------------------------------------
+# Name:        getFileFormat
+# Purpose:     Internal function that returns the format of an output from its extension, as in 
+#              EJScreenTool.getOutputFormat.
+#-------------------------------------------------------------------------------
+
+def getFileFormat(path):
+
+    extensions = os.path.basename(path).lower().split(".")[1:]
+
+    if "parquet" in extensions:
+        return("parquet")
+    if "feather" in extensions or "arrow" in extensions:
+        return("feather")
+    if "csv" in extensions:
+        return("csv")
+
+    raise ValueError("Unknown format for " + path + ". Use .csv, .parquet, .feather or .arrow")
+
+#-------------------------------------------------------------------------------
+# Name:        orderColumns
+# Purpose:     Internal function that returns column names in the order of `col_names.cols_all`, followed by any
+#              other columns in file order.
+#-------------------------------------------------------------------------------
+
+def orderColumns(columns):
+
+    return([column for column in col_names.cols_all if column in columns] + [column for column in columns if column not in col_names.cols_all])
+
+#-------------------------------------------------------------------------------
+# Name:        printReport
+# Purpose:     Print the differences found by compareOutputs.
+#-------------------------------------------------------------------------------
+
+def printReport(report):
+
+    print("old: " + report["old"] + " (" + format(report["rows"]["old"], ",") + " rows)")
+    print("new: " + report["new"] + " (" + format(report["rows"]["new"], ",") + " rows)")
+
+    if report["identical"]:
+        print("The outputs are identical")
+        return
+
+    for side in ["old", "new"]:
+        if len(report["columns_only_in_" + side]) > 0:
+            print("columns only in " + side + ": " + ", ".join(report["columns_only_in_" + side]))
+        if report["ids_only_in_" + side]["count"] > 0:
+            only = report["ids_only_in_" + side]
+            print("IDs only in " + side + ": " + format(only["count"], ",") + ", e.g. " + ", ".join(only["sample_ids"]))
+
+    if len(report["within_tolerance"]) > 0:
+        print("columns that differ within the tolerance: " + ", ".join(report["within_tolerance"]))
+
+    for column, result in report["columns"].items():
+        states = ", ".join(state + " " + format(count, ",") for state, count in list(result["states"].items())[:5])
+        print(column.ljust(24) + format(result["rows_differing"], ",").rjust(12) + " rows" + 
+              ("   max difference " + str(result["max_difference"]) if result["max_difference"] is not None else "") + 
+              ("   states: " + states if states else "") + "   e.g. " + ", ".join(result["sample_ids"]))
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Compare two EJScreen outputs, matching rows on ID.")
+    parser.add_argument("old", help = "previous output (.csv, .parquet or .feather)")
+    parser.add_argument("new", help = "output to check")
+    parser.add_argument("--chunksize", type = int, default = 200000, help = "rows read at a time from each file")
+    parser.add_argument("--tolerance", type = float, default = 0, help = "allowed difference of P_, B_, T_ percentiles and EXCEED_COUNT values")
+    parser.add_argument("--float-tolerance", type = float, default = 0, help = "allowed difference of other numeric columns")
+    parser.add_argument("--samples", type = int, default = 5, help = "example IDs reported for each differing column")
+    parser.add_argument("--partitions", type = int, help = "parts the rows that are out of order are split into. By default one per chunk")
+    parser.add_argument("--temp-dir", help = "directory for the parts. The system temporary directory by default")
+    parser.add_argument("--report", help = "write the differences to this json file")
+    args = parser.parse_args(argv)
+
+    report = compareOutputs(args.old, args.new, args.chunksize, args.tolerance, args.float_tolerance, args.samples, args.partitions, args.temp_dir)
+    printReport(report)
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(report, report_file, indent = 2)
+
+    return(0 if report["identical"] else 1)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,206 @@
+#****************************************************************************************
+# Name:        ejscreen_loadtest
+# Purpose:     Measure how fast the percentile query service answers queries, in the same process and through
+#              its HTTP front end, and check that single and batched queries give the same answers.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   numpy: used to generate random queries
+#   ejscreen_query: the service being measured
+#   argparse: command line options
+#   http.client/json: HTTP requests to the front end over keep-alive connections
+#   threading/concurrent.futures: the front end is started on a thread and queried by several client threads
+#   time: wall clock timing
+#   urllib.parse: the URL of a server that is already running
+#
+# Usage:
+#   python ejscreen_loadtest.py data/lookup.npz data/lookup_state.npz --queries 200000 --clients 4 --batch-size 1000
+#   python ejscreen_loadtest.py data/lookup.npz data/lookup_state.npz --url http://127.0.0.1:8080
+#
+#****************************************************************************************
+
+import numpy as np
+import ejscreen_query
+import argparse
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlparse
+
+#-------------------------------------------------------------------------------
+# Name:        generateQueries
+# Purpose:     Generate random (indicator, region, value) queries for the indicators and regions of a
+#              PercentileQuery. Values are drawn from the range of each lookup table and a little beyond it, a
+#              quarter of them are exact lookup values (so ties are tested) and 2% are NA.
+#-------------------------------------------------------------------------------
+
+def generateQueries(lookups, count, seed = 0):
+
+    rng = np.random.default_rng(seed)
+
+    regions = np.array(lookups.regions, dtype = object)[rng.integers(len(lookups.regions), size = count)]
+    indicators = np.empty(count, dtype = object)
+    values = np.empty(count)
+
+    for region in lookups.regions:
+
+        rows = np.flatnonzero(regions == region)
+        table = lookups.tables[lookups.region_tables[region]]
+        region_breakpoints = np.asarray(table["breakpoints"][table["region_indexes"][region]])
+
+        column_indexes = rng.integers(len(table["columns"]), size = len(rows))
+        indicators[rows] = np.array(table["columns"], dtype = object)[column_indexes]
+
+        low = np.nan_to_num(np.nanmin(region_breakpoints, axis = 0)[column_indexes]) if len(rows) > 0 else 0
+        high = np.nan_to_num(np.nanmax(region_breakpoints, axis = 0)[column_indexes]) if len(rows) > 0 else 0
+        margin = (high - low) * 0.05
+
+        values[rows] = rng.uniform(low - margin, high + margin)
+
+        exact = rng.random(len(rows)) < 0.25
+        values[rows[exact]] = region_breakpoints[rng.integers(region_breakpoints.shape[0], size = exact.sum()), column_indexes[exact]]
+
+    values[rng.random(count) < 0.02] = np.nan
+
+    return(indicators.tolist(), regions.tolist(), values)
+
+#-------------------------------------------------------------------------------
+# Name:        measureInProcess
+# Purpose:     Time single queries and batched queries in this process, and check that they agree.
+#-------------------------------------------------------------------------------
+
+def measureInProcess(lookups, indicators, regions, values, batch_size):
+
+    value_list = values.tolist()
+
+    start = time.perf_counter()
+    single = [lookups.percentile(indicator, region, value) for indicator, region, value in zip(indicators, regions, value_list)]
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = np.concatenate([lookups.queryBatch(indicators[i:i + batch_size], regions[i:i + batch_size], values[i:i + batch_size])["percentile"]
+                              for i in range(0, len(values), batch_size)])
+    batch_seconds = time.perf_counter() - start
+
+    if not np.array_equal(np.array(single, dtype = float), batched, equal_nan = True):
+        raise AssertionError("Single and batched queries give different percentiles")
+
+    return({"single_us_per_query": round(single_seconds / len(values) * 1e6, 3),
+            "batch_us_per_query": round(batch_seconds / len(values) * 1e6, 3)}, batched)
+
+#-------------------------------------------------------------------------------
+# Name:        measureHttp
+# Purpose:     Send the queries to the HTTP front end from `clients` threads, each with its own keep-alive
+#              connection. Batches of batch_size go to /batch, and single_count queries go to /percentile one at a
+#              time. Returns queries per second and request latency percentiles, and checks the answers against
+#              `expected`.
+#-------------------------------------------------------------------------------
+
+def measureHttp(host, port, indicators, regions, values, expected, batch_size, clients, single_count):
+
+    def sendBatches(batch_starts):
+        connection = http.client.HTTPConnection(host, port)
+        latencies = []
+        for i in batch_starts:
+            body = json.dumps({"indicator": indicators[i:i + batch_size],
+                               "region": regions[i:i + batch_size],
+                               "value": [None if np.isnan(value) else value for value in values[i:i + batch_size].tolist()]})
+            start = time.perf_counter()
+            connection.request("POST", "/batch", body, {"Content-Type": "application/json"})
+            response = json.loads(connection.getresponse().read())
+            latencies.append(time.perf_counter() - start)
+            answers = np.array([np.nan if pctile is None else pctile for pctile in response["percentile"]], dtype = float)
+            if not np.array_equal(answers, expected[i:i + batch_size], equal_nan = True):
+                raise AssertionError("/batch gives different percentiles than the service")
+        connection.close()
+        return(latencies)
+
+    def sendSingles(rows):
+        connection = http.client.HTTPConnection(host, port)
+        latencies = []
+        for i in rows:
+            query = urlencode({"indicator": indicators[i], "region": regions[i], "value": values[i]})
+            start = time.perf_counter()
+            connection.request("GET", "/percentile?" + query)
+            response = json.loads(connection.getresponse().read())
+            latencies.append(time.perf_counter() - start)
+            answer = np.nan if response["percentile"] is None else response["percentile"]
+            if not np.array_equal(answer, expected[i], equal_nan = True):
+                raise AssertionError("/percentile gives a different percentile than the service")
+        connection.close()
+        return(latencies)
+
+    batch_starts = list(range(0, len(values), batch_size))
+    single_rows = list(range(min(single_count, len(values))))
+
+    results = {}
+    for name, function, work, query_count in [("batch", sendBatches, batch_starts, len(values)), ("single", sendSingles, single_rows, len(single_rows))]:
+
+        if query_count == 0:
+            continue
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(clients) as executor:
+            latencies = [latency for client_latencies in executor.map(function, [work[client::clients] for client in range(clients)]) for latency in client_latencies]
+        seconds = time.perf_counter() - start
+
+        latencies_ms = np.array(latencies) * 1000
+        results[name] = {"requests": len(latencies),
+                         "queries_per_second": round(query_count / seconds),
+                         "latency_ms_p50": round(float(np.percentile(latencies_ms, 50)), 3),
+                         "latency_ms_p95": round(float(np.percentile(latencies_ms, 95)), 3),
+                         "latency_ms_p99": round(float(np.percentile(latencies_ms, 99)), 3)}
+
+    return(results)
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Load test the EJScreen percentile query service.")
+    parser.add_argument("artifacts", nargs = "+", help = "national and/or state lookup artifacts (.npz). Queries are generated from them")
+    parser.add_argument("--queries", type = int, default = 100000, help = "number of random queries")
+    parser.add_argument("--batch-size", type = int, default = 1000, help = "queries per batch")
+    parser.add_argument("--clients", type = int, default = 4, help = "number of concurrent HTTP clients")
+    parser.add_argument("--single", type = int, default = 2000, help = "number of queries also sent one at a time over HTTP")
+    parser.add_argument("--url", help = "URL of a running server. By default a server is started in this process")
+    parser.add_argument("--seed", type = int, default = 0, help = "random seed of the queries")
+    parser.add_argument("--report", help = "write the results to this json file")
+    args = parser.parse_args(argv)
+
+    lookups = ejscreen_query.PercentileQuery(args.artifacts)
+    indicators, regions, values = generateQueries(lookups, args.queries, args.seed)
+
+    results = {"queries": args.queries, "batch_size": args.batch_size, "clients": args.clients}
+    results["in_process"], expected = measureInProcess(lookups, indicators, regions, values, args.batch_size)
+    print("in process: " + json.dumps(results["in_process"]))
+
+    server = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        server = ejscreen_query.makeServer(lookups, port = 0)
+        host, port = server.server_address[:2]
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    try:
+        results["http"] = measureHttp(host, port, indicators, regions, values, expected, args.batch_size, args.clients, args.single)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    for name, result in results["http"].items():
+        print("http " + name + ": " + json.dumps(result))
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(results, report_file, indent = 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#****************************************************************************************
+# Name:        ejscreen_query
+# Purpose:     Answer "what percentile is this value" for any indicator, nationally or in a state, from the lookup
+#              tables of an EJScreen run, with an optional local HTTP front end.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   pandas/numpy: lookup tables are held as arrays and batches of queries are answered with array operations
+#   EJScreenTool: lookup artifacts are read with loadLookupArtifact, and the bin and text rules are its getBin,
+#       getBinArray and getTxtLabels
+#   argparse: command line options
+#   bisect/math: single queries search the lookup values of one column without numpy
+#   http.server/json/urllib.parse: the HTTP front end
+#
+# Usage:
+#   python ejscreen_query.py data/lookup.npz data/lookup_state.npz --port 8080
+#
+#****************************************************************************************
+
+import pandas as pd
+import numpy as np
+import EJScreenTool
+import argparse
+import bisect
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+#-------------------------------------------------------------------------------
+# Name:        PercentileQuery
+# Purpose:     Holds the national and state lookup tables of a run and answers single and batched
+#              (indicator, region, value) queries with the percentile, bin and text of the value. The rules are the
+#              same as percentileCal and percentileCalState use for the dataset (see EJScreenTool.getPctileArray):
+#              values between two lookup values fall back one percentile, tied lookup values give the lowest
+#              percentile, and values above the last lookup value are given the last percentile. NA values have
+#              no percentile, bin or text.
+#
+#              The national lookup is region "USA" and each state lookup is its ST_ABBREV (or the group of a
+#              lookup built with another group_column). Lookup artifacts are memory mapped, so several server
+#              processes share one copy.
+#
+#              Usage:
+#                  lookups = PercentileQuery(["data/lookup.npz", "data/lookup_state.npz"])
+#                  lookups.query("PM25", "NC", 8.1)
+#                  lookups.queryBatch(["PM25", "OZONE"], ["USA", "NC"], [8.1, 61.2])
+#
+# Parameters:
+#   lookups - list of lookup artifact paths (.npz, see EJScreenTool.saveLookupArtifact) or lookup tables returned
+#             by percentileCal/percentileCalState (e.g. after combineLookups)
+#   memory_map - (True/False) whether lookup artifacts are memory mapped instead of read into memory
+#-------------------------------------------------------------------------------
+
+class PercentileQuery:
+
+    def __init__(self, lookups, memory_map = True):
+
+        self.tables = []
+        self.region_tables = {}
+        self.single_cache = {}
+        self.txt_labels = EJScreenTool.getTxtLabels()
+
+        for lookup in lookups:
+
+            if isinstance(lookup, pd.DataFrame):
+                lookup_arrays = EJScreenTool.lookupToArrays(lookup)
+            else:
+                lookup_arrays = EJScreenTool.loadLookupArtifact(lookup, memory_map)
+
+            table = buildQueryTable(lookup_arrays)
+
+            for region in table["regions"]:
+                if region in self.region_tables:
+                    raise ValueError("Region " + region + " is in more than one lookup table")
+                self.region_tables[region] = len(self.tables)
+
+            self.tables.append(table)
+
+        self.regions = list(self.region_tables)
+        self.region_index = pd.Index(self.regions)
+        self.region_table_indexes = np.array(list(self.region_tables.values()), dtype = np.int64)
+        self.indicators = sorted(set(column for table in self.tables for column in table["columns"]))
+
+    #---------------------------------------------------------------------------
+    # Name:        percentile
+    # Purpose:     Percentile of one value, as an integer, or NaN for an NA value.
+    #---------------------------------------------------------------------------
+
+    def percentile(self, indicator, region, value):
+
+        value = float(value)
+        if math.isnan(value):
+            return(float("nan"))
+
+        key = (indicator, region)
+        if key not in self.single_cache:
+            self.single_cache[key] = self.getColumnLists(indicator, region)
+
+        search_values, lookup_values, first_indexes = self.single_cache[key]
+
+        #the same steps as getPctileArray for one value
+        lookup_index = bisect.bisect_left(search_values, value)
+
+        if lookup_index >= len(lookup_values):
+            lookup_index = len(lookup_values) - 1
+        elif lookup_index > 0 and lookup_values[lookup_index] != value:
+            lookup_index = lookup_index - 1
+
+        return(first_indexes[lookup_index])
+
+    #---------------------------------------------------------------------------
+    # Name:        query
+    # Purpose:     Percentile, bin and text of one value as a dictionary. All three are None for an NA value.
+    #---------------------------------------------------------------------------
+
+    def query(self, indicator, region, value):
+
+        pctile = self.percentile(indicator, region, value)
+
+        if math.isnan(pctile):
+            return({"percentile": None, "bin": None, "text": None})
+
+        return({"percentile": pctile, "bin": EJScreenTool.getBin(pctile), "text": self.txt_labels[pctile]})
+
+    #---------------------------------------------------------------------------
+    # Name:        queryBatch
+    # Purpose:     Percentiles, bins and texts of many values at once. indicators, regions and values are lists or
+    #              arrays of the same length. Returns a dictionary of arrays: percentile (float, NaN for NA values),
+    #              bin (float, NaN for NA values) and text (object, None for NA values).
+    #---------------------------------------------------------------------------
+
+    def queryBatch(self, indicators, regions, values):
+
+        indicators = np.asarray(indicators, dtype = object)
+        regions = np.asarray(regions, dtype = object)
+        values = np.asarray(values, dtype = float)
+
+        if not (len(indicators) == len(regions) == len(values)):
+            raise ValueError("indicators, regions and values must have the same length")
+
+        region_positions = self.region_index.get_indexer(regions)
+        if (region_positions < 0).any():
+            raise ValueError("No lookup table for region " + ", ".join(map(str, pd.unique(regions[region_positions < 0]))))
+
+        region_tables = self.region_table_indexes[region_positions]
+        pctiles = np.full(len(values), np.nan)
+
+        for table_index, table in enumerate(self.tables):
+
+            rows = np.flatnonzero(region_tables == table_index)
+            if len(rows) == 0:
+                continue
+
+            region_indexes = table["region_index"].get_indexer(regions[rows])
+            column_indexes = table["column_index"].get_indexer(indicators[rows])
+            if (column_indexes < 0).any():
+                raise ValueError("Lookup table has no indicator " + ", ".join(map(str, pd.unique(indicators[rows][column_indexes < 0]))))
+
+            pctiles[rows] = getTablePctiles(table, region_indexes, column_indexes, values[rows])
+
+        return({"percentile": pctiles,
+                "bin": EJScreenTool.getBinArray(pctiles).astype(float),
+                "text": EJScreenTool.getTxtArray(pctiles)})
+
+    #---------------------------------------------------------------------------
+    # Name:        getColumnLists
+    # Purpose:     Internal method that copies the lookup values of one indicator and region to lists, which are
+    #              searched faster than arrays one value at a time.
+    #---------------------------------------------------------------------------
+
+    def getColumnLists(self, indicator, region):
+
+        if region not in self.region_tables:
+            raise ValueError("No lookup table for region " + str(region))
+
+        table = self.tables[self.region_tables[region]]
+        if indicator not in table["column_indexes"]:
+            raise ValueError("Lookup table has no indicator " + str(indicator))
+
+        region_index = table["region_indexes"][region]
+        column_index = table["column_indexes"][indicator]
+
+        return(table["search_values"][region_index, :, column_index].tolist(),
+               table["breakpoints"][region_index, :, column_index].tolist(),
+               table["first_indexes"][region_index, :, column_index].tolist())
+
+#-------------------------------------------------------------------------------
+# Name:        buildQueryTable
+# Purpose:     Internal function that adds the arrays used to search a lookup table to the arrays of a lookup
+#              artifact. search_values is the running maximum of each column (see getPctileArray). It is only a
+#              copy when a lookup table is out of order, otherwise it is the breakpoints array itself.
+#              first_indexes holds, for each position, the first position with the same lookup value.
+#-------------------------------------------------------------------------------
+
+def buildQueryTable(lookup_arrays):
+
+    breakpoints = lookup_arrays["breakpoints"]
+    region_count, pctile_count, column_count = breakpoints.shape
+
+    search_values = np.maximum.accumulate(breakpoints, axis = 1)
+    if np.array_equal(search_values, breakpoints, equal_nan = True):
+        search_values = breakpoints
+
+    first_indexes = np.empty(breakpoints.shape, dtype = np.uint8)
+    for region_index in range(region_count):
+        for column_index in range(column_count):
+            first_indexes[region_index, :, column_index] = EJScreenTool.getFirstIndexes(breakpoints[region_index, :, column_index])
+
+    return({"regions": [str(region) for region in lookup_arrays["regions"]],
+            "columns": list(lookup_arrays["columns"]),
+            "region_indexes": {str(region): index for index, region in enumerate(lookup_arrays["regions"])},
+            "column_indexes": {column: index for index, column in enumerate(lookup_arrays["columns"])},
+            "region_index": pd.Index([str(region) for region in lookup_arrays["regions"]]),
+            "column_index": pd.Index(lookup_arrays["columns"]),
+            "breakpoints": breakpoints,
+            "search_values": search_values,
+            "first_indexes": first_indexes})
+
+#-------------------------------------------------------------------------------
+# Name:        getTablePctiles
+# Purpose:     Internal function that finds the percentiles of values that may each have a different region and
+#              column of one lookup table. It is a binary search that runs on all values at once, followed by the
+#              fall back and tie steps of getPctileArray, so the results are the same as getPctileArray.
+#-------------------------------------------------------------------------------
+
+def getTablePctiles(table, region_indexes, column_indexes, values):
+
+    search_values = table["search_values"]
+    pctile_count = search_values.shape[1]
+
+    #first position whose search value is >= the value, as np.searchsorted(side = "left")
+    low = np.zeros(len(values), dtype = np.int64)
+    high = np.full(len(values), pctile_count, dtype = np.int64)
+
+    searching = low < high
+    while searching.any():
+        middle = (low + high) // 2
+        go_right = searching & (search_values[region_indexes, np.minimum(middle, pctile_count - 1), column_indexes] < values)
+        low = np.where(go_right, middle + 1, low)
+        high = np.where(searching & ~go_right, middle, high)
+        searching = low < high
+
+    above_max = low >= pctile_count
+    lookup_index = np.where(above_max, pctile_count - 1, low)
+
+    #Fall back one percentile (unless the value is equal to the lookup table value)
+    fall_back = (lookup_index > 0) & (table["breakpoints"][region_indexes, lookup_index, column_indexes] != values) & ~above_max
+    lookup_index = lookup_index - fall_back
+
+    pctiles = table["first_indexes"][region_indexes, lookup_index, column_indexes].astype(float)
+    pctiles[np.isnan(values)] = np.nan
+
+    return(pctiles)
+
+#-------------------------------------------------------------------------------
+# Name:        makeHandler
+# Purpose:     Internal function that returns the request handler class of the HTTP front end. Endpoints:
+#                GET /info - the regions and indicators that can be queried
+#                GET /percentile?indicator=PM25&region=NC&value=8.1 - one query
+#                POST /batch - many queries. The body is {"indicator": [...], "region": [...], "value": [...]} and
+#                              the response is {"percentile": [...], "bin": [...], "text": [...]}
+#              NA values are sent and returned as null. Invalid queries return status 400 with {"error": message}.
+#-------------------------------------------------------------------------------
+
+def makeHandler(lookups):
+
+    class QueryHandler(BaseHTTPRequestHandler):
+
+        #keep connections open between requests, and send small responses without waiting for the client's
+        #acknowledgement of the headers
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+
+            url = urlparse(self.path)
+
+            if url.path == "/info":
+                self.sendJson(200, {"regions": lookups.regions, "indicators": lookups.indicators})
+            elif url.path == "/percentile":
+                parameters = {name: values[0] for name, values in parse_qs(url.query).items()}
+                try:
+                    value = float(parameters.get("value", "nan"))
+                    result = lookups.query(parameters["indicator"], parameters["region"], value)
+                except KeyError as error:
+                    self.sendJson(400, {"error": "Missing parameter " + str(error)})
+                except ValueError as error:
+                    self.sendJson(400, {"error": str(error)})
+                else:
+                    self.sendJson(200, {"indicator": parameters["indicator"], "region": parameters["region"], "value": None if math.isnan(value) else value, **result})
+            else:
+                self.sendJson(404, {"error": "Unknown path " + url.path})
+
+        def do_POST(self):
+
+            if urlparse(self.path).path != "/batch":
+                self.sendJson(404, {"error": "Unknown path " + self.path})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                values = [float("nan") if value is None else value for value in body["value"]]
+                results = lookups.queryBatch(body["indicator"], body["region"], values)
+            except KeyError as error:
+                self.sendJson(400, {"error": "Missing field " + str(error)})
+            except (ValueError, TypeError) as error:
+                self.sendJson(400, {"error": str(error)})
+            else:
+                self.sendJson(200, {"percentile": toJsonList(results["percentile"]),
+                                    "bin": toJsonList(results["bin"]),
+                                    "text": results["text"].tolist()})
+
+        def sendJson(self, status, content):
+
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+
+            #one line per request would slow the server down and fill the console
+            pass
+
+    return(QueryHandler)
+
+#-------------------------------------------------------------------------------
+# Name:        toJsonList
+# Purpose:     Internal function that converts an array of whole numbers with NaN to a list of integers and None.
+#-------------------------------------------------------------------------------
+
+def toJsonList(values):
+
+    return([None if math.isnan(value) else int(value) for value in values.tolist()])
+
+#-------------------------------------------------------------------------------
+# Name:        makeServer
+# Purpose:     Returns an HTTP server that answers queries from a PercentileQuery. Call serve_forever() to start it,
+#              and shutdown() from another thread to stop it. Port 0 picks a free port (see server_address).
+#              The server only listens on this machine unless another host is given.
+#-------------------------------------------------------------------------------
+
+def makeServer(lookups, host = "127.0.0.1", port = 8080):
+
+    return(ThreadingHTTPServer((host, port), makeHandler(lookups)))
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Serve percentile queries from EJScreen lookup artifacts over HTTP.")
+    parser.add_argument("artifacts", nargs = "+", help = "national and/or state lookup artifacts (.npz)")
+    parser.add_argument("--host", default = "127.0.0.1", help = "address to listen on")
+    parser.add_argument("--port", type = int, default = 8080, help = "port to listen on")
+    args = parser.parse_args(argv)
+
+    lookups = PercentileQuery(args.artifacts)
+    server = makeServer(lookups, args.host, args.port)
+
+    print("Serving " + str(len(lookups.indicators)) + " indicators in " + str(len(lookups.regions)) + " regions on http://" + args.host + ":" + str(server.server_address[1]))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#****************************************************************************************
+# Name:        ejscreen_store
+# Purpose:     Read records of an EJScreen dataset by ID or by state from a dataset store (.npz) written by an
+#              EJScreen run, without loading the dataset.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   pandas/numpy: columns are read as arrays of the memory mapped store and returned as data frames
+#   EJScreenTool: the store is written by saveDatasetStore, and its arrays are found with readArrayHeader
+#   argparse/json: command line options and output
+#   mmap/zipfile: the store file is memory mapped once and its arrays are found from its zip entries
+#   threading: arrays are found on first use, one thread at a time
+#
+# Usage:
+#   python ejscreen_store.py data/EJSCREEN_Full.npz 010010201001 010010201002 --columns ID,P_PM25,T_PM25
+#   python ejscreen_store.py data/EJSCREEN_Full.npz --state NC
+#
+#****************************************************************************************
+
+import pandas as pd
+import numpy as np
+import EJScreenTool
+import argparse
+import json
+import mmap
+import threading
+import zipfile
+
+#-------------------------------------------------------------------------------
+# Name:        DatasetStore
+# Purpose:     Reads records of a dataset store (see EJScreenTool.saveDatasetStore). The store file is memory mapped
+#              read-only, so opening it reads only the zip directory and a few small arrays, a record reads only the
+#              pages of its row, and processes that open the same store share one copy in the page cache. Each
+#              array is found the first time it is used. IDs are looked up by binary search of the sorted ID index.
+#
+#              Usage:
+#                  store = DatasetStore("data/EJSCREEN_Full.npz")
+#                  store.record("010010201001")
+#                  store.records(["010010201001", "010010201002"], ["ID", "P_PM25", "T_PM25"])
+#                  store.state("NC")
+#
+# Parameters:
+#   store_path - path to a dataset store (.npz) written by an EJScreen run, e.g. with an output_csv ending in .npz
+#-------------------------------------------------------------------------------
+
+class DatasetStore:
+
+    def __init__(self, store_path):
+
+        self.store_path = store_path
+        self.arrays = {}
+        self.column_arrays = {}
+        self.record_plans = {}
+        self.text_values = {}
+        self.lock = threading.Lock()
+
+        with open(store_path, "rb") as store_file:
+            self.map = mmap.mmap(store_file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        with zipfile.ZipFile(store_path) as store_zip:
+            self.entries = {entry.filename[:-len(".npy")]: entry for entry in store_zip.infolist()}
+
+        version = int(self.array("version"))
+        if version > EJScreenTool.dataset_store_version:
+            raise ValueError(store_path + " is dataset store version " + str(version) + ", this tool reads version " + str(EJScreenTool.dataset_store_version) + " or lower")
+
+        self.columns = self.array("columns").tolist()
+        self.column_types = self.array("column_types").tolist()
+        self.column_blocks = self.array("column_blocks").tolist()
+        self.column_positions = self.array("column_positions").tolist()
+        self.column_numbers = {col: i for i, col in enumerate(self.columns)}
+        self.id_column = str(self.array("id_column"))
+        self.group_column = str(self.array("group_column"))
+        self.groups = self.array("groups").tolist()
+
+    def __len__(self):
+        return(len(self.array("index_rows")))
+
+    #---------------------------------------------------------------------------
+    # Name:        array
+    # Purpose:     Returns one array of the store as a read-only view of the memory map. Uncompressed .npz entries
+    #              are .npy files, so the data of each starts right after its header.
+    #---------------------------------------------------------------------------
+
+    def array(self, name):
+
+        if name not in self.arrays:
+            with self.lock:
+                entry = self.entries[name]
+                if entry.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError(self.store_path + " is compressed and cannot be memory mapped")
+
+                offset, shape, fortran_order, dtype = EJScreenTool.readArrayHeader(self.map, entry)
+                self.arrays[name] = np.ndarray(shape, dtype = dtype, buffer = self.map, offset = offset, order = "F" if fortran_order else "C")
+
+        return(self.arrays[name])
+
+    #---------------------------------------------------------------------------
+    # Name:        rows
+    # Purpose:     Returns the row of each ID in the store, or -1 for IDs that are not in it.
+    #---------------------------------------------------------------------------
+
+    def rows(self, ids):
+
+        ids = np.asarray(ids).astype(str)
+        index_ids = self.array("index_ids")
+
+        if len(index_ids) == 0:
+            return(np.full(len(ids), -1, dtype = np.int64))
+
+        positions = np.minimum(np.searchsorted(index_ids, ids), len(index_ids) - 1)
+        found = index_ids[positions] == ids
+
+        return(np.where(found, self.array("index_rows")[positions], -1))
+
+    #---------------------------------------------------------------------------
+    # Name:        record
+    # Purpose:     Returns the record of one ID as a dictionary of column values. Text values are str, numbers are
+    #              Python numbers (NaN when missing), and NA text or nullable values are None. Raises KeyError for
+    #              an ID that is not in the store.
+    #---------------------------------------------------------------------------
+
+    def record(self, record_id, columns = None):
+
+        record_id = str(record_id)
+        index_ids = self.array("index_ids")
+
+        position = index_ids.searchsorted(record_id)
+        if position == len(index_ids) or index_ids[position] != record_id:
+            raise KeyError(record_id)
+
+        row = int(self.array("index_rows")[position])
+        block_reads, column_order, text_columns, mask_columns, id_columns = self.getRecordPlan(columns)
+
+        #the values of each block are read in one step and put in column order, then codes are replaced by labels
+        block_values = []
+        for block_array, positions in block_reads:
+            block_values += (block_array[row] if positions is None else block_array[row, positions]).tolist()
+
+        values = [block_values[i] for i in column_order]
+
+        for i, labels in text_columns:
+            values[i] = None if values[i] < 0 else labels[values[i]]
+
+        for i, mask in mask_columns:
+            if mask[row]:
+                values[i] = None
+
+        for i in id_columns:
+            values[i] = record_id
+
+        return(dict(zip(self.columns if columns is None else columns, values)))
+
+    #---------------------------------------------------------------------------
+    # Name:        records
+    # Purpose:     Returns a data frame of the records of a list of IDs, in the order of the list. IDs that are not in
+    #              the store are left out.
+    #---------------------------------------------------------------------------
+
+    def records(self, ids, columns = None):
+
+        rows = self.rows(ids)
+
+        return(self.take(rows[rows >= 0], columns))
+
+    #---------------------------------------------------------------------------
+    # Name:        state
+    # Purpose:     Returns a data frame of the records of one state (one value of the store's group column,
+    #              ST_ABBREV by default), in dataset order. Raises KeyError for a state that is not in the store.
+    #---------------------------------------------------------------------------
+
+    def state(self, region, columns = None):
+
+        if region not in self.groups:
+            raise KeyError(region)
+
+        group_number = self.groups.index(region)
+        group_offsets = self.array("group_offsets")
+
+        return(self.take(self.array("group_rows")[group_offsets[group_number]:group_offsets[group_number + 1]], columns))
+
+    #---------------------------------------------------------------------------
+    # Name:        take
+    # Purpose:     Returns a data frame of the given rows (an array of row numbers, or slice(None) for every row) 
+    #              with the column types of the dataset. The rows of each block are read once.
+    #---------------------------------------------------------------------------
+
+    def take(self, rows, columns = None):
+
+        columns = self.columns if columns is None else columns
+        block_rows = {}
+        data = {}
+
+        for col in columns:
+
+            column_type, block, position, labels, mask = self.getColumn(col)
+
+            if block not in block_rows:
+                block_rows[block] = self.array("block_" + str(block))[rows]
+            values = block_rows[block][:, position]
+
+            if column_type == "category":
+                data[col] = pd.Categorical.from_codes(values, dtype = self.text_values[col])
+            elif column_type == "text":
+                #NA codes are -1, so they take the NaN after the last label
+                data[col] = self.text_values[col][values]
+            elif column_type == "id":
+                data[col] = self.array("index_ids")[values].astype(object)
+            elif mask is not None:
+                data[col] = pd.api.types.pandas_dtype(column_type).construct_array_type()(np.array(values), np.array(mask[rows]))
+            else:
+                data[col] = values
+
+        return(pd.DataFrame(data, columns = columns))
+
+    #---------------------------------------------------------------------------
+    # Name:        column
+    # Purpose:     Returns one column of every row as a Series.
+    #---------------------------------------------------------------------------
+
+    def column(self, col):
+
+        return(self.take(slice(None), [col])[col])
+
+    #---------------------------------------------------------------------------
+    # Name:        getRecordPlan
+    # Purpose:     Returns how record reads a list of columns (None for every column): the blocks to read, each with 
+    #              the positions of the columns in it (None for the whole row), where each column is in the values
+    #              read, the (index, labels) of text and category columns, the (index, mask) of nullable columns and
+    #              the indexes of the ID column. Plans are kept for the next records.
+    #---------------------------------------------------------------------------
+
+    def getRecordPlan(self, columns):
+
+        plan_key = None if columns is None else tuple(columns)
+
+        if plan_key not in self.record_plans:
+
+            columns = self.columns if columns is None else columns
+            block_positions = {}
+            text_columns = []
+            mask_columns = []
+            id_columns = []
+
+            for i, col in enumerate(columns):
+
+                column_type, block, position, labels, mask = self.getColumn(col)
+                block_positions.setdefault(block, {})[position] = None
+
+                if labels is not None:
+                    text_columns.append((i, labels))
+                elif mask is not None:
+                    mask_columns.append((i, mask))
+                elif column_type == "id":
+                    id_columns.append(i)
+
+            block_reads = []
+            read_index = {}
+            for block, positions in block_positions.items():
+                positions = list(positions)
+                block_array = self.array("block_" + str(block))
+                for position in positions:
+                    read_index[(block, position)] = len(read_index)
+                block_reads.append((block_array, None if positions == list(range(block_array.shape[1])) else np.array(positions)))
+
+            column_order = [read_index[self.getColumn(col)[1:3]] for col in columns]
+
+            self.record_plans[plan_key] = (block_reads, column_order, text_columns, mask_columns, id_columns)
+
+        return(self.record_plans[plan_key])
+
+    #---------------------------------------------------------------------------
+    # Name:        getColumn
+    # Purpose:     Returns the type, block, position in the block, labels (a list, for text and category columns) and
+    #              NA mask (for nullable columns) of one column, found once and kept for the next records.
+    #---------------------------------------------------------------------------
+
+    def getColumn(self, col):
+
+        if col not in self.column_arrays:
+
+            number = self.column_numbers[col]
+            labels = self.array("labels_" + str(number)).tolist() if ("labels_" + str(number)) in self.entries else None
+            mask = self.array("mask_" + str(number)) if ("mask_" + str(number)) in self.entries else None
+
+            #the values of text columns and the type of category columns are built once for take
+            if self.column_types[number] == "text":
+                self.text_values[col] = np.array(labels + [np.nan], dtype = object)
+            elif self.column_types[number] == "category":
+                self.text_values[col] = pd.CategoricalDtype(labels)
+
+            self.column_arrays[col] = (self.column_types[number], self.column_blocks[number], self.column_positions[number], labels, mask)
+
+        return(self.column_arrays[col])
+
+def main(argv = None):
+
+    parser = argparse.ArgumentParser(description = "Read EJScreen records from a dataset store.")
+    parser.add_argument("store", help = "dataset store (.npz) written by an EJScreen run")
+    parser.add_argument("ids", nargs = "*", help = "IDs of the records to read")
+    parser.add_argument("--state", help = "read every record of this state instead")
+    parser.add_argument("--columns", help = "comma separated columns to read. By default every column is read")
+    args = parser.parse_args(argv)
+
+    store = DatasetStore(args.store)
+    columns = args.columns.split(",") if args.columns else None
+
+    if args.state:
+        records = store.state(args.state, columns)
+    else:
+        records = store.records(args.ids, columns)
+        missing = [record_id for record_id, row in zip(args.ids, store.rows(args.ids)) if row < 0]
+        if len(missing) > 0:
+            print("Not found: " + ", ".join(missing))
+
+    for record in json.loads(records.to_json(orient = "records")):
+        print(json.dumps(record))
+
+if __name__ == "__main__":
+    main()
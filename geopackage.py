@@ -0,0 +1,229 @@
+#****************************************************************************************
+# Name:        geopackage
+# Purpose:     Read and write GeoPackage feature tables in batches with the Python standard library, so the
+#              EJScreen dataset can be joined to geometry and exported without ArcGIS Pro. Geometry is copied
+#              as the GeoPackage binary it is stored in and is never decoded.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   sqlite3: a GeoPackage is a SQLite database
+#   csv: reads the Batch Update Fields schema csv
+#   datetime: time stamp of the output table in gpkg_contents
+#   os: paths of the input and output GeoPackages
+#
+#****************************************************************************************
+
+import csv
+import datetime
+import os
+import sqlite3
+
+#GeoPackage data type of each field type of the Batch Update Fields schema
+schema_types = {"text": "TEXT", "short": "SMALLINT", "long": "MEDIUMINT", "biginteger": "INTEGER",
+                "float": "FLOAT", "double": "DOUBLE", "date": "DATETIME"}
+
+#-------------------------------------------------------------------------------
+# Name:        splitPath
+# Purpose:     Split a path such as "data/BlockGroups.gpkg/BlockGroups" into the GeoPackage file and the layer name.
+#              The layer is None when the path is only the file.
+#-------------------------------------------------------------------------------
+
+def splitPath(path):
+
+    file_end = path.lower().rfind(".gpkg") + len(".gpkg")
+    layer = path[file_end:].strip("/\\")
+
+    return(path[:file_end], layer if layer != "" else None)
+
+#-------------------------------------------------------------------------------
+# Name:        isGeoPackage
+# Purpose:     Whether a path is a GeoPackage file, or a layer in one.
+#-------------------------------------------------------------------------------
+
+def isGeoPackage(path):
+
+    return(".gpkg" in str(path).lower())
+
+#-------------------------------------------------------------------------------
+# Name:        openGeoPackage
+# Purpose:     Open an existing GeoPackage to read it. Raises FileNotFoundError rather than creating an empty database.
+#-------------------------------------------------------------------------------
+
+def openGeoPackage(path):
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError("GeoPackage not found: " + path)
+
+    return(sqlite3.connect(path))
+
+#-------------------------------------------------------------------------------
+# Name:        readLayerInfo
+# Purpose:     Returns a dictionary that describes a feature table: its name, primary key, geometry column,
+#              geometry type, spatial reference, extent, and the name and declared type of every attribute.
+#              The first feature table is used when layer is None.
+#-------------------------------------------------------------------------------
+
+def readLayerInfo(connection, layer = None):
+
+    query = "SELECT table_name, min_x, min_y, max_x, max_y, srs_id FROM gpkg_contents WHERE data_type = 'features'"
+    if layer is None:
+        contents = connection.execute(query + " ORDER BY rowid LIMIT 1").fetchone()
+    else:
+        contents = connection.execute(query + " AND table_name = ?", (layer,)).fetchone()
+
+    if contents is None:
+        raise ValueError("No feature table " + (layer if layer is not None else "") + " in the GeoPackage")
+
+    table = contents[0]
+    geometry = connection.execute("SELECT column_name, geometry_type_name, srs_id, z, m FROM gpkg_geometry_columns WHERE table_name = ?", (table,)).fetchone()
+
+    columns = connection.execute("SELECT name, type, pk FROM pragma_table_info(?) ORDER BY cid", (table,)).fetchall()
+    primary_key = [name for name, column_type, pk in columns if pk == 1][0]
+
+    return({"table": table,
+            "primary_key": primary_key,
+            "geometry_column": geometry[0],
+            "geometry_type": geometry[1],
+            "srs_id": geometry[2],
+            "z": geometry[3],
+            "m": geometry[4],
+            "extent": contents[1:5],
+            "fields": [(name, column_type) for name, column_type, pk in columns if name not in (primary_key, geometry[0])]})
+
+#-------------------------------------------------------------------------------
+# Name:        readFeatures
+# Purpose:     Generator that reads the geometry and the requested attributes of a feature table, batch_size rows
+#              at a time in primary key order. Each batch is a list of (geometry, attribute, ...) tuples.
+#-------------------------------------------------------------------------------
+
+def readFeatures(connection, layer_info, field_names, batch_size = 10000):
+
+    columns = [layer_info["geometry_column"]] + list(field_names)
+    cursor = connection.execute("SELECT " + ", ".join(quoteName(col) for col in columns) + " FROM " + quoteName(layer_info["table"]) + " ORDER BY " + quoteName(layer_info["primary_key"]))
+
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if len(batch) == 0:
+            return
+        yield batch
+
+#-------------------------------------------------------------------------------
+# Name:        readSchema
+# Purpose:     Read a Batch Update Fields schema csv (Target field, Source field, Type, Decimals/Length, Alias).
+#              Returns a list of (target, source, GeoPackage type, alias), in the order of the output fields.
+#              Text fields with a length become TEXT(length).
+#-------------------------------------------------------------------------------
+
+def readSchema(schema_path):
+
+    fields = []
+
+    with open(schema_path, newline = "") as schema_file:
+        for row in csv.DictReader(schema_file):
+
+            field_type = schema_types[row["Type"].strip().lower()]
+            if field_type == "TEXT" and row["Decimals/Length"].strip() != "":
+                field_type += "(" + row["Decimals/Length"].strip() + ")"
+
+            fields.append((row["Target field"], row["Source field"], field_type, row["Alias"]))
+
+    return(fields)
+
+#-------------------------------------------------------------------------------
+# Name:        createGeoPackage
+# Purpose:     Create a new GeoPackage with one empty feature table. Any existing file is replaced. The table has
+#              the geometry type, spatial reference and extent of layer_info, and `fields`, a list of
+#              (name, GeoPackage type, alias). Aliases that differ from the field name are stored as titles with
+#              the GeoPackage schema extension. Returns the open connection.
+#-------------------------------------------------------------------------------
+
+def createGeoPackage(output_path, table, source_connection, layer_info, fields):
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    connection = sqlite3.connect(output_path)
+
+    #a partly written file is replaced by the next run, so writes do not wait for the disk
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.execute("PRAGMA application_id = 1196444487")
+    connection.execute("PRAGMA user_version = 10200")
+
+    connection.executescript("""
+        CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+        CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+            description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+            CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+        CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+            CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+            CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+            CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id));
+        CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL,
+            scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name));
+        CREATE TABLE gpkg_data_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, name TEXT, title TEXT,
+            description TEXT, mime_type TEXT, constraint_name TEXT,
+            CONSTRAINT pk_gdc PRIMARY KEY (table_name, column_name),
+            CONSTRAINT gdc_tn UNIQUE (table_name, name));
+        CREATE TABLE gpkg_data_column_constraints (constraint_name TEXT NOT NULL, constraint_type TEXT NOT NULL, value TEXT,
+            min NUMERIC, min_is_inclusive BOOLEAN, max NUMERIC, max_is_inclusive BOOLEAN, description TEXT,
+            CONSTRAINT gdcc_ntv UNIQUE (constraint_name, constraint_type, value));
+    """)
+
+    #the required spatial references, and the spatial reference of the source layer
+    connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+        ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", "undefined cartesian coordinate reference system"),
+        ("Undefined geographic SRS", 0, "NONE", 0, "undefined", "undefined geographic coordinate reference system"),
+        ("WGS 84 geodetic", 4326, "EPSG", 4326, 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]', "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid")])
+
+    source_srs = source_connection.execute("SELECT srs_name, srs_id, organization, organization_coordsys_id, definition, description FROM gpkg_spatial_ref_sys WHERE srs_id = ?", (layer_info["srs_id"],)).fetchone()
+    if source_srs is not None:
+        connection.execute("INSERT OR REPLACE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", source_srs)
+
+    geometry_column = layer_info["geometry_column"]
+    field_definitions = ["fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL", quoteName(geometry_column) + " " + layer_info["geometry_type"]]
+    field_definitions += [quoteName(name) + " " + field_type for name, field_type, alias in fields]
+
+    connection.execute("CREATE TABLE " + quoteName(table) + " (" + ", ".join(field_definitions) + ")")
+    connection.execute("INSERT INTO gpkg_contents VALUES (?, 'features', ?, '', ?, ?, ?, ?, ?, ?)",
+                       (table, table, datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z", *layer_info["extent"], layer_info["srs_id"]))
+    connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)",
+                       (table, geometry_column, layer_info["geometry_type"], layer_info["srs_id"], layer_info["z"], layer_info["m"]))
+
+    titles = [(table, name, name, alias) for name, field_type, alias in fields if alias not in ("", name)]
+    if len(titles) > 0:
+        connection.executemany("INSERT INTO gpkg_data_columns (table_name, column_name, name, title) VALUES (?, ?, ?, ?)", titles)
+        connection.executemany("INSERT INTO gpkg_extensions VALUES (?, NULL, ?, ?, 'read-write')",
+                               [("gpkg_data_columns", "gpkg_schema", "http://www.geopackage.org/spec/#extension_schema"),
+                                ("gpkg_data_column_constraints", "gpkg_schema", "http://www.geopackage.org/spec/#extension_schema")])
+
+    connection.commit()
+
+    return(connection)
+
+#-------------------------------------------------------------------------------
+# Name:        writeFeatures
+# Purpose:     Insert a batch of rows, each (geometry, field value, ...), into a table in one transaction.
+#-------------------------------------------------------------------------------
+
+def writeFeatures(connection, table, geometry_column, field_names, rows):
+
+    columns = [geometry_column] + list(field_names)
+
+    with connection:
+        connection.executemany("INSERT INTO " + quoteName(table) + " (" + ", ".join(quoteName(col) for col in columns) + ") VALUES (" + ", ".join(["?"] * len(columns)) + ")", rows)
+
+#-------------------------------------------------------------------------------
+# Name:        quoteName
+# Purpose:     Internal function that quotes a table or column name for SQL.
+#-------------------------------------------------------------------------------
+
+def quoteName(name):
+
+    return('"' + str(name).replace('"', '""') + '"')
@@ -0,0 +1,293 @@
+#****************************************************************************************
+# Name:        run_report
+# Purpose:     Record the wall time, CPU time, peak memory and throughput of each stage of an EJScreen run
+#              and write them to a JSON run report.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   contextlib: stages and steps are timed with context managers
+#   cProfile: default profiler that can be attached to a single stage
+#   json: the run report is written as JSON
+#   os/sys/time: wall time, CPU time and memory of the process
+#   datetime: start time of the run
+#   resource: peak memory on Linux and macOS. Not available on Windows
+#   psutil: optional. Used for peak memory on Windows when it is installed
+#
+#****************************************************************************************
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#-------------------------------------------------------------------------------
+# Name:        RunReport
+# Purpose:     Collects one record per pipeline stage. Each record has the wall time, CPU time (including worker
+#              processes that finished during the stage), peak resident memory, and rows per second of the stage.
+#              With `detail` set to True, the time of each column and state inside a stage is recorded as well.
+#
+#              Usage:
+#                  report = RunReport()
+#                  with report.stage("ingest") as record:
+#                      df = readInput(...)
+#                      record["rows"] = len(df)
+#                  report.write("run_report.json")
+#
+# Parameters:
+#   detail - (True/False) whether per-column and per-state times are recorded
+#   verbose - (True/False) whether a summary line is printed when each stage ends
+#   profile_stage - optional name of one stage to profile
+#   profile_hook - optional function that takes the stage name and returns a context manager, used to attach
+#                  another profiler (e.g. a sampling profiler) to profile_stage. Defaults to cProfile
+#   profile_path - path of the cProfile stats file. Defaults to "<profile_stage>.prof"
+#-------------------------------------------------------------------------------
+
+class RunReport:
+
+    def __init__(self, detail = False, verbose = True, profile_stage = None, profile_hook = None, profile_path = ""):
+
+        self.detail_enabled = detail
+        self.verbose = verbose
+        self.profile_stage = profile_stage
+        self.profile_hook = profile_hook
+        self.profile_path = profile_path or (str(profile_stage) + ".prof")
+
+        self.started = datetime.datetime.now().isoformat(timespec = "seconds")
+        self.start_time = time.perf_counter()
+        self.info = {}
+        self.stages = []
+        self.current = None
+
+    #---------------------------------------------------------------------------
+    # Name:        stage
+    # Purpose:     Context manager that measures one stage. Yields the stage record, so `rows` and other values
+    #              can be set on it while the stage runs.
+    #---------------------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def stage(self, name, rows = None):
+
+        record = {"stage": name, "rows": rows}
+        if self.detail_enabled:
+            record["detail"] = []
+
+        parent = self.current
+        self.current = record
+
+        resetPeakRss()
+        wall_start = time.perf_counter()
+        cpu_start = getCpuSeconds()
+
+        try:
+            if name == self.profile_stage:
+                hook = self.profile_hook or cProfileHook(self.profile_path)
+                with hook(name):
+                    yield record
+                record["profile"] = self.profile_path if self.profile_hook is None else "custom"
+            else:
+                yield record
+        finally:
+            record["wall_seconds"] = round(time.perf_counter() - wall_start, 4)
+            record["cpu_seconds"] = round(getCpuSeconds() - cpu_start, 4)
+            record["peak_rss_mb"] = getPeakRss()
+            record["peak_worker_rss_mb"] = getPeakChildRss()
+            if record["rows"] and record["wall_seconds"] > 0:
+                record["rows_per_second"] = round(record["rows"] / record["wall_seconds"])
+
+            self.current = parent
+            self.stages.append(record)
+
+            if self.verbose:
+                print(formatStage(record))
+
+    #---------------------------------------------------------------------------
+    # Name:        step
+    # Purpose:     Context manager that times one column, state or other step of the current stage.
+    #              Nothing is recorded unless `detail` is True.
+    #---------------------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def step(self, name, rows = None, kind = "step"):
+
+        if not self.detail_enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.detail(name, time.perf_counter() - start, rows, kind)
+
+    #---------------------------------------------------------------------------
+    # Name:        detail
+    # Purpose:     Record the time of a column, state or other step of the current stage that was measured
+    #              elsewhere (e.g. in a worker process). `kind` is "column", "state" or "step".
+    #              Nothing is recorded unless `detail` is True.
+    #---------------------------------------------------------------------------
+
+    def detail(self, name, seconds, rows = None, kind = "step"):
+
+        if not self.detail_enabled or self.current is None:
+            return
+
+        entry = {"name": str(name), "type": kind, "wall_seconds": round(float(seconds), 4)}
+        if rows is not None:
+            entry["rows"] = int(rows)
+
+        self.current["detail"].append(entry)
+
+    #---------------------------------------------------------------------------
+    # Name:        note
+    # Purpose:     Record an extra value (e.g. the columns read from a cache) on the current stage.
+    #---------------------------------------------------------------------------
+
+    def note(self, name, value):
+
+        if self.current is not None:
+            self.current[name] = value
+
+    #---------------------------------------------------------------------------
+    # Name:        toDict
+    # Purpose:     Return the run report as a dictionary.
+    #---------------------------------------------------------------------------
+
+    def toDict(self):
+
+        return({"started": self.started,
+                "total_wall_seconds": round(time.perf_counter() - self.start_time, 4),
+                "peak_rss_mb": max([stage["peak_rss_mb"] for stage in self.stages if stage["peak_rss_mb"] is not None], default = getPeakRss()),
+                "python": sys.version.split()[0],
+                **self.info,
+                "stages": self.stages})
+
+    #---------------------------------------------------------------------------
+    # Name:        write
+    # Purpose:     Write the run report to a JSON file.
+    #---------------------------------------------------------------------------
+
+    def write(self, output_path):
+
+        with open(output_path, "w") as report_file:
+            json.dump(self.toDict(), report_file, indent = 2, default = str)
+
+#-------------------------------------------------------------------------------
+# Name:        cProfileHook
+# Purpose:     Returns a profile hook that runs cProfile during a stage and writes the stats to output_path.
+#              The stats can be read with `python -m pstats <output_path>` or snakeviz.
+#-------------------------------------------------------------------------------
+
+def cProfileHook(output_path):
+
+    @contextlib.contextmanager
+    def hook(stage_name):
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(output_path)
+
+    return(hook)
+
+#-------------------------------------------------------------------------------
+# Name:        formatStage
+# Purpose:     Internal function that formats the summary line printed at the end of a stage.
+#-------------------------------------------------------------------------------
+
+def formatStage(record):
+
+    line = record["stage"] + ": " + format(record["wall_seconds"], ".2f") + " s wall, " + format(record["cpu_seconds"], ".2f") + " s cpu"
+
+    if record["peak_rss_mb"] is not None:
+        line += ", " + format(record["peak_rss_mb"], ",.0f") + " MB peak"
+
+    if "rows_per_second" in record:
+        line += ", " + format(record["rows_per_second"], ",") + " rows/s"
+
+    return(line)
+
+#-------------------------------------------------------------------------------
+# Name:        getCpuSeconds
+# Purpose:     Internal function that returns the CPU time of this process and of the worker processes that
+#              have finished. Worker CPU time is not available on Windows.
+#-------------------------------------------------------------------------------
+
+def getCpuSeconds():
+
+    times = os.times()
+
+    return(times.user + times.system + times.children_user + times.children_system)
+
+#-------------------------------------------------------------------------------
+# Name:        resetPeakRss
+# Purpose:     Internal function that resets the peak resident memory of this process, so the peak of each stage
+#              can be measured. Only Linux supports this. Elsewhere the peak is the peak of the whole run so far.
+#-------------------------------------------------------------------------------
+
+def resetPeakRss():
+
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+#-------------------------------------------------------------------------------
+# Name:        getPeakRss
+# Purpose:     Internal function that returns the peak resident memory of this process in MB, or None if it
+#              cannot be measured. On Linux this is the peak since the last resetPeakRss.
+#-------------------------------------------------------------------------------
+
+def getPeakRss():
+
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return(round(int(line.split()[1]) / 1024, 1))
+    except OSError:
+        pass
+
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        #macOS reports bytes, Linux reports kilobytes
+        return(round(peak / (2**20 if sys.platform == "darwin" else 1024), 1))
+
+    try:
+        import psutil
+        return(round(psutil.Process().memory_info().peak_wset / 2**20, 1))
+    except (ImportError, AttributeError):
+        return(None)
+
+#-------------------------------------------------------------------------------
+# Name:        getPeakChildRss
+# Purpose:     Internal function that returns the largest peak resident memory of any finished worker process
+#              in MB, or None if it cannot be measured or no worker has finished.
+#-------------------------------------------------------------------------------
+
+def getPeakChildRss():
+
+    if resource is None:
+        return(None)
+
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if peak == 0:
+        return(None)
+
+    return(round(peak / (2**20 if sys.platform == "darwin" else 1024), 1))
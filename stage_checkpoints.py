@@ -0,0 +1,175 @@
+#****************************************************************************************
+# Name:        stage_checkpoints
+# Purpose:     Save the output of each stage of an EJScreen run to a checkpoint directory, so a run that fails
+#              partway (e.g. while exporting to a feature class or writing the lookup table) can resume from the
+#              last completed stage instead of starting over from the input csv.
+#
+# Author:      SAIC, EPA OMS Contractor
+#
+# Created:     10/17/2026
+# Updated:     10/17/2026
+#
+# imports:
+#   hashlib/json: the checkpoints of a run are kept under a fingerprint of its input and settings
+#   os/shutil: checkpoints are written to a temporary directory that is renamed when it is complete
+#   col_names: the column lists are part of the fingerprint
+#   pyarrow: checkpoints are uncompressed Feather (Arrow IPC) files, which are read through a memory map.
+#       This package is only imported if a checkpoint directory is set.
+#
+#****************************************************************************************
+
+import hashlib
+import json
+import os
+import shutil
+import col_names
+
+#version of the checkpoint layout. Increase when the layout or the output of a stage changes, so old checkpoints are not used
+checkpoint_version = 1
+
+#-------------------------------------------------------------------------------
+# Name:        StageCheckpoints
+# Purpose:     Saves and loads the data frames each stage produces. Each stage is a directory of Feather files,
+#              one per data frame, in `<checkpoint_dir>/<fingerprint>/`. A stage directory is written under a
+#              temporary name and renamed when every file is written, so a stage is either complete or missing.
+#              With checkpoint_dir set to "" nothing is saved or loaded.
+#
+#              Usage:
+#                  checkpoints = StageCheckpoints("checkpoints", getFingerprint("input.csv", "national"), resume = True)
+#                  stage, frames = checkpoints.loadLatest(["percentiles", "bins"])
+#                  if stage is None:
+#                      checkpoints.save("percentiles", {"data": df})
+#
+# Parameters:
+#   checkpoint_dir - directory that holds the checkpoints, or "" to turn checkpoints off
+#   fingerprint - key of the run, from getFingerprint. Runs with a different input or settings do not share checkpoints
+#   resume - (True/False) whether loadLatest returns the checkpoints of an earlier run. When False, the run starts
+#            from the beginning and replaces them
+#-------------------------------------------------------------------------------
+
+class StageCheckpoints:
+
+    def __init__(self, checkpoint_dir = "", fingerprint = "", resume = False):
+
+        self.enabled = checkpoint_dir != ""
+        self.resume = resume
+        self.run_dir = os.path.join(checkpoint_dir, fingerprint) if self.enabled else ""
+
+    #---------------------------------------------------------------------------
+    # Name:        save
+    # Purpose:     Save the data frames of a completed stage. `frames` is a dictionary of name to data frame.
+    #---------------------------------------------------------------------------
+
+    def save(self, stage, frames):
+
+        if not self.enabled:
+            return
+
+        from pyarrow import feather
+        import pyarrow as pa
+
+        stage_dir = os.path.join(self.run_dir, stage)
+        temp_dir = stage_dir + ".tmp"
+
+        shutil.rmtree(temp_dir, ignore_errors = True)
+        os.makedirs(temp_dir)
+
+        for name, df in frames.items():
+
+            #the index is kept as well, e.g. the PCTILE index of the lookup tables
+            feather.write_feather(pa.Table.from_pandas(df), os.path.join(temp_dir, name + ".feather"), compression = "uncompressed")
+
+        with open(os.path.join(temp_dir, "frames.json"), "w") as frames_file:
+            json.dump(sorted(frames), frames_file)
+
+        shutil.rmtree(stage_dir, ignore_errors = True)
+        os.replace(temp_dir, stage_dir)
+
+    #---------------------------------------------------------------------------
+    # Name:        isValid
+    # Purpose:     Whether a stage has a complete checkpoint. Every file the stage lists is opened to check that it
+    #              is a readable Feather file, which only reads its footer.
+    #---------------------------------------------------------------------------
+
+    def isValid(self, stage):
+
+        if not self.enabled:
+            return(False)
+
+        import pyarrow as pa
+
+        stage_dir = os.path.join(self.run_dir, stage)
+
+        try:
+            with open(os.path.join(stage_dir, "frames.json")) as frames_file:
+                names = json.load(frames_file)
+
+            for name in names:
+                with pa.memory_map(os.path.join(stage_dir, name + ".feather")) as source:
+                    pa.ipc.open_file(source)
+
+        except (OSError, ValueError, pa.ArrowException):
+            return(False)
+
+        return(True)
+
+    #---------------------------------------------------------------------------
+    # Name:        load
+    # Purpose:     Load the data frames of a stage as a dictionary of name to data frame. The files are read through
+    #              a memory map.
+    #---------------------------------------------------------------------------
+
+    def load(self, stage):
+
+        from pyarrow import feather
+
+        stage_dir = os.path.join(self.run_dir, stage)
+
+        with open(os.path.join(stage_dir, "frames.json")) as frames_file:
+            names = json.load(frames_file)
+
+        return({name: feather.read_table(os.path.join(stage_dir, name + ".feather"), memory_map = True).to_pandas() for name in names})
+
+    #---------------------------------------------------------------------------
+    # Name:        loadLatest
+    # Purpose:     Find the first stage, in run order, that is missing or invalid, and load the stage before it.
+    #              Returns the name and data frames of that stage, or (None, {}) when the run must start from the
+    #              beginning (no valid first stage, resume is False, or checkpoints are off).
+    #---------------------------------------------------------------------------
+
+    def loadLatest(self, stages):
+
+        if not self.enabled or not self.resume:
+            return(None, {})
+
+        latest = None
+        for stage in stages:
+            if not self.isValid(stage):
+                break
+            latest = stage
+
+        if latest is None:
+            return(None, {})
+
+        return(latest, self.load(latest))
+
+#-------------------------------------------------------------------------------
+# Name:        getFingerprint
+# Purpose:     Returns the key of a run's checkpoints. It changes when the input file changes (its path, size or
+#              modification time), when any column list in col_names.py changes, or when any of `settings` changes.
+#
+# Parameters:
+#   input_path - path to the input file of the run
+#   settings - any other values the checkpoints depend on, e.g. the percentile level and data type of the indicators
+#-------------------------------------------------------------------------------
+
+def getFingerprint(input_path, *settings):
+
+    input_stat = os.stat(input_path)
+
+    fingerprint = {"version": checkpoint_version,
+                   "input": [os.path.abspath(input_path), input_stat.st_size, input_stat.st_mtime_ns],
+                   "columns": [col_names.info_names, col_names.data_names, col_names.extra_cols, col_names.index_names, col_names.cols_all],
+                   "settings": [str(setting) for setting in settings]}
+
+    return(hashlib.blake2b(json.dumps(fingerprint).encode(), digest_size = 16).hexdigest())